@@ -13,6 +13,7 @@ from modules.premium_system import premium_system_app, admin_premium_management
 from modules.email_notifications import email_notifications_app
 from modules.landing_page import enhanced_landing_page
 from modules.database import initialize_databases
+from utils.retention import get_retention_job
 from modules.ui_components import apply_glassmorphism_style, set_background_image
 
 # Page configuration
@@ -25,6 +26,9 @@ st.set_page_config(
 # Initialize databases and directories
 initialize_databases()
 
+# Daily archival of aged rows (no-op until a retention policy is enabled)
+get_retention_job().start()
+
 # Apply styling
 apply_glassmorphism_style()
 try:
@@ -122,10 +126,8 @@ def dashboard_app():
 def get_active_batches_count():
     """Get count of active breeding batches"""
     try:
-        import pandas as pd
-        if os.path.exists('breeding_batches.csv'):
-            df = pd.read_csv('breeding_batches.csv')
-            return len(df)
+        from modules.breeding_management import get_batch_counters
+        return get_batch_counters()['batches']
     except:
         pass
     return 0
@@ -3,9 +3,25 @@ import numpy as np
 from PIL import Image
 import os
 import datetime
+import hashlib
 from data.butterfly_species_info import BUTTERFLY_SPECIES_INFO, LIFESTAGES_INFO, PUPAE_DEFECTS_INFO, LARVAL_DISEASES_INFO
-from utils.image_processing import process_image_for_classification
-from utils.csv_handlers import save_to_csv
+from utils.image_processing import process_image_for_classification, preprocess_image_for_classification, extract_color_features, color_features_to_vector
+from utils.feature_store import get_feature_store
+from utils.similarity_index import get_similarity_index, load_embedding_model
+from utils.csv_handlers import append_csv_record, read_csv_tail
+from utils.aggregate_counters import get_counters, record_write, source_size
+from utils.image_archive import archive_image, get_thumbnail_path, run_archive_retention, DEFAULT_HOT_RETENTION_DAYS
+from utils.image_hashing import compute_image_hashes, get_duplicate_index, DEFAULT_MAX_HAMMING_DISTANCE
+
+CLASSIFICATIONS_FILE = 'ai_classifications.csv'
+
+# Column layout of ai_classifications.csv
+CLASSIFICATION_COLUMNS = [
+    'timestamp', 'analysis_type', 'user', 'predicted_species',
+    'species_confidence', 'predicted_stage', 'stage_confidence',
+    'predicted_disease', 'disease_confidence', 'predicted_defect', 'defect_confidence',
+    'image_key'
+]
 
 def ai_classification_app():
     """AI-powered butterfly classification system"""
@@ -35,10 +51,22 @@ def ai_classification_app():
         "Pupae Defect Analysis"
     ])
     
+    # Near-duplicate detection settings
+    with st.expander("Duplicate Detection Settings"):
+        dedup_enabled = st.checkbox("Reuse results for near-duplicate images", value=True)
+        max_distance = st.slider(
+            "Maximum Hamming distance",
+            min_value=0,
+            max_value=16,
+            value=DEFAULT_MAX_HAMMING_DISTANCE,
+            help="Lower values only match near-identical shots; higher values tolerate more change"
+        )
+    
     # Image upload options
     upload_option = st.radio("Image Source", ["Upload File", "Camera Capture"])
     
     image = None
+    image_bytes = None
     if upload_option == "Upload File":
         uploaded_file = st.file_uploader(
             "Upload Butterfly Image", 
@@ -46,10 +74,12 @@ def ai_classification_app():
             help="Upload a clear image of the butterfly/larva/pupa for analysis"
         )
         if uploaded_file:
+            image_bytes = uploaded_file.getvalue()
             image = Image.open(uploaded_file)
     else:
         camera_image = st.camera_input("Take a photo")
         if camera_image:
+            image_bytes = camera_image.getvalue()
             image = Image.open(camera_image)
     
     if image:
@@ -68,11 +98,47 @@ def ai_classification_app():
             # Process button
             if st.button("🔍 Analyze Image", type="primary"):
                 with st.spinner("Processing image with AI models..."):
-                    results = perform_classification(image, analysis_type)
-                    display_results(results)
+                    duplicate = None
+                    hashes = None
+                    if dedup_enabled:
+                        hashes = hash_uploaded_image(image)
+                        if hashes:
+                            duplicate = get_duplicate_index().lookup(
+                                hashes[0], hashes[1], analysis_type, max_distance
+                            )
                     
-                    # Save analysis results
-                    save_analysis_results(results, analysis_type)
+                    if duplicate:
+                        results = duplicate['results']
+                        feature_ids = {'color': -1, 'embedding': -1}
+                    else:
+                        results = perform_classification(image, analysis_type)
+                        
+                        # Archive the original and its thumbnail, then save analysis results
+                        image_key = archive_image(image_bytes, image)
+                        save_analysis_results(results, analysis_type, image_key)
+                        feature_ids = store_image_features(image, results, analysis_type, image_key)
+                        
+                        if hashes and "error" not in results:
+                            get_duplicate_index().add(hashes[0], hashes[1], analysis_type, results)
+                    
+                    st.session_state.last_analysis = {
+                        'fingerprint': image_fingerprint(image),
+                        'results': results,
+                        'duplicate': duplicate,
+                        'feature_ids': feature_ids
+                    }
+            
+        # Results stay visible across reruns so "Find Similar Cases" can be used
+        last_analysis = st.session_state.get('last_analysis')
+        if last_analysis and last_analysis['fingerprint'] == image_fingerprint(image):
+            duplicate = last_analysis['duplicate']
+            if duplicate:
+                st.info(
+                    f"♻️ Near-duplicate of an image analyzed at {duplicate['timestamp']} "
+                    f"(distance {duplicate['distance']}). Reusing the previous result."
+                )
+            display_results(last_analysis['results'])
+            display_similar_cases(image, last_analysis)
     
     # Model information section
     st.markdown("---")
@@ -80,6 +146,12 @@ def ai_classification_app():
     
     # Recent classifications
     display_recent_classifications()
+    
+    # Stored image feature analytics
+    display_feature_analytics()
+    
+    # Archive retention (admin only)
+    display_archive_maintenance()
 
 def perform_classification(image, analysis_type):
     """Perform AI classification based on selected analysis type"""
@@ -108,6 +180,13 @@ def perform_classification(image, analysis_type):
     
     return results
 
+def hash_uploaded_image(image):
+    """Compute perceptual hashes of an uploaded image on the 180x180 model input"""
+    img_array = preprocess_image_for_classification(image)
+    if img_array is None:
+        return None
+    return compute_image_hashes(img_array)
+
 def simulate_species_classification():
     """Simulate species classification (replace with actual model)"""
     import random
@@ -225,7 +304,7 @@ def display_results(results):
         
         st.write(f"**Quality Information:** {defect_result['quality_info']}")
 
-def save_analysis_results(results, analysis_type):
+def save_analysis_results(results, analysis_type, image_key=''):
     """Save classification results to CSV"""
     import datetime
     
@@ -234,6 +313,7 @@ def save_analysis_results(results, analysis_type):
         'timestamp': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
         'analysis_type': analysis_type,
         'user': st.session_state.username,
+        'image_key': image_key,
     }
     
     # Add specific results
@@ -261,7 +341,113 @@ def save_analysis_results(results, analysis_type):
             'defect_confidence': results["defects"]["confidence"]
         })
     
-    save_to_csv('ai_classifications.csv', analysis_data)
+    # Align by column name so partial analyses don't shift into other columns
+    size_before = source_size(CLASSIFICATIONS_FILE)
+    if append_csv_record(CLASSIFICATIONS_FILE, analysis_data, CLASSIFICATION_COLUMNS):
+        record_write('ai_classifications', CLASSIFICATIONS_FILE, size_before,
+                     lambda counters: update_classification_counters(counters, analysis_data),
+                     build_classification_counters)
+
+def build_classification_counters(classifications_df):
+    """Compute classification counters from a full table scan"""
+    counters = {'total': 0, 'species': [], 'per_day': {}}
+    if classifications_df.empty:
+        return counters
+    
+    counters['total'] = len(classifications_df)
+    if 'predicted_species' in classifications_df.columns:
+        counters['species'] = sorted(classifications_df['predicted_species'].dropna().astype(str).unique().tolist())
+    days = classifications_df['timestamp'].astype(str).str[:10].value_counts()
+    counters['per_day'] = {day: int(count) for day, count in days.items()}
+    return counters
+
+def update_classification_counters(counters, analysis_data):
+    """Fold one new classification into the counters"""
+    counters['total'] += 1
+    species = analysis_data.get('predicted_species')
+    if species and species not in counters['species']:
+        counters['species'].append(species)
+    day = analysis_data['timestamp'][:10]
+    counters['per_day'][day] = counters['per_day'].get(day, 0) + 1
+
+def store_image_features(image, results, analysis_type, image_key=''):
+    """Extract color features (and model embeddings if available) and store them alongside the classification"""
+    feature_ids = {'color': -1, 'embedding': -1}
+    features = extract_color_features(image)
+    if not features:
+        return feature_ids
+    
+    metadata = {
+        'timestamp': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'user': st.session_state.username,
+        'analysis_type': analysis_type,
+        'image_key': image_key,
+    }
+    for result_key, column in [("species", 'predicted_species'), ("lifecycle", 'predicted_stage'),
+                               ("diseases", 'predicted_disease'), ("defects", 'predicted_defect')]:
+        if result_key in results:
+            metadata[column] = results[result_key]["predicted_class"]
+    
+    feature_ids['color'] = get_feature_store().append(color_features_to_vector(features), metadata)
+    
+    embedding = compute_image_embedding(image)
+    if embedding is not None:
+        index = get_similarity_index(embedding.shape[0])
+        feature_ids['embedding'] = index.store.append(embedding, metadata)
+    
+    return feature_ids
+
+_EMBEDDING_MODEL = {}
+
+def compute_image_embedding(image):
+    """Penultimate-layer embedding from the species model, or None when no model is present"""
+    if 'model' not in _EMBEDDING_MODEL:
+        _EMBEDDING_MODEL['model'] = load_embedding_model()
+    model = _EMBEDDING_MODEL['model']
+    if model is None:
+        return None
+    
+    img_array = preprocess_image_for_classification(image)
+    if img_array is None:
+        return None
+    return np.asarray(model.predict(img_array, verbose=0)[0], dtype=np.float32).ravel()
+
+def image_fingerprint(image):
+    """Content fingerprint of a decoded image, stable across Streamlit reruns"""
+    return hashlib.sha1(image.tobytes()).hexdigest()
+
+def display_similar_cases(image, last_analysis, k=5):
+    """Show past classifications whose images look similar to the analyzed one"""
+    if not st.button("🔎 Find Similar Cases"):
+        return
+    
+    feature_ids = last_analysis['feature_ids']
+    
+    embedding = compute_image_embedding(image)
+    if embedding is not None:
+        index = get_similarity_index(embedding.shape[0])
+        query, exclude = embedding, feature_ids['embedding']
+    else:
+        features = extract_color_features(image)
+        if not features:
+            return
+        index = get_similarity_index()
+        query, exclude = color_features_to_vector(features), feature_ids['color']
+    
+    matches = index.search(query, k=k, exclude=exclude)
+    if not matches:
+        st.info("No past cases to compare with yet.")
+        return
+    
+    metadata = index.store.metadata()
+    similar_cases = metadata.set_index('feature_id').reindex([feature_id for feature_id, _ in matches])
+    similar_cases.insert(0, 'similarity', [round(score, 3) for _, score in matches])
+    
+    st.write("### 🔎 Similar Past Cases")
+    if 'image_key' in similar_cases.columns:
+        display_thumbnail_strip(similar_cases['image_key'].tolist(),
+                                [f"{score:.0%} similar" for _, score in matches])
+    st.dataframe(similar_cases.reset_index(), use_container_width=True)
 
 def display_model_info():
     """Display model information and status"""
@@ -296,31 +482,86 @@ def display_recent_classifications():
     """Display recent classification results"""
     st.subheader("📊 Recent Classifications")
     
-    from utils.csv_handlers import load_from_csv
-    
-    classifications_df = load_from_csv('ai_classifications.csv')
+    # Only the last records are read; statistics come from maintained counters
+    recent_classifications = read_csv_tail(CLASSIFICATIONS_FILE, 10)
     
-    if not classifications_df.empty:
+    if not recent_classifications.empty:
         # Display recent classifications
-        recent_classifications = classifications_df.tail(10).sort_values('timestamp', ascending=False)
+        recent_classifications = recent_classifications.sort_values('timestamp', ascending=False)
+        if 'image_key' in recent_classifications.columns:
+            display_thumbnail_strip(recent_classifications['image_key'].tolist(),
+                                    recent_classifications['timestamp'].tolist())
         st.dataframe(recent_classifications, use_container_width=True)
         
+        counters = get_counters('ai_classifications', CLASSIFICATIONS_FILE, build_classification_counters)
+        
         # Classification statistics
         st.write("**Classification Statistics:**")
         col1, col2, col3 = st.columns(3)
         
         with col1:
-            total_classifications = len(classifications_df)
-            st.metric("Total Classifications", total_classifications)
+            st.metric("Total Classifications", counters['total'])
         
         with col2:
-            if 'predicted_species' in classifications_df.columns:
-                unique_species = classifications_df['predicted_species'].nunique()
-                st.metric("Species Identified", unique_species)
+            st.metric("Species Identified", len(counters['species']))
         
         with col3:
             today = datetime.date.today().strftime('%Y-%m-%d')
-            today_classifications = len(classifications_df[classifications_df['timestamp'].str.startswith(today)])
-            st.metric("Today's Classifications", today_classifications)
+            st.metric("Today's Classifications", counters['per_day'].get(today, 0))
     else:
         st.info("No classifications performed yet. Upload an image to get started!")
+
+def display_thumbnail_strip(image_keys, captions):
+    """Render pre-generated archive thumbnails in a row without opening originals"""
+    thumbnails = [(get_thumbnail_path(key), caption) for key, caption in zip(image_keys, captions)]
+    thumbnails = [(path, caption) for path, caption in thumbnails if path]
+    if not thumbnails:
+        return
+    
+    columns = st.columns(len(thumbnails))
+    for column, (path, caption) in zip(columns, thumbnails):
+        with column:
+            st.image(path, caption=str(caption), use_container_width=True)
+
+def display_archive_maintenance():
+    """Admin controls for moving old originals to the compressed cold tier"""
+    if st.session_state.get('user_role') != 'admin':
+        return
+    
+    with st.expander("🗄️ Image Archive Retention"):
+        max_age_days = st.number_input("Move originals older than (days)", min_value=1,
+                                       value=DEFAULT_HOT_RETENTION_DAYS)
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            dry_run = st.button("Preview Retention")
+        with col2:
+            run = st.button("Run Retention")
+        
+        if dry_run or run:
+            retention = run_archive_retention(max_age_days, dry_run=dry_run)
+            action = "Would move" if dry_run else "Moved"
+            st.success(f"{action} {retention['moved']} of {retention['checked']} originals "
+                       f"({retention['bytes_before'] / 1024 / 1024:.1f} MB) to cold storage")
+            if not dry_run and retention['moved']:
+                st.info(f"Compressed size: {retention['bytes_after'] / 1024 / 1024:.1f} MB")
+
+def display_feature_analytics():
+    """Display image feature distributions from the feature store"""
+    store = get_feature_store()
+    
+    if len(store) == 0:
+        return
+    
+    with st.expander(f"🎨 Image Feature Analytics ({len(store)} images)"):
+        feature = st.selectbox("Feature", ["brightness", "contrast", "mean_r", "mean_g", "mean_b"])
+        st.bar_chart(store.histogram(feature, bins=20, value_range=(0, 255)))
+        
+        values = store.column(feature)
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Mean", f"{values.mean():.1f}")
+        with col2:
+            st.metric("Median", f"{np.median(values):.1f}")
+        with col3:
+            st.metric("Std Dev", f"{values.std():.1f}")
\ No newline at end of file
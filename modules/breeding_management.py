@@ -2,9 +2,38 @@ import streamlit as st
 import pandas as pd
 import datetime
 import os
-from utils.csv_handlers import save_to_csv, load_from_csv
+from utils.csv_handlers import (save_to_csv, load_from_csv, load_from_csv_cached, bulk_update_csv_records,
+                                append_csv_records, STORAGE_DIR)
+from utils.lifecycle_forecast import forecast_batches, pupae_supply_curve
+from utils.feed_planning import get_feed_planner
+from utils.csv_index import get_csv_index, gzip_stream, write_stream
+from utils.cohort_analytics import get_cohort_table, COHORT_DIMENSIONS
+from utils.task_scheduler import get_task_scheduler, get_task_counters
+from utils.inventory import get_inventory
+from utils.telemetry import (get_telemetry_store, get_telemetry_listener, simulate_readings,
+                             THRESHOLDS, INBOX_DIR)
+from utils.aggregate_counters import source_size, get_counters, record_write
+from utils.batch_events import get_batch_event_store, build_change_events, created_event, survival_summary
 from data.butterfly_species_info import BUTTERFLY_SPECIES_INFO, SPECIES_HOST_PLANTS
 
+BATCH_STAGES = ["egg", "larva", "pupa", "adult"]
+HEALTH_STATUSES = ["healthy", "warning", "critical"]
+TASK_TYPES = [
+    "Feeding", "Pest Control", "Cage Cleaning", "Health Check", 
+    "Plant Replacement", "Temperature Check", "Humidity Check", 
+    "Breeding Record", "Quality Assessment", "Harvest"
+]
+TASK_PRIORITIES = ["Low", "Medium", "High"]
+RECURRENCE_INTERVALS = {"Daily": 1, "Every 2 Days": 2, "Every 3 Days": 3, "Weekly": 7, "Every 2 Weeks": 14}
+DUE_NOW_LIMIT = 100
+BATCHES_FILE = 'breeding_batches.csv'
+BREEDING_LOG_FILE = 'breeding_log.csv'
+EXPORTS_DIR = os.path.join(STORAGE_DIR, 'exports')
+BATCH_COUNTERS = 'breeding_batches'
+BATCH_COUNTER_FIELDS = ['health_status', 'stage', 'species']
+TASK_LIST_LIMIT = 50
+BREEDING_LOG_COLUMNS = ['timestamp', 'event_type', 'batch_id', 'description', 'logged_by']
+
 def breeding_management_app():
     """Main breeding management application"""
     st.title("🦋 Butterfly Breeding Management System")
@@ -38,50 +67,102 @@ def breeding_dashboard():
     """Breeding dashboard overview"""
     st.header("Breeding Dashboard")
     
-    # Load existing batches
-    batches_df = load_from_csv('breeding_batches.csv')
-    tasks_df = load_from_csv('breeding_tasks.csv')
+    # Precomputed counters keep the dashboard independent of farm size
+    scheduler = get_task_scheduler()
+    scheduler.generate_recurring()
+    batch_counters = get_batch_counters()
+    task_counters = get_task_counters()
     
     # Metrics
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        active_batches = len(batches_df) if not batches_df.empty else 0
-        st.metric("Active Batches", active_batches)
+        st.metric("Active Batches", batch_counters['batches'])
     
     with col2:
-        total_larvae = batches_df['larva_count'].sum() if not batches_df.empty else 0
-        st.metric("Total Larvae", int(total_larvae))
+        st.metric("Total Larvae", int(batch_counters['total_larvae']))
     
     with col3:
-        open_tasks = len(tasks_df[tasks_df['status'] == 'pending']) if not tasks_df.empty else 0
-        st.metric("Open Tasks", open_tasks)
+        st.metric("Open Tasks", task_counters['status'].get('pending', 0))
     
     with col4:
-        healthy_batches = len(batches_df[batches_df['health_status'] == 'healthy']) if not batches_df.empty else 0
-        st.metric("Healthy Batches", healthy_batches)
+        st.metric("Healthy Batches", batch_counters['health_status'].get('healthy', 0))
     
     # Recent activity
     st.subheader("Recent Batch Activity")
-    if not batches_df.empty:
-        recent_batches = batches_df.tail(5)
+    if batch_counters['batches'] > 0:
+        # The row index handles notes with embedded newlines, which a raw tail read would split
+        batch_index = get_csv_index(BATCHES_FILE)
+        batch_count = len(batch_index)
+        recent_batches = batch_index.read_rows(range(max(batch_count - 5, 0), batch_count))
         st.dataframe(recent_batches, use_container_width=True)
     else:
         st.info("No breeding batches yet. Create your first batch in Cage Management.")
     
     # Alerts and notifications
     st.subheader("System Alerts")
-    if not tasks_df.empty:
-        overdue_tasks = tasks_df[
-            (tasks_df['due_date'] < datetime.datetime.now().strftime('%Y-%m-%d')) & 
-            (tasks_df['status'] == 'pending')
-        ]
-        if not overdue_tasks.empty:
-            st.error(f"⚠️ {len(overdue_tasks)} overdue tasks require attention!")
+    if task_counters['status'].get('pending', 0) > 0:
+        overdue_count = len(scheduler.overdue())
+        if overdue_count > 0:
+            st.error(f"⚠️ {overdue_count} overdue tasks require attention!")
         else:
             st.success("✅ All tasks are up to date")
     else:
         st.info("No tasks scheduled")
+    
+    # Live cage conditions from sensors
+    st.subheader("🌡️ Cage Environment")
+    cage_environment()
+
+def cage_environment():
+    """Latest sensor readings, sparklines and threshold alerts per cage"""
+    store = get_telemetry_store()
+    if not get_telemetry_listener().running:
+        # The listener drains the inbox while it runs
+        store.process_inbox()
+    
+    for (cage_id, metric), alert in store.active_alerts.items():
+        st.error(f"⚠️ {cage_id}: {metric} {alert['value']} outside {alert['min']}-{alert['max']} since {alert['timestamp']}")
+    
+    overview = store.cage_overview(window_minutes=60)
+    if overview.empty:
+        st.info(f"No sensor readings yet. Send 'batch_id,timestamp,temperature,humidity' lines over UDP "
+                f"or drop CSV files into {INBOX_DIR}.")
+    else:
+        st.dataframe(
+            overview[['batch_id', 'temperature', 'temperature_trend', 'humidity', 'humidity_trend',
+                      'alerts', 'last_reading']],
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                'temperature': st.column_config.NumberColumn("Temp (°C)", format="%.1f"),
+                'temperature_trend': st.column_config.LineChartColumn(
+                    "Temp, last hour", y_min=THRESHOLDS[0, 0] - 5, y_max=THRESHOLDS[0, 1] + 5),
+                'humidity': st.column_config.NumberColumn("Humidity (%)", format="%.1f"),
+                'humidity_trend': st.column_config.LineChartColumn(
+                    "Humidity, last hour", y_min=THRESHOLDS[1, 0] - 10, y_max=THRESHOLDS[1, 1] + 10),
+            }
+        )
+    
+    if st.session_state.get('user_role') == 'admin':
+        with st.expander("Sensor Ingestion"):
+            listener = get_telemetry_listener()
+            st.write(f"**UDP listener:** {'running on port ' + str(listener.port) if listener.running else 'stopped'}")
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("⏹️ Stop Listener" if listener.running else "▶️ Start Listener"):
+                    try:
+                        listener.stop() if listener.running else listener.start()
+                        st.rerun()
+                    except OSError as e:
+                        st.error(f"Could not start listener: {str(e)}")
+            with col2:
+                if st.button("🧪 Simulate 10 Minutes of Readings"):
+                    cage_ids = load_from_csv_cached(BATCHES_FILE)['batch_id'].dropna().astype(str).unique()
+                    ingested = store.ingest(*simulate_readings(cage_ids, seconds=600))
+                    store.flush()
+                    st.success(f"Ingested {ingested} simulated readings")
+                    st.rerun()
 
 def cage_management():
     """Cage and batch management"""
@@ -102,8 +183,8 @@ def cage_management():
             cage_id = st.text_input("Cage ID", value=f"CAGE_{datetime.datetime.now().strftime('%Y%m%d_%H%M')}")
         
         with col2:
-            health_status = st.selectbox("Health Status", ["healthy", "warning", "critical"])
-            stage = st.selectbox("Current Stage", ["egg", "larva", "pupa", "adult"])
+            health_status = st.selectbox("Health Status", HEALTH_STATUSES)
+            stage = st.selectbox("Current Stage", BATCH_STAGES)
             notes = st.text_area("Notes")
         
         submit_batch = st.form_submit_button("Create Batch")
@@ -121,74 +202,416 @@ def cage_management():
                 'notes': notes
             }
             
+            size_before = source_size('breeding_batches.csv')
             save_to_csv('breeding_batches.csv', new_batch)
+            get_batch_event_store().append([created_event(new_batch, st.session_state.username)])
+            record_write(BATCH_COUNTERS, BATCHES_FILE, size_before,
+                         lambda counters: update_batch_counters(counters, [], [new_batch]),
+                         build_batch_counters)
+            get_feed_planner().apply_batches(pd.DataFrame([new_batch]), size_before)
+            get_task_scheduler().on_stage_transitions([(cage_id, None, stage)], st.session_state.username)
+            get_inventory().record_batches([None], [new_batch], st.session_state.username)
             st.success(f"✅ Batch {cage_id} created successfully!")
             st.rerun()
     
     # Display existing batches
     st.subheader("Active Breeding Batches")
-    batches_df = load_from_csv('breeding_batches.csv')
+    batch_browser()
     
-    if not batches_df.empty:
-        # Batch management interface
-        for idx, batch in batches_df.iterrows():
-            with st.expander(f"🦋 {batch['batch_id']} - {batch['species']} ({batch['stage']})"):
-                col1, col2, col3 = st.columns(3)
-                
-                with col1:
-                    st.write(f"**Larva Count:** {batch['larva_count']}")
-                    st.write(f"**Health Status:** {batch['health_status']}")
-                    st.write(f"**Created:** {batch['created_date']}")
-                
-                with col2:
-                    # Update larva count
-                    new_count = st.number_input(
-                        "Update Count", 
-                        value=int(batch['larva_count']), 
-                        key=f"count_{idx}"
-                    )
-                    
-                    # Update stage
-                    new_stage = st.selectbox(
-                        "Update Stage",
-                        ["egg", "larva", "pupa", "adult"],
-                        index=["egg", "larva", "pupa", "adult"].index(batch['stage']),
-                        key=f"stage_{idx}"
-                    )
-                
-                with col3:
-                    # Update health status
-                    new_health = st.selectbox(
-                        "Health Status",
-                        ["healthy", "warning", "critical"],
-                        index=["healthy", "warning", "critical"].index(batch['health_status']),
-                        key=f"health_{idx}"
-                    )
-                    
-                    if st.button(f"Update Batch", key=f"update_{idx}"):
-                        # Update the batch
-                        batches_df.loc[idx, 'larva_count'] = new_count
-                        batches_df.loc[idx, 'stage'] = new_stage
-                        batches_df.loc[idx, 'health_status'] = new_health
-                        batches_df.loc[idx, 'last_updated'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                        
-                        # Save updated dataframe
-                        batches_df.to_csv('breeding_batches.csv', index=False)
-                        st.success("Batch updated!")
-                        st.rerun()
-                
-                # Host plant information
-                if batch['species'] in SPECIES_HOST_PLANTS:
-                    plant_info = SPECIES_HOST_PLANTS[batch['species']]
-                    st.info(f"**Host Plants:** {', '.join(plant_info['plant'])}")
-                    st.info(f"**Daily Consumption:** {plant_info['dailyConsumption']}g per larva")
-    else:
+    # Move many batches at once
+    st.subheader("Bulk Stage / Health Transition")
+    bulk_transition_form()
+    
+    # Host plant demand across all cages
+    st.subheader("🌿 Feed Planning")
+    feed_planning_section()
+
+def filter_batches(batches_df, species=None, stage="All", health="All", search=""):
+    """
+    Filter breeding batches
+    
+    Args:
+        batches_df: Full batches DataFrame
+        species: Optional list of species to include
+        stage: Stage filter or "All"
+        health: Health status filter or "All"
+        search: Case-insensitive substring matched against batch ID and notes
+        
+    Returns:
+        pandas.DataFrame: Matching batches (original index preserved)
+    """
+    if batches_df.empty:
+        return batches_df
+    
+    mask = pd.Series(True, index=batches_df.index)
+    if species:
+        mask &= batches_df['species'].isin(species)
+    if stage != "All":
+        mask &= batches_df['stage'] == stage
+    if health != "All":
+        mask &= batches_df['health_status'] == health
+    if search:
+        haystack = batches_df['batch_id'].astype(str) + ' ' + batches_df['notes'].fillna('').astype(str)
+        mask &= haystack.str.contains(search, case=False, regex=False)
+    
+    return batches_df[mask]
+
+def paginate_batches(matches, sort_by="created_date", ascending=False, page=1, page_size=25):
+    """
+    Sort filtered batches and return one page
+    
+    Args:
+        matches: Filtered batches DataFrame
+        sort_by: Column to sort by
+        ascending: Sort direction
+        page: 1-based page number
+        page_size: Rows per page
+        
+    Returns:
+        pandas.DataFrame: Rows on the requested page
+    """
+    if sort_by in matches.columns:
+        matches = matches.sort_values(sort_by, ascending=ascending, kind='stable')
+    start = (page - 1) * page_size
+    return matches.iloc[start:start + page_size]
+
+def batch_browser():
+    """Paginated batch list with filters and a single batched edit"""
+    batches_df = load_from_csv_cached('breeding_batches.csv')
+    
+    if batches_df.empty:
         st.info("No active batches. Create your first batch above.")
+        return
+    
+    col1, col2, col3, col4 = st.columns([2, 1, 1, 2])
+    with col1:
+        species_filter = st.multiselect("Species", sorted(batches_df['species'].dropna().unique().tolist()))
+    with col2:
+        stage_filter = st.selectbox("Stage", ["All"] + BATCH_STAGES, key="batch_stage_filter")
+    with col3:
+        health_filter = st.selectbox("Health", ["All"] + HEALTH_STATUSES, key="batch_health_filter")
+    with col4:
+        search = st.text_input("Search Batch ID / Notes", key="batch_search")
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        sort_by = st.selectbox("Sort by", ["created_date", "batch_id", "species", "larva_count", "last_updated"])
+    with col2:
+        ascending = st.radio("Order", ["Descending", "Ascending"], horizontal=True) == "Ascending"
+    with col3:
+        page_size = st.selectbox("Rows per page", [25, 50, 100], key="batch_page_size")
+    
+    matches = filter_batches(batches_df, species_filter, stage_filter, health_filter, search)
+    total = len(matches)
+    page_count = max(1, -(-total // page_size))
+    page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, value=1)
+    
+    # Only the visible page is sent to the browser
+    page_df = paginate_batches(matches, sort_by, ascending, page, page_size)
+    st.caption(f"Showing {len(page_df)} of {total} matching batches")
+    
+    if page_df.empty:
+        st.info("No batches match the current filters.")
+        return
+    
+    editable_columns = ['larva_count', 'stage', 'health_status', 'notes']
+    edited_df = st.data_editor(
+        page_df,
+        key=f"batch_editor_{page}_{page_size}",
+        hide_index=True,
+        use_container_width=True,
+        disabled=[column for column in page_df.columns if column not in editable_columns],
+        column_config={
+            'larva_count': st.column_config.NumberColumn("Larva Count", min_value=0, step=1),
+            'stage': st.column_config.SelectboxColumn("Stage", options=BATCH_STAGES),
+            'health_status': st.column_config.SelectboxColumn("Health Status", options=HEALTH_STATUSES),
+        }
+    )
+    
+    changes = diff_batch_edits(page_df, edited_df, editable_columns)
+    if st.button(f"💾 Save Changes ({len(changes)} batches)", disabled=not changes):
+        if bulk_update_batches(changes, st.session_state.username) >= 0:
+            st.success(f"Updated {len(changes)} batches!")
+            st.rerun()
+    
+    # Host plant information for species on this page
+    with st.expander("🌿 Host Plants for Species on This Page"):
+        for species in page_df['species'].dropna().unique():
+            if species in SPECIES_HOST_PLANTS:
+                plant_info = SPECIES_HOST_PLANTS[species]
+                st.write(f"**{species}:** {', '.join(plant_info['plant'])} "
+                         f"({plant_info['dailyConsumption']}g per larva daily)")
+
+def bulk_transition_form():
+    """Multi-select stage and health transitions committed in one write"""
+    batches_df = load_from_csv_cached('breeding_batches.csv')
+    
+    if batches_df.empty:
+        return
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        from_stage = st.selectbox("Current Stage", ["All"] + BATCH_STAGES, key="bulk_from_stage")
+    with col2:
+        species_filter = st.selectbox("Species", ["All"] + sorted(batches_df['species'].dropna().unique().tolist()),
+                                      key="bulk_species")
+    
+    candidates = filter_batches(batches_df, None if species_filter == "All" else [species_filter], from_stage)
+    # Batch IDs can repeat, so batches are picked by (batch_id, created_date)
+    candidate_keys = list(dict.fromkeys(zip(candidates['batch_id'].astype(str), candidates['created_date'].astype(str))))
+    
+    with st.form("bulk_transition_form"):
+        select_all = st.checkbox(f"Select all {len(candidate_keys)} matching batches")
+        selected_keys = st.multiselect("Batches", candidate_keys,
+                                       format_func=lambda key: f"{key[0]} (created {key[1]})")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            new_stage = st.selectbox("New Stage", ["No change"] + BATCH_STAGES)
+        with col2:
+            new_health = st.selectbox("New Health Status", ["No change"] + HEALTH_STATUSES)
+        
+        submit = st.form_submit_button("Apply to Selected Batches")
+        
+        if submit:
+            target_keys = candidate_keys if select_all else selected_keys
+            fields = {}
+            if new_stage != "No change":
+                fields['stage'] = new_stage
+            if new_health != "No change":
+                fields['health_status'] = new_health
+            
+            if not target_keys or not fields:
+                st.warning("Select batches and at least one change.")
+            else:
+                updated = bulk_update_batches({key: fields for key in target_keys},
+                                              st.session_state.username)
+                if updated >= 0:
+                    st.success(f"✅ Updated {updated} batches in one transaction!")
+                    st.rerun()
+
+def bulk_update_batches(changes, username):
+    """
+    Apply changes keyed by batch row identity as one write, logging each transition
+    
+    Rows are located by (batch_id, created_date) inside the write itself, so
+    a concurrent rewrite that reorders or removes rows never redirects an
+    edit to a different batch, and an edit never spreads to other batches
+    that reuse the same hand-typed ID.
+    
+    Args:
+        changes: Mapping of (batch_id, created_date) to field updates
+        username: User recorded on the generated log events
+        
+    Returns:
+        int: Number of batch rows updated, or -1 on failure
+    """
+    if not changes:
+        return 0
+    
+    batches_df = load_from_csv('breeding_batches.csv')
+    if batches_df.empty:
+        st.warning("No data found in breeding_batches.csv")
+        return -1
+    
+    changes = {(str(batch_id), str(created_date)): dict(fields)
+               for (batch_id, created_date), fields in changes.items()}
+    for (batch_id, _), fields in changes.items():
+        if 'larva_count' in fields:
+            count = pd.to_numeric(fields['larva_count'], errors='coerce')
+            if pd.isna(count) or count < 0 or count != int(count):
+                st.warning(f"Batch {batch_id}: larva count must be a whole number of 0 or more")
+                return -1
+            fields['larva_count'] = int(count)
+    
+    # Row positions in this snapshot only drive the log events and derived state
+    positions = {}
+    for row_index, key in zip(batches_df.index, zip(batches_df['batch_id'].astype(str),
+                                                     batches_df['created_date'].astype(str))):
+        positions.setdefault(key, []).append(row_index)
+    row_changes = {}
+    for key, fields in changes.items():
+        rows = positions.get(key, [])
+        if not rows:
+            st.warning(f"Batch {key[0]} created {key[1]} not found")
+            return -1
+        for row_index in rows:
+            row_changes.setdefault(row_index, {}).update(fields)
+    
+    events = build_batch_log_events(batches_df, row_changes, username)
+    batch_events = build_change_events(batches_df, row_changes, username)
+    
+    size_before = source_size('breeding_batches.csv')
+    updated = bulk_update_csv_records('breeding_batches.csv', ['batch_id', 'created_date'], changes)
+    if updated < 0:
+        return -1
+    
+    # The batch table is the source of truth, so events are appended only after it is written
+    if events:
+        append_csv_records(BREEDING_LOG_FILE, events, BREEDING_LOG_COLUMNS)
+    get_batch_event_store().append(batch_events)
+    
+    updated_rows = updated_batch_rows(batches_df, row_changes)
+    previous_rows = batches_df.loc[updated_rows.index].to_dict('records')
+    record_write(BATCH_COUNTERS, BATCHES_FILE, size_before,
+                 lambda counters: update_batch_counters(counters, previous_rows, updated_rows.to_dict('records')),
+                 build_batch_counters)
+    get_feed_planner().apply_batches(updated_rows, size_before)
+    transitions = stage_transitions(batches_df, row_changes)
+    get_task_scheduler().on_stage_transitions(transitions, username)
+    get_inventory().record_batches(previous_rows, updated_rows.to_dict('records'), username)
+    
+    return updated
+
+def build_batch_counters(batches_df):
+    """Compute batch counters from a full table scan"""
+    counters = {'batches': 0, 'total_larvae': 0, **{field: {} for field in BATCH_COUNTER_FIELDS}}
+    if batches_df.empty:
+        return counters
+    
+    counters['batches'] = len(batches_df)
+    counters['total_larvae'] = int(pd.to_numeric(batches_df['larva_count'], errors='coerce').fillna(0).sum())
+    for field in BATCH_COUNTER_FIELDS:
+        counters[field] = {str(value): int(count) for value, count in batches_df[field].value_counts().items()}
+    return counters
+
+def update_batch_counters(counters, removed_rows, added_rows):
+    """
+    Fold batch writes into the counters
+    
+    An edited batch is passed as its old row in removed_rows and its new
+    row in added_rows, so only the fields that changed move.
+    """
+    for rows, sign in [(removed_rows, -1), (added_rows, 1)]:
+        for batch in rows:
+            counters['batches'] += sign
+            count = pd.to_numeric(batch.get('larva_count'), errors='coerce')
+            counters['total_larvae'] += sign * (0 if pd.isna(count) else int(count))
+            for field in BATCH_COUNTER_FIELDS:
+                value = batch.get(field)
+                if pd.isna(value):
+                    continue
+                key = str(value)
+                counters[field][key] = counters[field].get(key, 0) + sign
+                if counters[field][key] == 0:
+                    del counters[field][key]
+
+def get_batch_counters():
+    """Batch counters, rebuilt only if the batches file changed outside the app"""
+    return get_counters(BATCH_COUNTERS, BATCHES_FILE, build_batch_counters)
+
+def stage_transitions(batches_df, row_changes):
+    """(batch_id, old_stage, new_stage) for rows whose stage changed"""
+    transitions = []
+    for row_index, fields in row_changes.items():
+        if 'stage' in fields and row_index in batches_df.index:
+            old_stage = batches_df.at[row_index, 'stage']
+            if fields['stage'] != old_stage:
+                transitions.append((batches_df.at[row_index, 'batch_id'], old_stage, fields['stage']))
+    return transitions
+
+def updated_batch_rows(batches_df, row_changes):
+    """Changed batch rows as they stand after the write"""
+    rows = batches_df.loc[[row_index for row_index in row_changes if row_index in batches_df.index]].copy()
+    rows['last_updated'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    for row_index, fields in row_changes.items():
+        for field, value in fields.items():
+            if row_index in rows.index and field in rows.columns:
+                rows.at[row_index, field] = value
+    return rows
+
+def feed_planning_section():
+    """Aggregate host plant demand for every active batch"""
+    planner = get_feed_planner()
+    plan = planner.plan()
+    
+    if plan.empty:
+        st.info("No larvae or eggs need feeding.")
+        return
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Daily Feed", f"{plan['daily_grams'].sum() / 1000:.2f} kg")
+    with col2:
+        st.metric("Next 7 Days", f"{plan['next_7d_kg'].sum():.1f} kg")
+    with col3:
+        st.metric("Next 30 Days", f"{plan['next_30d_kg'].sum():.1f} kg")
+    
+    st.write("**Demand by Host Plant**")
+    st.caption("Each species' demand is split evenly across its host plants; eggs are counted from hatching.")
+    st.dataframe(plan, use_container_width=True, hide_index=True)
+    
+    with st.expander("Demand by Species"):
+        st.dataframe(planner.species_plan(), use_container_width=True)
+
+def build_batch_log_events(batches_df, row_changes, username):
+    """
+    Turn batch field changes into breeding log events
+    
+    Returns:
+        list: Log records for stage, health and count changes
+    """
+    timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    events = []
+    
+    for row_index, fields in row_changes.items():
+        if row_index not in batches_df.index:
+            continue
+        batch = batches_df.loc[row_index]
+        
+        def log(event_type, description):
+            events.append({
+                'timestamp': timestamp,
+                'event_type': event_type,
+                'batch_id': batch['batch_id'],
+                'description': description,
+                'logged_by': username
+            })
+        
+        if 'stage' in fields and fields['stage'] != batch['stage']:
+            log("Stage Change", f"Stage {batch['stage']} → {fields['stage']}")
+        if 'health_status' in fields and fields['health_status'] != batch['health_status']:
+            log("Health Check", f"Health {batch['health_status']} → {fields['health_status']}")
+        if ('larva_count' in fields and pd.notna(batch['larva_count']) and pd.notna(fields['larva_count'])
+                and int(fields['larva_count']) != int(batch['larva_count'])):
+            old_count, new_count = int(batch['larva_count']), int(fields['larva_count'])
+            event_type = "Mortality" if new_count < old_count else "Other"
+            log(event_type, f"Count {old_count} → {new_count} ({new_count - old_count:+d})")
+    
+    return events
+
+def diff_batch_edits(original_df, edited_df, columns):
+    """
+    Collect cell changes between the displayed page and the edited page
+    
+    Returns:
+        dict: (batch_id, created_date) -> {column: new value} for changed rows only
+    """
+    changes = {}
+    for column in columns:
+        if column not in original_df.columns:
+            continue
+        before = original_df[column]
+        after = edited_df[column]
+        changed = (before != after) & ~(before.isna() & after.isna())
+        for row_index in changed[changed].index:
+            value = after[row_index]
+            if column == 'larva_count':
+                # A cleared count cell is not an edit; the stored count stays
+                if pd.isna(value):
+                    continue
+                value = int(value)
+            key = (str(original_df.at[row_index, 'batch_id']), str(original_df.at[row_index, 'created_date']))
+            changes.setdefault(key, {})[column] = value
+    return changes
 
 def task_management():
     """Task management system"""
     st.header("Task Management")
     
+    scheduler = get_task_scheduler()
+    scheduler.generate_recurring()
+    
     # Create new task
     st.subheader("Create New Task")
     
@@ -197,12 +620,8 @@ def task_management():
         
         with col1:
             task_title = st.text_input("Task Title")
-            task_type = st.selectbox("Task Type", [
-                "Feeding", "Pest Control", "Cage Cleaning", "Health Check", 
-                "Plant Replacement", "Temperature Check", "Humidity Check", 
-                "Breeding Record", "Quality Assessment", "Harvest"
-            ])
-            priority = st.selectbox("Priority", ["Low", "Medium", "High"])
+            task_type = st.selectbox("Task Type", TASK_TYPES)
+            priority = st.selectbox("Priority", TASK_PRIORITIES)
         
         with col2:
             due_date = st.date_input("Due Date", value=datetime.date.today())
@@ -225,13 +644,36 @@ def task_management():
                 'created_date': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             }
             
-            save_to_csv('breeding_tasks.csv', new_task)
-            st.success("✅ Task created successfully!")
-            st.rerun()
+            if scheduler.add_tasks([new_task]):
+                st.success("✅ Task created successfully!")
+                st.rerun()
+    
+    # Recurring tasks
+    with st.expander("🔁 Recurring Tasks"):
+        recurring_task_form(scheduler)
+    
+    # What needs doing now, straight from the due-date index
+    st.subheader("Due Now")
+    tasks_df = load_from_csv_cached('breeding_tasks.csv')
+    overdue_ids = scheduler.overdue()
+    today_ids = scheduler.due_today()
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Overdue", len(overdue_ids))
+    with col2:
+        st.metric("Due Today", len(today_ids))
+    
+    due_ids = overdue_ids + today_ids
+    if due_ids:
+        due_tasks = tasks_by_id(tasks_df, due_ids[:DUE_NOW_LIMIT])
+        st.dataframe(due_tasks[['task_id', 'title', 'type', 'priority', 'due_date', 'batch_id']],
+                     use_container_width=True, hide_index=True)
+        if len(due_ids) > DUE_NOW_LIMIT:
+            st.caption(f"Showing the {DUE_NOW_LIMIT} most urgent of {len(due_ids)} tasks")
     
     # Display tasks
     st.subheader("Task List")
-    tasks_df = load_from_csv('breeding_tasks.csv')
     
     if not tasks_df.empty:
         # Filter options
@@ -239,12 +681,12 @@ def task_management():
         with col1:
             status_filter = st.selectbox("Filter by Status", ["All", "pending", "completed", "cancelled"])
         with col2:
-            priority_filter = st.selectbox("Filter by Priority", ["All", "High", "Medium", "Low"])
+            priority_filter = st.selectbox("Filter by Priority", ["All"] + TASK_PRIORITIES[::-1])
         with col3:
-            type_filter = st.selectbox("Filter by Type", ["All"] + tasks_df['type'].unique().tolist())
+            type_filter = st.selectbox("Filter by Type", ["All"] + tasks_df['type'].dropna().unique().tolist())
         
         # Apply filters
-        filtered_tasks = tasks_df.copy()
+        filtered_tasks = tasks_df
         if status_filter != "All":
             filtered_tasks = filtered_tasks[filtered_tasks['status'] == status_filter]
         if priority_filter != "All":
@@ -252,8 +694,25 @@ def task_management():
         if type_filter != "All":
             filtered_tasks = filtered_tasks[filtered_tasks['type'] == type_filter]
         
+        # Complete many tasks in one write
+        pending_tasks = filtered_tasks[filtered_tasks['status'] == 'pending']
+        if not pending_tasks.empty:
+            task_titles = dict(zip(pending_tasks['task_id'].astype(str), pending_tasks['title']))
+            with st.form("bulk_complete_form"):
+                selected_tasks = st.multiselect(
+                    "Select pending tasks to complete",
+                    list(task_titles.keys()),
+                    format_func=lambda task_id: f"{task_id} - {task_titles[task_id]}"
+                )
+                if st.form_submit_button("✅ Mark Selected Complete") and selected_tasks:
+                    if complete_tasks(selected_tasks) >= 0:
+                        st.success(f"{len(selected_tasks)} tasks marked as completed!")
+                        st.rerun()
+        
         # Display tasks
-        for idx, task in filtered_tasks.iterrows():
+        if len(filtered_tasks) > TASK_LIST_LIMIT:
+            st.caption(f"Showing {TASK_LIST_LIMIT} of {len(filtered_tasks)} tasks; narrow the filters to see more")
+        for idx, task in filtered_tasks.head(TASK_LIST_LIMIT).iterrows():
             with st.expander(f"📋 {task['title']} - {task['priority']} Priority"):
                 col1, col2 = st.columns(2)
                 
@@ -269,14 +728,72 @@ def task_management():
                     # Mark as completed
                     if task['status'] == 'pending':
                         if st.button(f"Mark Complete", key=f"complete_{idx}"):
-                            tasks_df.loc[idx, 'status'] = 'completed'
-                            tasks_df.loc[idx, 'completed_date'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                            tasks_df.to_csv('breeding_tasks.csv', index=False)
-                            st.success("Task marked as completed!")
-                            st.rerun()
+                            if complete_tasks([task['task_id']]) >= 0:
+                                st.success("Task marked as completed!")
+                                st.rerun()
     else:
         st.info("No tasks created yet.")
 
+def recurring_task_form(scheduler):
+    """Create and stop recurring task schedules"""
+    with st.form("create_schedule_form"):
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            title = st.text_input("Task Title", key="schedule_title")
+            task_type = st.selectbox("Task Type", TASK_TYPES, key="schedule_type")
+            priority = st.selectbox("Priority", TASK_PRIORITIES, key="schedule_priority")
+        
+        with col2:
+            frequency = st.selectbox("Repeat", list(RECURRENCE_INTERVALS.keys()))
+            start_date = st.date_input("First Due Date", value=datetime.date.today(), key="schedule_start")
+            batch_id = st.text_input("Batch / Cage ID (optional)", key="schedule_batch")
+        
+        if st.form_submit_button("Create Recurring Task") and title:
+            schedule_id = scheduler.add_schedule(
+                title, task_type, priority, RECURRENCE_INTERVALS[frequency],
+                start_date.strftime('%Y-%m-%d'), st.session_state.username, batch_id=batch_id
+            )
+            if schedule_id:
+                scheduler.generate_recurring()
+                st.success(f"✅ Recurring task {schedule_id} created!")
+                st.rerun()
+    
+    schedules = scheduler.active_schedules()
+    if schedules.empty:
+        st.info("No recurring tasks yet.")
+        return
+    
+    st.dataframe(schedules[['schedule_id', 'title', 'type', 'batch_id', 'interval_days', 'next_due']],
+                 use_container_width=True, hide_index=True)
+    to_stop = st.multiselect("Stop schedules", schedules['schedule_id'].tolist())
+    if st.button("⏹️ Stop Selected", disabled=not to_stop):
+        if scheduler.deactivate_schedules(to_stop) >= 0:
+            st.success(f"Stopped {len(to_stop)} schedules")
+            st.rerun()
+
+def tasks_by_id(tasks_df, task_ids):
+    """Task rows for the given IDs, in the given order"""
+    positions = pd.Series(range(len(tasks_df)), index=tasks_df['task_id'].astype(str))
+    positions = positions[~positions.index.duplicated()]
+    return tasks_df.iloc[positions.reindex(task_ids).dropna().astype(int).to_numpy()]
+
+def bulk_update_tasks(changes):
+    """
+    Apply changes keyed by task ID with a single write
+    
+    Args:
+        changes: Mapping of task_id to field updates
+        
+    Returns:
+        int: Number of task rows updated, or -1 on failure
+    """
+    return get_task_scheduler().update_tasks(changes)
+
+def complete_tasks(task_ids):
+    """Mark tasks as completed in one write"""
+    return get_task_scheduler().complete_tasks(task_ids)
+
 def breeding_log():
     """Breeding activity log"""
     st.header("Breeding Activity Log")
@@ -308,55 +825,106 @@ def breeding_log():
                 'logged_by': st.session_state.username
             }
             
-            save_to_csv('breeding_log.csv', new_log_entry)
+            append_csv_records(BREEDING_LOG_FILE, [new_log_entry], BREEDING_LOG_COLUMNS)
             st.success("✅ Log entry added!")
             st.rerun()
     
     # Display log
-    st.subheader("Recent Activity Log")
-    log_df = load_from_csv('breeding_log.csv')
-    
-    if not log_df.empty:
-        # Sort by timestamp (most recent first)
-        log_df['timestamp'] = pd.to_datetime(log_df['timestamp'])
-        log_df = log_df.sort_values('timestamp', ascending=False)
-        
-        # Display recent entries
-        st.dataframe(log_df.head(20), use_container_width=True)
-        
-        # Download full log
-        csv_data = log_df.to_csv(index=False)
-        st.download_button(
-            label="📥 Download Full Log",
-            data=csv_data,
-            file_name=f"breeding_log_{datetime.date.today()}.csv",
-            mime="text/csv"
-        )
-    else:
+    st.subheader("Activity Log")
+    log_index = get_csv_index(BREEDING_LOG_FILE, code_columns=['event_type', 'batch_id'], date_column='timestamp')
+    
+    if len(log_index) == 0:
         st.info("No log entries yet.")
+        return
+    
+    # Filters run against the in-memory row index; only the visible page is read from disk
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        event_filter = st.multiselect("Event Type", log_index.values('event_type'), key="log_event_filter")
+    with col2:
+        batch_filter = st.multiselect("Batch ID", log_index.values('batch_id'), key="log_batch_filter")
+    with col3:
+        date_range = st.date_input("Date Range", value=(), key="log_date_range")
+    
+    filters = {}
+    if event_filter:
+        filters['event_type'] = event_filter
+    if batch_filter:
+        filters['batch_id'] = batch_filter
+    date_from = date_range[0] if len(date_range) > 0 else None
+    date_to = date_range[1] if len(date_range) > 1 else date_from
+    
+    rows = log_index.query(filters, date_from, date_to, newest_first=True)
+    if rows.size == 0:
+        st.info("No log entries match the filters.")
+        return
+    
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        page_size = st.selectbox("Rows per page", [20, 50, 100], key="log_page_size")
+    page_count = (rows.size + page_size - 1) // page_size
+    with col2:
+        page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, value=1, key="log_page")
+    
+    st.caption(f"{rows.size} entries, newest first")
+    st.dataframe(log_index.page(rows, page, page_size), use_container_width=True, hide_index=True)
+    
+    # Export the filtered range, streamed to disk rather than built in memory
+    compress = st.checkbox("Compress export (gzip)", value=True, key="log_export_gzip")
+    if st.button("📦 Prepare Export"):
+        export_path = export_breeding_log(log_index, rows[::-1], compress)
+        st.session_state.log_export = export_path
+    
+    export_path = st.session_state.get('log_export')
+    if export_path and os.path.exists(export_path):
+        with open(export_path, 'rb') as f:
+            st.download_button(
+                label=f"📥 Download Log ({os.path.getsize(export_path) / 1024:.1f} KB)",
+                data=f,
+                file_name=os.path.basename(export_path),
+                mime="application/gzip" if export_path.endswith('.gz') else "text/csv"
+            )
+
+def export_breeding_log(log_index, rows, compress=True):
+    """
+    Write selected log rows to an export file in file order
+    
+    Rows are copied from the log as raw bytes in bounded chunks, so memory
+    use does not grow with the size of the export.
+    
+    Returns:
+        str: Path of the export file
+    """
+    chunks = log_index.iter_csv(rows)
+    suffix = '.csv'
+    if compress:
+        chunks = gzip_stream(chunks)
+        suffix = '.csv.gz'
+    path = os.path.join(EXPORTS_DIR, f"breeding_log_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}{suffix}")
+    write_stream(chunks, path)
+    return path
 
 def breeding_analytics():
     """Breeding analytics and insights"""
     st.header("Breeding Analytics")
     
-    # Load data
-    batches_df = load_from_csv('breeding_batches.csv')
-    log_df = load_from_csv('breeding_log.csv')
+    # Distributions come from counters maintained on every batch write
+    counters = get_batch_counters()
     
-    if not batches_df.empty:
+    if counters['batches'] > 0:
         # Species distribution
         st.subheader("Species Distribution")
-        species_counts = batches_df['species'].value_counts()
+        species_counts = pd.Series(counters['species'], dtype=int).sort_values(ascending=False)
         st.bar_chart(species_counts)
         
         # Stage distribution
         st.subheader("Lifecycle Stage Distribution")
-        stage_counts = batches_df['stage'].value_counts()
+        stage_counts = pd.Series(counters['stage'], dtype=int).sort_values(ascending=False)
         st.bar_chart(stage_counts)
         
         # Health status overview
         st.subheader("Health Status Overview")
-        health_counts = batches_df['health_status'].value_counts()
+        health_counts = counters['health_status']
         
         col1, col2, col3 = st.columns(3)
         with col1:
@@ -368,8 +936,8 @@ def breeding_analytics():
         
         # Productivity metrics
         st.subheader("Productivity Metrics")
-        total_larvae = batches_df['larva_count'].sum()
-        avg_batch_size = batches_df['larva_count'].mean()
+        total_larvae = counters['total_larvae']
+        avg_batch_size = total_larvae / counters['batches']
         
         col1, col2 = st.columns(2)
         with col1:
@@ -377,9 +945,105 @@ def breeding_analytics():
         with col2:
             st.metric("Average Batch Size", f"{avg_batch_size:.1f}")
         
+        # Survival and mortality from the batch event history
+        survival_analytics()
+        
+        # Egg-to-adult cohorts and underperforming cages
+        cohort_analytics()
+        
+        # Projected pupation/emergence and pupae supply
+        batches_df = load_from_csv_cached(BATCHES_FILE)
+        forecast_analytics(batches_df)
+        
         # Detailed batch table
         st.subheader("Detailed Batch Information")
         st.dataframe(batches_df, use_container_width=True)
         
     else:
         st.info("No breeding data available for analysis.")
+
+def survival_analytics():
+    """Survival and mortality from event-sourced batch history"""
+    store = get_batch_event_store()
+    
+    st.subheader("Survival & Mortality")
+    as_of = st.date_input("State as of", value=datetime.date.today(), key="survival_as_of")
+    
+    if as_of >= datetime.date.today():
+        state = store.current_state()
+    else:
+        state = store.state_at(f"{as_of.strftime('%Y-%m-%d')} 23:59:59")
+    
+    summary = survival_summary(state)
+    if summary.empty:
+        st.info("No batch history recorded yet.")
+        return
+    
+    total_initial = summary['initial_count'].sum()
+    total_current = summary['current_count'].sum()
+    col1, col2 = st.columns(2)
+    with col1:
+        overall = total_current / total_initial * 100 if total_initial else 0
+        st.metric("Overall Survival", f"{overall:.1f}%")
+    with col2:
+        st.metric("Individuals Lost", int(max(total_initial - total_current, 0)))
+    
+    st.dataframe(summary, use_container_width=True)
+    
+    # Count timeline for one batch
+    batch_keys = sorted(state.keys())
+    selected_key = st.selectbox("Batch History", batch_keys, key="history_batch")
+    if selected_key:
+        history = store.history(selected_key)
+        if not history.empty:
+            st.line_chart(history.set_index('timestamp')['larva_count'])
+            st.dataframe(history, use_container_width=True)
+
+def cohort_analytics():
+    """Survival by cohort against species benchmarks, plus anomaly flags"""
+    st.subheader("Cohort Survival & Yield")
+    cohorts = get_cohort_table()
+    
+    group_by = st.multiselect("Group cohorts by", COHORT_DIMENSIONS, default=['species'], key="cohort_group_by")
+    table = cohorts.table(group_by or ['species'])
+    if table.empty:
+        st.info("No batch history yet.")
+        return
+    
+    st.dataframe(table, use_container_width=True)
+    if list(table.index.names) == ['species'] and table['survival_rate'].notna().any():
+        st.write("**Egg-to-Adult Survival vs Benchmark (%)**")
+        st.bar_chart(table[['survival_rate', 'benchmark_rate']].dropna(subset=['survival_rate']))
+    st.caption("Survival rate counts only batches that reached the adult stage; "
+               "benchmark is the species success rate.")
+    
+    st.write("**Underperforming Cages**")
+    anomalies = cohorts.anomaly_table()
+    if anomalies.empty:
+        st.success("✅ No batches are surviving significantly below expectations")
+        return
+    
+    log_index = get_csv_index(BREEDING_LOG_FILE, code_columns=['event_type', 'batch_id'], date_column='timestamp')
+    mortality_logs = log_index.value_counts('batch_id', log_index.query({'event_type': 'Mortality'}))
+    anomalies['mortality_logs'] = anomalies['batch_id'].astype(str).map(mortality_logs).fillna(0).astype(int)
+    st.warning(f"⚠️ {len(anomalies)} batches are surviving well below their species' expected rate")
+    st.dataframe(anomalies, use_container_width=True, hide_index=True)
+
+def forecast_analytics(batches_df):
+    """Lifecycle forecast and weekly pupae supply"""
+    st.subheader("Lifecycle Forecast")
+    
+    forecast = forecast_batches(batches_df)
+    if forecast.empty:
+        st.info("No batches to forecast.")
+        return
+    
+    st.write("**Expected Pupae Available by Week**")
+    st.bar_chart(pupae_supply_curve(forecast, weeks=12))
+    
+    st.write("**Projected Transitions (90% intervals)**")
+    st.dataframe(forecast[[
+        'batch_id', 'species', 'stage', 'count',
+        'pupation_date', 'pupation_low', 'pupation_high', 'expected_pupae',
+        'emergence_date', 'emergence_low', 'emergence_high', 'expected_adults'
+    ]].round(1), use_container_width=True)
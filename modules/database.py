@@ -1,14 +1,36 @@
 import os
 import sqlite3
+import shutil
 import pandas as pd
+from utils.csv_handlers import STORAGE_DIR
+
+# State directory used before STORAGE_DIR; on case-insensitive filesystems it is the data/ package
+LEGACY_STORAGE_DIR = 'Data'
+
+def migrate_legacy_storage():
+    """Move app state from the old Data/ root into STORAGE_DIR (package files stay put)"""
+    if not os.path.isdir(LEGACY_STORAGE_DIR):
+        return
+    os.makedirs(STORAGE_DIR, exist_ok=True)
+    for name in os.listdir(LEGACY_STORAGE_DIR):
+        if name.endswith('.py') or name == '__pycache__':
+            continue
+        target = os.path.join(STORAGE_DIR, name)
+        if not os.path.exists(target):
+            shutil.move(os.path.join(LEGACY_STORAGE_DIR, name), target)
+    try:
+        os.rmdir(LEGACY_STORAGE_DIR)
+    except OSError:
+        pass
 
 def initialize_databases():
     """Initialize all required databases and CSV files"""
     
     # Create necessary directories
-    directories = ['Data', 'model', 'icon']
+    directories = [STORAGE_DIR, 'model', 'icon']
     for directory in directories:
         os.makedirs(directory, exist_ok=True)
+    migrate_legacy_storage()
     
     # Initialize SQLite database for users
     initialize_user_database()
@@ -21,6 +43,10 @@ def initialize_databases():
     
     # Initialize CSV file structures
     initialize_csv_files()
+    
+    # Opening stock for a ledger that has no entries yet
+    from utils.inventory import seed_opening_balance
+    seed_opening_balance()
 
 def initialize_user_database():
     """Initialize the user authentication database"""
@@ -60,7 +86,11 @@ def initialize_csv_files():
         ],
         'breeding_tasks.csv': [
             'task_id', 'title', 'type', 'priority', 'due_date', 'batch_id',
-            'description', 'status', 'created_by', 'created_date', 'completed_date'
+            'description', 'status', 'created_by', 'created_date', 'completed_date', 'schedule_id'
+        ],
+        'task_schedules.csv': [
+            'schedule_id', 'title', 'type', 'priority', 'batch_id', 'description',
+            'interval_days', 'next_due', 'active', 'created_by', 'created_date'
         ],
         'breeding_log.csv': [
             'timestamp', 'event_type', 'batch_id', 'description', 'logged_by'
@@ -68,18 +98,23 @@ def initialize_csv_files():
         'ai_classifications.csv': [
             'timestamp', 'analysis_type', 'user', 'predicted_species',
             'species_confidence', 'predicted_stage', 'stage_confidence',
-            'predicted_disease', 'disease_confidence', 'predicted_defect', 'defect_confidence'
+            'predicted_disease', 'disease_confidence', 'predicted_defect', 'defect_confidence',
+            'image_key'
         ],
         'pos_transactions.csv': [
             'order_number', 'date', 'time', 'cashier', 'customer_name',
             'customer_email', 'payment_method', 'total_items', 'total_revenue',
-            'total_cost', 'total_profit', 'notes'
+            'total_cost', 'total_profit', 'notes', 'discount', 'tax'
         ],
         'pos_items.csv': [
             'order_number', 'date', 'time', 'item_id', 'item_name', 'species',
             'quantity', 'unit_price', 'unit_cost', 'subtotal_revenue',
             'subtotal_profit', 'cashier'
         ],
+        'inventory_ledger.csv': [
+            'entry_id', 'timestamp', 'species', 'stage', 'delta', 'reason',
+            'reference', 'recorded_by'
+        ],
         'pupae_sales.csv': [
             'sale_id', 'sale_date', 'seller_username', 'buyer_name', 'buyer_contact',
             'species', 'stage', 'quantity', 'price_per_unit', 'total_amount',
@@ -138,8 +173,8 @@ def get_database_info():
     
     # Check CSV files
     csv_files = [
-        'breeding_batches.csv', 'breeding_tasks.csv', 'breeding_log.csv',
-        'ai_classifications.csv', 'pos_transactions.csv', 'pos_items.csv',
+        'breeding_batches.csv', 'breeding_tasks.csv', 'task_schedules.csv', 'breeding_log.csv',
+        'ai_classifications.csv', 'pos_transactions.csv', 'pos_items.csv', 'inventory_ledger.csv',
         'pupae_sales.csv', 'pupae_purchases.csv', 'farm_bookings.csv',
         'farm_reviews.csv'
     ]
@@ -177,8 +212,8 @@ def backup_data():
     
     # Backup CSV files
     csv_files = [
-        'breeding_batches.csv', 'breeding_tasks.csv', 'breeding_log.csv',
-        'ai_classifications.csv', 'pos_transactions.csv', 'pos_items.csv',
+        'breeding_batches.csv', 'breeding_tasks.csv', 'task_schedules.csv', 'breeding_log.csv',
+        'ai_classifications.csv', 'pos_transactions.csv', 'pos_items.csv', 'inventory_ledger.csv',
         'pupae_sales.csv', 'pupae_purchases.csv', 'farm_bookings.csv',
         'farm_reviews.csv'
     ]
@@ -198,8 +233,8 @@ def reset_database():
     
     # Remove CSV files
     csv_files = [
-        'breeding_batches.csv', 'breeding_tasks.csv', 'breeding_log.csv',
-        'ai_classifications.csv', 'pos_transactions.csv', 'pos_items.csv',
+        'breeding_batches.csv', 'breeding_tasks.csv', 'task_schedules.csv', 'breeding_log.csv',
+        'ai_classifications.csv', 'pos_transactions.csv', 'pos_items.csv', 'inventory_ledger.csv',
         'pupae_sales.csv', 'pupae_purchases.csv', 'farm_bookings.csv',
         'farm_reviews.csv'
     ]
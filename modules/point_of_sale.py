@@ -1,9 +1,23 @@
 import streamlit as st
 import pandas as pd
 import datetime
-import random
 import os
-from utils.csv_handlers import save_to_csv, load_from_csv
+import json
+from utils.csv_handlers import load_from_csv
+from utils.pos_checkout import get_checkout_pipeline, new_idempotency_key
+from utils.inventory import get_inventory, movement, InsufficientStock, STOCK_STAGES
+from utils.pos_sync import get_terminal_sync, get_central_server
+from utils.pos_cart import Cart
+from utils.pricing import get_pricing_engine, load_rules, save_rules
+from utils.receipts import (get_receipt_store, get_receipt_worker, build_receipt, render_receipt,
+                            load_receipt_settings, save_receipt_settings, RECEIPT_FORMATS)
+from utils.z_reports import close_day, load_z_reports
+from utils.pos_history import get_transaction_history
+from utils.pos_aggregates import get_sales_aggregates
+from utils.retention import (get_retention_job, load_policies as load_retention_policies,
+                             save_policies as save_retention_policies, load_runs as load_retention_runs,
+                             ARCHIVE_DIR as RETENTION_ARCHIVE_DIR)
+from utils.lifecycle_forecast import get_pupae_supply_curve
 
 # Butterfly items with pricing
 BUTTERFLY_ITEMS = {
@@ -33,13 +47,21 @@ def point_of_sale_app():
     st.caption("Professional sales system with inventory management and analytics")
     
     # Initialize session state for cart
-    if 'cart' not in st.session_state:
-        st.session_state.cart = []
-    if 'order_number' not in st.session_state:
-        st.session_state.order_number = generate_order_number()
+    if not isinstance(st.session_state.get('cart'), Cart):
+        st.session_state.cart = Cart()
+    if 'checkout_key' not in st.session_state:
+        st.session_state.checkout_key = new_idempotency_key()
+    
+    # A sale in progress belongs to the cashier who started it; a different sign-in starts afresh
+    if st.session_state.get('pos_cashier') != st.session_state.username:
+        st.session_state.pos_cashier = st.session_state.username
+        st.session_state.cart = Cart()
+        st.session_state.checkout_key = new_idempotency_key()
+        st.session_state.pop('last_order_number', None)
     
     # Main tabs
-    tabs = st.tabs(["🛒 Sales Terminal", "📊 Sales Analytics", "📋 Transaction History", "⚙️ Settings"])
+    tabs = st.tabs(["🛒 Sales Terminal", "📊 Sales Analytics", "📋 Transaction History", "📦 Inventory",
+                    "🧮 End of Day", "⚙️ Settings"])
     
     with tabs[0]:
         sales_terminal()
@@ -51,17 +73,41 @@ def point_of_sale_app():
         transaction_history()
     
     with tabs[3]:
+        inventory_management()
+    
+    with tabs[4]:
+        end_of_day()
+    
+    with tabs[5]:
         pos_settings()
 
 def sales_terminal():
     """Main sales terminal interface"""
-    st.header(f"Sales Terminal - Order #{st.session_state.order_number}")
+    st.header("Sales Terminal")
+    
+    if 'last_order_number' in st.session_state:
+        st.success(f"Order #{st.session_state.last_order_number} completed")
+        # Shown after the rerun that clears the cart, until the next sale starts
+        generate_receipt(st.session_state.last_order_number)
+        if st.button("✖️ Close Receipt"):
+            del st.session_state.last_order_number
+            st.rerun()
     
     current_datetime = datetime.datetime.now()
     st.write(f"**Date:** {current_datetime.strftime('%A, %B %d, %Y')}")
     st.write(f"**Time:** {current_datetime.strftime('%I:%M %p')}")
     st.write(f"**Cashier:** {st.session_state.username}")
     
+    terminal = get_terminal_sync()
+    if terminal is None:
+        today_summary()
+    else:
+        status = terminal.status()
+        sync_note = f"last synced {status['last_sync']}" if status['last_sync'] else "not synced yet"
+        if status['last_error']:
+            sync_note += " · central store unreachable, sales are kept on this terminal"
+        st.caption(f"📡 Terminal {status['terminal']} · {status['pending_orders']} sales waiting to sync · {sync_note}")
+    
     # Product selection
     st.subheader("Add Items to Cart")
     
@@ -71,7 +117,7 @@ def sales_terminal():
         selected_item_id = st.selectbox(
             "Select Butterfly Product",
             options=list(BUTTERFLY_ITEMS.keys()),
-            format_func=lambda x: f"{BUTTERFLY_ITEMS[x]['name']} - ${BUTTERFLY_ITEMS[x]['price']:.2f}",
+            format_func=lambda x: f"{BUTTERFLY_ITEMS[x]['name']} - ${catalog_item(x)['price']:.2f}",
             key="item_selector"
         )
     
@@ -85,8 +131,13 @@ def sales_terminal():
     
     # Display selected item details
     if selected_item_id:
-        item = BUTTERFLY_ITEMS[selected_item_id]
-        st.info(f"**{item['name']}** - ${item['price']:.2f} each | Species: {item['species']}")
+        item = catalog_item(selected_item_id)
+        in_stock = stock_available(item['species']) if stock_tracked(item['species']) else "not tracked"
+        st.info(f"**{item['name']}** - ${item['price']:.2f} each | Species: {item['species']} | In stock: {in_stock}")
+        
+        supply = get_pupae_supply_curve(weeks=4)
+        if item['species'] in supply.columns:
+            st.caption(f"🐛 Expected pupae from breeding in the next 4 weeks: {supply[item['species']].sum():.0f}")
     
     # Shopping cart
     st.markdown("---")
@@ -97,90 +148,110 @@ def sales_terminal():
         st.markdown("---")
         checkout_section()
 
+def today_summary():
+    """Live totals for today across every terminal, from the shared aggregates"""
+    live = get_sales_aggregates().snapshot(top=1)
+    totals = live['totals']
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Orders Today", totals['orders'])
+    with col2:
+        st.metric("Revenue Today", f"${totals['revenue']:,.2f}")
+    with col3:
+        top_seller = live['top_sellers'][0] if live['top_sellers'] else None
+        st.metric("Top Seller Today", top_seller['item_name'] if top_seller else "—",
+                  f"{int(top_seller['quantity'])} sold" if top_seller else None, delta_color="off")
+
 def add_to_cart(item_id, quantity):
     """Add item to shopping cart"""
-    item = BUTTERFLY_ITEMS[item_id]
+    item = catalog_item(item_id)
+    cart = st.session_state.cart
+    st.session_state.pop('last_order_number', None)
     
-    # Check if item already in cart
-    for cart_item in st.session_state.cart:
-        if cart_item['item_id'] == item_id:
-            cart_item['quantity'] += quantity
-            cart_item['subtotal'] = cart_item['quantity'] * cart_item['price']
-            st.success(f"Updated {item['name']} quantity in cart!")
-            return
-    
-    # Add new item to cart
-    cart_item = {
-        'item_id': item_id,
-        'name': item['name'],
-        'species': item['species'],
-        'price': item['price'],
-        'cost': item['cost'],
-        'quantity': quantity,
-        'subtotal': item['price'] * quantity,
-        'profit': (item['price'] - item['cost']) * quantity
-    }
+    # Stock is only held at checkout, so this is a check against what is available right now
+    if not check_stock(item['species'], cart.species_quantity(item['species']) + quantity, item['name']):
+        return
     
-    st.session_state.cart.append(cart_item)
-    st.success(f"Added {quantity}x {item['name']} to cart!")
+    updating = cart.quantity(item_id) > 0
+    cart.add(item_id, item, quantity)
+    if updating:
+        st.success(f"Updated {item['name']} quantity in cart!")
+    else:
+        st.success(f"Added {quantity}x {item['name']} to cart!")
+
+def catalog_item(item_id):
+    """Catalog item at its current retail list price"""
+    item = BUTTERFLY_ITEMS[item_id]
+    return dict(item, price=get_pricing_engine().list_price(item['species'], item['price'], 'retail'))
+
+def check_stock(species, wanted, name):
+    """Whether wanted units of a species can go in the cart; warns instead of blocking on a remote terminal"""
+    if not stock_tracked(species):
+        return True
+    available = stock_available(species)
+    if wanted <= available:
+        return True
+    if get_terminal_sync() is None:
+        st.error(f"Only {max(available, 0)} {name} in stock.")
+        return False
+    # A terminal's stock figure is as old as its last sync; the central store settles any shortfall
+    st.warning(f"Stock at last sync shows only {max(available, 0)} {name}.")
+    return True
 
 def display_cart():
     """Display current shopping cart"""
     st.subheader("🛒 Current Order")
+    cart = st.session_state.cart
     
-    if not st.session_state.cart:
+    if not cart:
         st.info("Cart is empty. Add items to get started.")
         return
     
-    # Create cart dataframe
-    cart_df = pd.DataFrame(st.session_state.cart)
-    
-    # Display cart items
-    for idx, item in enumerate(st.session_state.cart):
-        col1, col2, col3, col4, col5 = st.columns([3, 1, 1, 1, 1])
-        
-        with col1:
-            st.write(f"**{item['name']}**")
-            st.caption(f"Species: {item['species']}")
-        
-        with col2:
-            st.write(f"${item['price']:.2f}")
-        
-        with col3:
-            # Quantity adjustment
-            new_qty = st.number_input(
-                "Qty", 
-                min_value=1, 
-                value=item['quantity'], 
-                key=f"qty_{idx}"
-            )
-            if new_qty != item['quantity']:
-                item['quantity'] = new_qty
-                item['subtotal'] = item['price'] * new_qty
-                item['profit'] = (item['price'] - item['cost']) * new_qty
-                st.rerun()
-        
-        with col4:
-            st.write(f"${item['subtotal']:.2f}")
-        
-        with col5:
-            if st.button("🗑️", key=f"remove_{idx}", help="Remove item"):
-                st.session_state.cart.pop(idx)
-                st.rerun()
+    # Quantities are edited in one form and applied together on submit, so typing never reruns the page
+    with st.form("cart_form"):
+        edited = st.data_editor(
+            cart.to_frame(),
+            hide_index=True,
+            use_container_width=True,
+            disabled=['name', 'species', 'price', 'subtotal', 'profit'],
+            column_config={
+                'item_id': None,
+                'name': st.column_config.TextColumn("Item"),
+                'species': st.column_config.TextColumn("Species"),
+                'price': st.column_config.NumberColumn("Price", format="$%.2f"),
+                'quantity': st.column_config.NumberColumn("Qty", min_value=0, step=1, help="Set to 0 to remove"),
+                'subtotal': st.column_config.NumberColumn("Subtotal", format="$%.2f"),
+                'profit': st.column_config.NumberColumn("Profit", format="$%.2f")
+            },
+            key=f"cart_editor_{cart.version}"
+        )
+        if st.form_submit_button("🔄 Update Cart"):
+            update_cart(edited)
     
     # Cart totals
-    st.markdown("---")
-    total_amount = sum(item['subtotal'] for item in st.session_state.cart)
-    total_profit = sum(item['profit'] for item in st.session_state.cart)
-    total_items = sum(item['quantity'] for item in st.session_state.cart)
-    
     col1, col2, col3 = st.columns(3)
     with col1:
-        st.metric("Total Items", total_items)
+        st.metric("Total Items", cart.total_items)
     with col2:
-        st.metric("Total Revenue", f"${total_amount:.2f}")
+        st.metric("Total Revenue", f"${cart.total_revenue:.2f}")
     with col3:
-        st.metric("Total Profit", f"${total_profit:.2f}")
+        st.metric("Total Profit", f"${cart.total_profit:.2f}")
+
+def update_cart(edited):
+    """Apply the cart editor's quantities as one batch"""
+    cart = st.session_state.cart
+    quantities = {int(item_id): int(quantity) for item_id, quantity
+                  in zip(edited['item_id'], edited['quantity'].fillna(0))}
+    
+    species_totals = {}
+    for line in cart:
+        species_totals[line['species']] = species_totals.get(line['species'], 0) + quantities.get(line['item_id'], 0)
+    for species, wanted in species_totals.items():
+        if wanted > cart.species_quantity(species) and not check_stock(species, wanted, species):
+            return
+    
+    if cart.apply_edits(quantities):
+        st.rerun()
 
 def checkout_section():
     """Checkout and payment processing"""
@@ -192,6 +263,7 @@ def checkout_section():
     with col1:
         customer_name = st.text_input("Customer Name (Optional)")
         customer_email = st.text_input("Customer Email (Optional)")
+        member_username = st.text_input("Member Username (Optional)", help="Premium members get the member discount")
     
     with col2:
         payment_method = st.selectbox("Payment Method", [
@@ -199,12 +271,18 @@ def checkout_section():
         ])
         notes = st.text_area("Order Notes (Optional)")
     
-    # Order summary
-    total_amount = sum(item['subtotal'] for item in st.session_state.cart)
+    priced = get_pricing_engine().price(st.session_state.cart, 'retail', member_username)
     
+    # Order summary
     st.write("### Order Summary")
-    st.write(f"**Order Number:** {st.session_state.order_number}")
-    st.write(f"**Total Amount:** ${total_amount:.2f}")
+    st.write("**Order Number:** assigned when payment is processed")
+    st.write(f"**Subtotal:** ${priced['subtotal']:.2f}")
+    if priced['discount']:
+        member_note = " (includes member discount)" if priced['member'] else ""
+        st.write(f"**Discount:** -${priced['discount']:.2f}{member_note}")
+    if priced['tax']:
+        st.write(f"**Tax:** ${priced['tax']:.2f}")
+    st.write(f"**Total Amount:** ${priced['total']:.2f}")
     st.write(f"**Payment Method:** {payment_method}")
     
     # Process payment
@@ -212,106 +290,110 @@ def checkout_section():
     
     with col1:
         if st.button("💰 Process Payment", type="primary"):
-            process_payment(customer_name, customer_email, payment_method, notes)
+            process_payment(customer_name or member_username, customer_email, payment_method, notes, priced)
     
     with col2:
         if st.button("🗑️ Clear Cart"):
-            st.session_state.cart = []
+            st.session_state.cart = Cart()
             st.rerun()
 
-def process_payment(customer_name, customer_email, payment_method, notes):
+def process_payment(customer_name, customer_email, payment_method, notes, priced):
     """Process the payment and save transaction"""
     try:
-        # Calculate totals
-        total_revenue = sum(item['subtotal'] for item in st.session_state.cart)
-        total_cost = sum(item['cost'] * item['quantity'] for item in st.session_state.cart)
-        total_profit = total_revenue - total_cost
-        
-        # Create transaction record
-        transaction = {
-            'order_number': st.session_state.order_number,
-            'date': datetime.datetime.now().strftime('%Y-%m-%d'),
-            'time': datetime.datetime.now().strftime('%H:%M:%S'),
-            'cashier': st.session_state.username,
-            'customer_name': customer_name or 'Walk-in Customer',
-            'customer_email': customer_email or '',
-            'payment_method': payment_method,
-            'total_items': sum(item['quantity'] for item in st.session_state.cart),
-            'total_revenue': total_revenue,
-            'total_cost': total_cost,
-            'total_profit': total_profit,
-            'notes': notes
-        }
-        
-        # Save transaction
-        save_to_csv('pos_transactions.csv', transaction)
+        # Header and lines are committed together; retries with the same key return the original order
+        transaction, created = checkout_backend().checkout(
+            priced['lines'],
+            st.session_state.checkout_key,
+            st.session_state.username,
+            customer_name=customer_name,
+            customer_email=customer_email,
+            payment_method=payment_method,
+            notes=notes,
+            discount=priced['discount'],
+            tax=priced['tax']
+        )
         
-        # Save individual items
-        for item in st.session_state.cart:
-            item_record = {
-                'order_number': st.session_state.order_number,
-                'date': datetime.datetime.now().strftime('%Y-%m-%d'),
-                'time': datetime.datetime.now().strftime('%H:%M:%S'),
-                'item_id': item['item_id'],
-                'item_name': item['name'],
-                'species': item['species'],
-                'quantity': item['quantity'],
-                'unit_price': item['price'],
-                'unit_cost': item['cost'],
-                'subtotal_revenue': item['subtotal'],
-                'subtotal_profit': item['profit'],
-                'cashier': st.session_state.username
-            }
-            save_to_csv('pos_items.csv', item_record)
+        if not created:
+            st.info(f"Order #{transaction['order_number']} was already recorded; not charging again.")
         
         # Show success message
         st.success(f"✅ Payment processed successfully!")
-        st.success(f"Order #{st.session_state.order_number} completed")
+        st.success(f"Order #{transaction['order_number']} completed")
         st.balloons()
         
-        # Generate receipt
-        generate_receipt(transaction)
+        # Store the receipt; it is displayed after the rerun
+        get_receipt_store().save(build_receipt(transaction, priced['lines'], load_receipt_settings()))
         
-        # Reset cart and generate new order number
-        st.session_state.cart = []
-        st.session_state.order_number = generate_order_number()
+        # Reset cart and start a new checkout attempt
+        st.session_state.cart = Cart()
+        st.session_state.checkout_key = new_idempotency_key()
+        st.session_state.last_order_number = transaction['order_number']
         
         st.rerun()
         
+    except InsufficientStock as e:
+        st.error(f"Payment not processed: {str(e)}")
     except Exception as e:
         st.error(f"Payment processing failed: {str(e)}")
 
-def generate_receipt(transaction):
-    """Generate and display receipt"""
+def generate_receipt(order_number, context='terminal'):
+    """Display a stored receipt with print downloads"""
+    receipt = get_receipt_store().get(order_number)
+    if receipt is None:
+        st.warning(f"No receipt found for order #{order_number}")
+        return
+    
     st.write("### 🧾 Receipt")
+    st.markdown(render_receipt(receipt, 'html'), unsafe_allow_html=True)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("📄 Download PDF", data=render_receipt(receipt, 'pdf'),
+                           file_name=f"receipt_{order_number}.pdf", mime="application/pdf",
+                           key=f"{context}_receipt_pdf_{order_number}")
+    with col2:
+        st.download_button("🖨️ Thermal Printer (ESC/POS)", data=render_receipt(receipt, 'escpos'),
+                           file_name=f"receipt_{order_number}.bin", mime="application/octet-stream",
+                           key=f"{context}_receipt_escpos_{order_number}")
+
+def receipt_reprints():
+    """Receipt lookup and background batch reprints"""
+    st.subheader("🧾 Receipts")
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        lookup_order = st.text_input("Receipt for Order Number")
+        if lookup_order:
+            generate_receipt(lookup_order.strip(), context='lookup')
     
-    receipt_html = f"""
-    <div style="border: 1px solid #ccc; padding: 20px; margin: 10px 0; font-family: monospace;">
-        <h3 style="text-align: center;">🦋 Butterfly Haven</h3>
-        <p style="text-align: center;">Sales Receipt</p>
-        <hr>
-        <p><strong>Order #:</strong> {transaction['order_number']}</p>
-        <p><strong>Date:</strong> {transaction['date']} {transaction['time']}</p>
-        <p><strong>Cashier:</strong> {transaction['cashier']}</p>
-        <p><strong>Customer:</strong> {transaction['customer_name']}</p>
-        <hr>
-    """
-    
-    for item in st.session_state.cart:
-        receipt_html += f"""
-        <p>{item['quantity']}x {item['name']} @ ${item['price']:.2f} = ${item['subtotal']:.2f}</p>
-        """
-    
-    receipt_html += f"""
-        <hr>
-        <p><strong>Total: ${transaction['total_revenue']:.2f}</strong></p>
-        <p><strong>Payment: {transaction['payment_method']}</strong></p>
-        <hr>
-        <p style="text-align: center;">Thank you for your purchase!</p>
-    </div>
-    """
-    
-    st.markdown(receipt_html, unsafe_allow_html=True)
+    with col2:
+        with st.form("receipt_batch_form"):
+            st.write("**Batch Reprint**")
+            start_date = st.date_input("From", value=datetime.date.today(), key="receipt_batch_start")
+            end_date = st.date_input("To", value=datetime.date.today(), key="receipt_batch_end")
+            fmt = st.selectbox("Format", RECEIPT_FORMATS,
+                               format_func=lambda x: "PDF" if x == 'pdf' else "Thermal (ESC/POS)")
+            if st.form_submit_button("🖨️ Generate"):
+                order_numbers = get_receipt_store().order_numbers(start_date, end_date)
+                if order_numbers:
+                    st.session_state.receipt_job = get_receipt_worker().submit(order_numbers, fmt)
+                else:
+                    st.info("No transactions in that date range.")
+        
+        job = get_receipt_worker().status(st.session_state.receipt_job) if 'receipt_job' in st.session_state else None
+        if job is not None:
+            if job['state'] == 'done':
+                st.success(f"{job['done']} receipts ready")
+                with open(job['path'], 'rb') as f:
+                    st.download_button("📥 Download Batch", data=f.read(), file_name=os.path.basename(job['path']),
+                                       mime="application/pdf" if job['format'] == 'pdf' else "application/octet-stream")
+            elif job['state'] == 'failed':
+                st.error(f"Receipt batch failed: {job['error']}")
+            else:
+                st.progress(job['done'] / max(job['total'], 1), text=f"Generating receipts: {job['done']}/{job['total']}")
+                if st.button("🔄 Refresh Status"):
+                    st.rerun()
 
 def sales_analytics():
     """Sales analytics and reporting"""
@@ -325,6 +407,9 @@ def sales_analytics():
         st.info("No sales data available yet.")
         return
     
+    if get_terminal_sync() is None:
+        live_today()
+    
     # Date range filter
     col1, col2 = st.columns(2)
     with col1:
@@ -394,109 +479,428 @@ def sales_analytics():
         
         st.dataframe(top_items.head(10), use_container_width=True)
 
+def live_today():
+    """Today's breakdowns and top sellers, updated as each terminal checks out"""
+    live = get_sales_aggregates().snapshot()
+    st.subheader("⚡ Today (live, all terminals)")
+    totals = live['totals']
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Orders", totals['orders'])
+    with col2:
+        st.metric("Collected", f"${totals['collected']:,.2f}")
+    with col3:
+        st.metric("Profit", f"${totals['profit']:,.2f}")
+    with col4:
+        st.metric("Avg Order", f"${totals['avg_order']:,.2f}")
+    
+    if not totals['orders']:
+        return
+    
+    col1, col2, col3 = st.columns(3)
+    for column, title, breakdown in ((col1, "By Cashier", 'by_cashier'), (col2, "By Payment Method", 'by_payment_method'),
+                                     (col3, "By Terminal", 'by_terminal')):
+        with column:
+            st.write(f"**{title}**")
+            st.dataframe(pd.DataFrame.from_dict(live[breakdown], orient='index').round(2), use_container_width=True)
+    
+    st.write("**Top Sellers Today**")
+    st.dataframe(pd.DataFrame(live['top_sellers'])[['item_name', 'quantity', 'revenue', 'profit']].round(2),
+                 use_container_width=True, hide_index=True)
+
 def transaction_history():
     """Display transaction history"""
     st.header("📋 Transaction History")
     
-    # Load data
-    transactions_df = load_from_csv('pos_transactions.csv')
-    
-    if transactions_df.empty:
+    history = get_transaction_history()
+    if history.count() == 0:
         st.info("No transactions recorded yet.")
+        receipt_reprints()
         return
     
-    # Search and filter options
+    # Search and filter options (matched against the row index, not the file)
     col1, col2, col3 = st.columns(3)
     
     with col1:
         search_order = st.text_input("Search by Order Number")
+        payment_filter = st.multiselect("Payment Method", history.payment_methods())
     
     with col2:
         search_customer = st.text_input("Search by Customer Name")
+        cashier_filter = st.multiselect("Cashier", history.cashiers())
     
     with col3:
-        payment_filter = st.selectbox("Filter by Payment Method", 
-                                    ["All"] + transactions_df['payment_method'].unique().tolist())
+        date_range = st.date_input("Date Range", value=(), key="history_date_range")
+        page_size = st.selectbox("Rows per page", [25, 50, 100], key="history_page_size")
+    
+    filters = {
+        'payment_methods': payment_filter,
+        'cashiers': cashier_filter,
+        'customer': search_customer,
+        'order_search': search_order,
+        'date_from': date_range[0] if len(date_range) > 0 else None,
+        'date_to': date_range[1] if len(date_range) > 1 else (date_range[0] if len(date_range) > 0 else None)
+    }
     
-    # Apply filters
-    filtered_df = transactions_df.copy()
+    # Cursors of the pages visited so far; any filter change starts again from the newest
+    filter_state = (repr(filters), page_size)
+    if st.session_state.get('history_filters') != filter_state:
+        st.session_state.history_filters = filter_state
+        st.session_state.history_cursors = [None]
+    cursors = st.session_state.history_cursors
     
-    if search_order:
-        filtered_df = filtered_df[filtered_df['order_number'].str.contains(search_order, case=False, na=False)]
+    total = history.count(**filters)
+    st.subheader(f"Transactions ({total} found)")
     
-    if search_customer:
-        filtered_df = filtered_df[filtered_df['customer_name'].str.contains(search_customer, case=False, na=False)]
+    if total:
+        page, next_cursor = history.page(cursors[-1], page_size, **filters)
+        st.dataframe(page, use_container_width=True, hide_index=True)
+        
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col1:
+            if st.button("⬅️ Newer", disabled=len(cursors) == 1):
+                cursors.pop()
+                st.rerun()
+        with col2:
+            st.caption(f"Page {len(cursors)} of {(total + page_size - 1) // page_size}, newest first")
+        with col3:
+            if st.button("Older ➡️", disabled=next_cursor is None):
+                cursors.append(next_cursor)
+                st.rerun()
+        
+        # Export the full filtered result, streamed to disk rather than built in memory
+        compress = st.checkbox("Compress export (gzip)", value=False, key="history_export_gzip")
+        if st.button("📦 Prepare Export"):
+            st.session_state.history_export = history.export(compress, **filters)
+        
+        export_path = st.session_state.get('history_export')
+        if export_path and os.path.exists(export_path):
+            with open(export_path, 'rb') as f:
+                st.download_button(
+                    label=f"📥 Export to CSV ({os.path.getsize(export_path) / 1024:.1f} KB)",
+                    data=f,
+                    file_name=os.path.basename(export_path),
+                    mime="application/gzip" if export_path.endswith('.gz') else "text/csv"
+                )
+    else:
+        st.info("No transactions match your search criteria.")
+    
+    receipt_reprints()
+
+def checkout_backend():
+    """Terminal sync when this POS runs as a remote terminal, else the central checkout pipeline"""
+    terminal = get_terminal_sync()
+    return terminal if terminal is not None else get_checkout_pipeline()
+
+def stock_available(species):
+    """Adult stock available to this POS"""
+    terminal = get_terminal_sync()
+    if terminal is not None:
+        return terminal.available(species, 'adult')
+    return get_inventory().available(species, 'adult')
+
+def stock_tracked(species):
+    """Whether sales of a species are held to its stock (remote terminals defer to the central store)"""
+    return get_terminal_sync() is not None or get_inventory().tracks(species)
+
+def inventory_management():
+    """Stock levels and manual adjustments"""
+    st.header("📦 Inventory")
+    st.caption("Stock is added when breeding batches reach the pupa or adult stage and taken by sales. "
+               "A species is only held to its stock once it has an entry here (opening balance, "
+               "adjustment or emerged batch); record an adjustment to start tracking one.")
+    
+    inventory = get_inventory()
+    stock = inventory.stock_table()
+    if stock.empty:
+        st.info("No stock recorded yet.")
+    else:
+        st.dataframe(stock, use_container_width=True, hide_index=True)
+    
+    st.subheader("Stock Adjustment")
+    with st.form("stock_adjustment_form"):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            species = st.selectbox("Species", sorted({item['species'] for item in BUTTERFLY_ITEMS.values()}))
+        with col2:
+            stage = st.selectbox("Stage", STOCK_STAGES, index=STOCK_STAGES.index('adult'))
+        with col3:
+            delta = st.number_input("Quantity Change", value=0, step=1, help="Negative values remove stock")
+        reason = st.text_input("Reason", value="Stock count")
+        
+        if st.form_submit_button("Record Adjustment") and delta != 0:
+            try:
+                inventory.record([([movement(species, stage, delta)], 'adjustment', reason, st.session_state.username)])
+                st.success(f"Recorded {delta:+d} {species} ({stage})")
+                st.rerun()
+            except InsufficientStock as e:
+                st.error(str(e))
+
+def end_of_day():
+    """Z-report closing and reconciliation"""
+    st.header("🧮 End of Day")
+    st.caption("Closing a day issues a Z-report that cannot be edited; closing it again after late sales issues a superseding report.")
     
-    if payment_filter != "All":
-        filtered_df = filtered_df[filtered_df['payment_method'] == payment_filter]
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        day = st.date_input("Business Day", value=datetime.date.today(), key="z_report_day")
+    with col2:
+        st.write("")
+        if st.button("🔒 Close Day", type="primary"):
+            try:
+                report, issued = close_day(day, st.session_state.username)
+                if issued:
+                    st.success(f"Z-report {report['report_id']} issued")
+                else:
+                    st.info(f"No new sales since {report['report_id']}; existing report kept")
+            except Exception as e:
+                st.error(f"Failed to close day: {str(e)}")
+    
+    reports = load_z_reports(day=day)
+    if not reports:
+        st.info("This day has not been closed yet.")
+        return
     
-    # Display transactions
-    st.subheader(f"Transactions ({len(filtered_df)} found)")
+    report = reports[0]
+    if not report['verified']:
+        st.error(f"Z-report {report['report_id']} does not match its checksum and may have been altered")
+    st.subheader(f"Z-Report {report['report_id']}")
+    st.caption(f"Closed by {report['closed_by']} at {report['closed_at']}"
+               + (f" · supersedes {report['supersedes']}" if report['supersedes'] else ""))
+    
+    totals = report['totals']
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Orders", totals['orders'])
+    with col2:
+        st.metric("Items Sold", totals['total_items'])
+    with col3:
+        st.metric("Collected", f"${totals['collected']:,.2f}")
+    with col4:
+        st.metric("Discounts", f"${totals['discount']:,.2f}")
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.write("**By Terminal**")
+        st.dataframe(pd.DataFrame(report['by_terminal']), use_container_width=True, hide_index=True)
+    with col2:
+        st.write("**By Cashier**")
+        st.dataframe(pd.DataFrame(report['by_cashier']), use_container_width=True, hide_index=True)
+    with col3:
+        st.write("**By Payment Method**")
+        st.dataframe(pd.DataFrame(report['by_payment_method']), use_container_width=True, hide_index=True)
     
-    if not filtered_df.empty:
-        # Sort by date (most recent first)
-        filtered_df = filtered_df.sort_values(['date', 'time'], ascending=False)
-        st.dataframe(filtered_df, use_container_width=True)
+    if report['mismatches']:
+        st.warning(f"⚠️ {len(report['mismatches'])} orders do not reconcile")
+        st.dataframe(pd.DataFrame(report['mismatches']), use_container_width=True, hide_index=True)
+    else:
+        st.success("All order headers match their lines")
+    
+    st.download_button("📥 Download Z-Report", data=json.dumps(report, indent=2, default=str),
+                       file_name=f"{report['report_id']}.json", mime="application/json")
+    
+    if len(reports) > 1:
+        with st.expander(f"Earlier reports for this day ({len(reports) - 1})"):
+            st.dataframe(pd.DataFrame([{'report_id': r['report_id'], 'closed_at': r['closed_at'],
+                                        'closed_by': r['closed_by'], 'orders': r['totals']['orders'],
+                                        'collected': r['totals']['collected'], 'verified': r['verified']}
+                                       for r in reports[1:]]), use_container_width=True, hide_index=True)
+
+def pricing_settings():
+    """Tax, discounts, promotions and price list, saved for the pricing engine"""
+    rules = load_rules()
+    species_options = sorted({item['species'] for item in BUTTERFLY_ITEMS.values()})
+    
+    with st.form("pricing_rules_form"):
+        # Tax settings
+        st.subheader("Tax Configuration")
+        tax_rate = st.number_input("Tax Rate (%)", min_value=0.0, max_value=50.0,
+                                   value=float(rules['tax_rate']), step=0.1)
+        
+        # Discount settings
+        st.subheader("Discount Options")
+        col1, col2 = st.columns(2)
+        with col1:
+            member_discount = st.number_input("Premium Member Discount (%)", min_value=0.0, max_value=100.0,
+                                              value=float(rules['member_discount']), step=0.5)
+        with col2:
+            max_discount = st.number_input("Maximum Discount (%)", min_value=0.0, max_value=100.0,
+                                           value=float(rules['max_discount']))
         
-        # Export option
-        csv_data = filtered_df.to_csv(index=False)
-        st.download_button(
-            label="📥 Export to CSV",
-            data=csv_data,
-            file_name=f"transactions_{datetime.date.today()}.csv",
-            mime="text/csv"
+        st.write("**Wholesale Tiers** (discount per line by quantity)")
+        tiers = st.data_editor(
+            pd.DataFrame(rules['tiers'], columns=['min_quantity', 'discount']),
+            num_rows="dynamic", use_container_width=True, hide_index=True, key="pricing_tiers",
+            column_config={
+                'min_quantity': st.column_config.NumberColumn("Min Quantity", min_value=1, step=1),
+                'discount': st.column_config.NumberColumn("Discount (%)", min_value=0.0, max_value=100.0)
+            }
         )
-    else:
-        st.info("No transactions match your search criteria.")
+        
+        st.write("**Species Promotions**")
+        promotions = pd.DataFrame(rules['promotions'], columns=['species', 'discount', 'start', 'end'])
+        promotions['start'] = pd.to_datetime(promotions['start'], errors='coerce').dt.date
+        promotions['end'] = pd.to_datetime(promotions['end'], errors='coerce').dt.date
+        promotions = st.data_editor(
+            promotions, num_rows="dynamic", use_container_width=True, hide_index=True, key="pricing_promotions",
+            column_config={
+                'species': st.column_config.SelectboxColumn("Species", options=species_options, required=True),
+                'discount': st.column_config.NumberColumn("Discount (%)", min_value=0.0, max_value=100.0),
+                'start': st.column_config.DateColumn("Starts"),
+                'end': st.column_config.DateColumn("Ends")
+            }
+        )
+        
+        st.write("**Retail Price List**")
+        retail = rules['prices'].get('retail', {})
+        price_list = st.data_editor(
+            pd.DataFrame([{'species': item['species'], 'item': item['name'], 'default_price': item['price'],
+                           'price': retail.get(item['species'], item['price'])} for item in BUTTERFLY_ITEMS.values()]),
+            use_container_width=True, hide_index=True, disabled=['species', 'item', 'default_price'],
+            key="pricing_price_list",
+            column_config={'price': st.column_config.NumberColumn("Price", min_value=0.0, format="$%.2f")}
+        )
+        
+        if st.form_submit_button("💾 Save Pricing"):
+            rules['tax_rate'] = tax_rate
+            rules['member_discount'] = member_discount
+            rules['max_discount'] = max_discount
+            rules['tiers'] = [{'min_quantity': int(row.min_quantity), 'discount': float(row.discount)}
+                              for row in tiers.dropna().itertuples()]
+            rules['promotions'] = [{'species': row.species, 'discount': float(row.discount),
+                                    'start': str(row.start) if pd.notna(row.start) else '',
+                                    'end': str(row.end) if pd.notna(row.end) else ''}
+                                   for row in promotions.dropna(subset=['species', 'discount']).itertuples()]
+            rules['prices']['retail'] = {row.species: float(row.price) for row in price_list.itertuples()
+                                         if pd.notna(row.price) and float(row.price) != float(row.default_price)}
+            save_rules(rules)
+            st.success("Pricing saved")
+
+def data_retention():
+    """Retention policies, dry runs and archival"""
+    st.subheader("🗄️ Data Retention")
+    st.caption(f"Rows older than a table's retention period are moved into compressed archives under {RETENTION_ARCHIVE_DIR}. "
+               "POS days are closed with a Z-report first; line items follow their orders.")
+    
+    policies = load_retention_policies()
+    with st.form("retention_policies_form"):
+        edited = {}
+        for table, policy in policies['tables'].items():
+            col1, col2 = st.columns([2, 1])
+            with col1:
+                label = "pos_transactions + pos_items" if table == 'pos_transactions' else table
+                enabled = st.checkbox(f"Archive {label}", value=policy['enabled'], key=f"retention_enabled_{table}")
+            with col2:
+                keep_days = st.number_input("Keep (days)", min_value=1, max_value=3650, value=int(policy['keep_days']),
+                                            key=f"retention_days_{table}")
+            edited[table] = {'enabled': enabled, 'keep_days': int(keep_days)}
+        schedule_hour = st.number_input("Daily run after (hour)", min_value=0, max_value=23,
+                                        value=int(policies['schedule_hour']))
+        if st.form_submit_button("💾 Save Policies"):
+            save_retention_policies({'schedule_hour': int(schedule_hour), 'tables': edited})
+            st.success("Retention policies saved")
+    
+    job = get_retention_job()
+    status = job.status()
+    st.caption(f"Scheduled job {'running' if status['running'] else 'stopped'} · daily after {status['schedule_hour']:02d}:00"
+               f" · last run {status['last_run_day'] or 'never'}")
+    if status['last_error']:
+        st.error(f"Last retention run failed: {status['last_error']}")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("🔍 Preview (Dry Run)"):
+            report = job.run_now(dry_run=True, run_by=st.session_state.username)
+            st.dataframe(pd.DataFrame(report['tables']).drop(columns=['file']), use_container_width=True, hide_index=True)
+    with col2:
+        if st.button("🗄️ Archive Now"):
+            try:
+                report = job.run_now(run_by=st.session_state.username)
+                archived = sum(table['archived'] for table in report['tables'])
+                st.success(f"Archived {archived} rows in {report['seconds']}s")
+            except Exception as e:
+                st.error(f"Archival failed: {str(e)}")
+    
+    runs = [run for run in load_retention_runs() if not run['dry_run']]
+    if runs:
+        with st.expander("Recent archival runs"):
+            st.dataframe(pd.DataFrame([{'run_id': run['run_id'], 'run_by': run['run_by'], 'started_at': run['started_at'],
+                                        'table': table['table'], 'archived': table['archived'], 'kept': table['kept'],
+                                        'archive': table['archive']}
+                                       for run in runs for table in run['tables']]),
+                         use_container_width=True, hide_index=True)
 
 def pos_settings():
     """POS system settings"""
     st.header("⚙️ POS Settings")
     
-    # Tax settings
-    st.subheader("Tax Configuration")
-    tax_rate = st.number_input("Tax Rate (%)", min_value=0.0, max_value=50.0, value=0.0, step=0.1)
-    
-    # Discount settings
-    st.subheader("Discount Options")
-    enable_discounts = st.checkbox("Enable Customer Discounts")
-    
-    if enable_discounts:
-        max_discount = st.number_input("Maximum Discount (%)", min_value=0.0, max_value=100.0, value=10.0)
+    pricing_settings()
     
     # Receipt settings
     st.subheader("Receipt Configuration")
-    business_name = st.text_input("Business Name", value="Butterfly Haven")
-    business_address = st.text_area("Business Address")
-    receipt_footer = st.text_area("Receipt Footer Message", 
-                                value="Thank you for your purchase!")
+    receipt_settings = load_receipt_settings()
+    with st.form("receipt_settings_form"):
+        business_name = st.text_input("Business Name", value=receipt_settings['business_name'])
+        business_address = st.text_area("Business Address", value=receipt_settings['business_address'])
+        receipt_footer = st.text_area("Receipt Footer Message", 
+                                    value=receipt_settings['footer'])
+        paper_width = st.selectbox("Thermal Paper", [42, 32], index=0 if receipt_settings['width'] != 32 else 1,
+                                   format_func=lambda x: "80 mm (42 characters)" if x == 42 else "58 mm (32 characters)")
+        if st.form_submit_button("💾 Save Receipt Settings"):
+            save_receipt_settings({'business_name': business_name, 'business_address': business_address,
+                                   'footer': receipt_footer, 'width': paper_width})
+            st.success("Receipt settings saved; new receipts use them, reprints keep their original layout")
+    
+    # Terminal sync
+    st.subheader("Terminal Sync")
+    terminal = get_terminal_sync()
+    if terminal is not None:
+        status = terminal.status()
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Waiting to Sync", status['pending_orders'])
+        with col2:
+            st.metric("Stock Conflicts", status['stock_conflicts'])
+        with col3:
+            st.metric("Last Sync", status['last_sync'] or "Never")
+        if status['last_error']:
+            st.warning(f"Central store unreachable: {status['last_error']}")
+        if st.button("🔄 Sync Now"):
+            try:
+                st.success(f"Synced {terminal.sync_all()} sales")
+            except Exception as e:
+                st.error(f"Sync failed: {str(e)}")
+    elif st.session_state.get('user_role') == 'admin':
+        server = get_central_server()
+        st.write(f"**Sync endpoint:** {f'accepting terminal sales on {server.host}:{server.port}' if server.running else 'stopped'}")
+        st.caption("Remote terminals run with POS_CENTRAL_URL pointing at this endpoint, a unique POS_TERMINAL_ID "
+                   "(defaults to the host name) and the same POS_SYNC_TOKEN as this POS. The endpoint listens on "
+                   "POS_SYNC_HOST (default 127.0.0.1; set it to this machine's LAN address for remote terminals).")
+        if st.button("⏹️ Stop Sync Endpoint" if server.running else "▶️ Start Sync Endpoint"):
+            try:
+                server.stop() if server.running else server.start()
+                st.rerun()
+            except (OSError, ValueError) as e:
+                st.error(f"Could not start sync endpoint: {str(e)}")
+    else:
+        st.info("This POS records sales directly to the central store.")
     
     # Data management
     st.subheader("Data Management")
     
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        if st.button("📊 Export All Sales Data"):
-            transactions_df = load_from_csv('pos_transactions.csv')
-            items_df = load_from_csv('pos_items.csv')
-            
-            if not transactions_df.empty:
-                csv_data = transactions_df.to_csv(index=False)
-                st.download_button(
-                    label="Download Transactions",
-                    data=csv_data,
-                    file_name=f"all_transactions_{datetime.date.today()}.csv",
-                    mime="text/csv"
-                )
+    if st.button("📊 Export All Sales Data"):
+        transactions_df = load_from_csv('pos_transactions.csv')
+        items_df = load_from_csv('pos_items.csv')
+        
+        if not transactions_df.empty:
+            csv_data = transactions_df.to_csv(index=False)
+            st.download_button(
+                label="Download Transactions",
+                data=csv_data,
+                file_name=f"all_transactions_{datetime.date.today()}.csv",
+                mime="text/csv"
+            )
     
-    with col2:
-        if st.button("🗑️ Clear Old Data (30+ days)"):
-            st.warning("This will permanently delete old transaction data!")
-            if st.button("Confirm Delete"):
-                # Implementation for clearing old data
-                st.success("Old data cleared successfully!")
-
-def generate_order_number():
-    """Generate a unique order number"""
-    return f"ORD{datetime.datetime.now().strftime('%Y%m%d')}{random.randint(1000, 9999)}"
+    if st.session_state.get('user_role') == 'admin':
+        data_retention()
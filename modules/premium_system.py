@@ -96,6 +96,20 @@ def get_user_premium_status(user_id):
         }
     return None
 
+def get_premium_usernames():
+    """Usernames with an active premium membership"""
+    conn = sqlite3.connect(DATABASE_FILE)
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        SELECT username FROM users
+        WHERE is_premium = 1 AND (premium_end_date IS NULL OR premium_end_date >= ?)
+    ''', (datetime.now().date().isoformat(),))
+    
+    usernames = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return usernames
+
 def claim_signup_bonus(user_id, username):
     """Claim 200 pesos signup bonus"""
     conn = sqlite3.connect(DATABASE_FILE)
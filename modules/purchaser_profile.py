@@ -3,6 +3,8 @@ import pandas as pd
 import datetime
 from utils.csv_handlers import save_to_csv, load_from_csv
 from modules.ui_components import display_header, create_metric_card, create_info_card
+from utils.inventory import get_inventory, movement, InsufficientStock
+from utils.pricing import get_pricing_engine
 
 def purchaser_profile_app():
     """Enhanced purchaser profile and purchase management system"""
@@ -81,24 +83,29 @@ def display_quick_order_system():
     """Enhanced quick order system for frequent purchasers"""
     st.subheader("🛍️ Quick Order System")
     
-    # Butterfly species inventory
+    # Butterfly species catalog; stock comes from the inventory ledger
     butterfly_species = {
-        'Butterfly-Common Lime': {'price': 150, 'stock': 25, 'description': 'Beautiful citrus butterfly, perfect for gardens'},
-        'Butterfly-Common Mormon': {'price': 200, 'stock': 15, 'description': 'Large black swallowtail with stunning patterns'},
-        'Butterfly-Paper Kite': {'price': 180, 'stock': 20, 'description': 'Elegant white butterfly with black markings'},
-        'Butterfly-Emerald Swallowtail': {'price': 300, 'stock': 8, 'description': 'Rare green butterfly, collector\'s favorite'},
-        'Butterfly-Golden Birdwing': {'price': 500, 'stock': 3, 'description': 'Premium species, very rare and beautiful'},
-        'Butterfly-Plain Tiger': {'price': 120, 'stock': 30, 'description': 'Hardy species, great for beginners'},
-        'Moth-Atlas': {'price': 250, 'stock': 12, 'description': 'One of the largest moths in the world'},
-        'Butterfly-Red Lacewing': {'price': 220, 'stock': 10, 'description': 'Stunning red patterns, eye-catching display'}
+        'Butterfly-Common Lime': {'price': 150, 'description': 'Beautiful citrus butterfly, perfect for gardens'},
+        'Butterfly-Common Mormon': {'price': 200, 'description': 'Large black swallowtail with stunning patterns'},
+        'Butterfly-Paper Kite': {'price': 180, 'description': 'Elegant white butterfly with black markings'},
+        'Butterfly-Emerald Swallowtail': {'price': 300, 'description': 'Rare green butterfly, collector\'s favorite'},
+        'Butterfly-Golden Birdwing': {'price': 500, 'description': 'Premium species, very rare and beautiful'},
+        'Butterfly-Plain Tiger': {'price': 120, 'description': 'Hardy species, great for beginners'},
+        'Moth-Atlas': {'price': 250, 'description': 'One of the largest moths in the world'},
+        'Butterfly-Red Lacewing': {'price': 220, 'description': 'Stunning red patterns, eye-catching display'}
     }
+    inventory = get_inventory()
+    engine = get_pricing_engine()
+    for species, info in butterfly_species.items():
+        # None: the species has no ledger entries yet, so its stock is not tracked
+        info['stock'] = max(inventory.available(species, 'adult'), 0) if inventory.tracks(species) else None
+        info['price'] = engine.list_price(species, info['price'], channel='online')
     
     # Quick order form
     with st.form("quick_order_form"):
         st.write("**Select Species and Quantities:**")
         
-        order_items = []
-        total_amount = 0
+        order_lines = []
         
         for species, info in butterfly_species.items():
             col1, col2, col3, col4 = st.columns([3, 1, 1, 1])
@@ -111,8 +118,11 @@ def display_quick_order_system():
                 st.write(f"₱{info['price']}")
             
             with col3:
-                stock_color = "🟢" if info['stock'] > 10 else "🟡" if info['stock'] > 5 else "🔴"
-                st.write(f"{stock_color} {info['stock']}")
+                if info['stock'] is None:
+                    st.write("—")
+                else:
+                    stock_color = "🟢" if info['stock'] > 10 else "🟡" if info['stock'] > 5 else "🔴"
+                    st.write(f"{stock_color} {info['stock']}")
             
             with col4:
                 quantity = st.number_input(
@@ -120,18 +130,22 @@ def display_quick_order_system():
                     min_value=0, 
                     max_value=info['stock'], 
                     value=0, 
-                    key=f"qty_{species}"
+                    key=f"qty_{species}",
+                    disabled=info['stock'] == 0
                 )
                 
                 if quantity > 0:
-                    item_total = quantity * info['price']
-                    order_items.append({
-                        'species': species,
-                        'quantity': quantity,
-                        'unit_price': info['price'],
-                        'total': item_total
-                    })
-                    total_amount += item_total
+                    order_lines.append({'species': species, 'price': info['price'], 'quantity': quantity})
+        
+        # Tiers, promotions and the member discount apply per line
+        priced = engine.price(order_lines, 'online', customer=st.session_state.username)
+        order_items = [{
+            'species': line['species'],
+            'quantity': line['quantity'],
+            'unit_price': line['price'],
+            'total': line['subtotal']
+        } for line in priced['lines']]
+        total_amount = priced['total']
         
         # Order summary
         if order_items:
@@ -139,6 +153,11 @@ def display_quick_order_system():
             summary_df = pd.DataFrame(order_items)
             st.dataframe(summary_df, use_container_width=True)
             
+            if priced['discount']:
+                member_note = " (includes member discount)" if priced['member'] else ""
+                st.write(f"Discount: -₱{priced['discount']:,.2f}{member_note}")
+            if priced['tax']:
+                st.write(f"Tax: ₱{priced['tax']:,.2f}")
             st.markdown(f"### **Total Amount: ₱{total_amount:,.2f}**")
             
             # Additional options
@@ -320,6 +339,14 @@ def process_quick_order(order_items, total_amount, delivery_option, payment_meth
     """Process the quick order submission"""
     order_id = f"ORD-{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"
     
+    # Stock is taken atomically; another session may have bought it since the form was drawn
+    try:
+        get_inventory().record([([movement(item['species'], 'adult', -item['quantity']) for item in order_items],
+                                 'quick_order', order_id, st.session_state.username)])
+    except InsufficientStock as e:
+        st.error(f"❌ {str(e)}")
+        return
+    
     for item in order_items:
         order_data = {
             'order_id': order_id,
@@ -3,6 +3,8 @@ import pandas as pd
 import datetime
 import os
 from utils.csv_handlers import save_to_csv, load_from_csv
+from utils.lifecycle_forecast import get_pupae_supply_curve
+from utils.inventory import get_inventory, movement, InsufficientStock
 
 def sales_tracking_app():
     """Sales tracking system for breeders and purchasers"""
@@ -82,6 +84,14 @@ def my_sales_section():
                 'recorded_at': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             }
             
+            # Take the sold stock first so two sellers can't sell the same pupae
+            try:
+                get_inventory().record([([movement(butterfly_species, stage, -pupae_quantity)], 'pupae_sale',
+                                         sale_record['sale_id'], st.session_state.username)])
+            except InsufficientStock as e:
+                st.error(f"❌ {str(e)}")
+                return
+            
             # Save sale record
             save_to_csv('pupae_sales.csv', sale_record)
             st.success(f"✅ Sale recorded successfully! Total: ${total_amount:.2f}")
@@ -378,6 +388,15 @@ def sales_analytics_section():
     
     else:
         st.info("Insufficient data for analysis. Record some sales and purchases first!")
+    
+    # Upcoming supply from the breeding forecast
+    st.subheader("🐛 Pupae Supply Forecast")
+    supply = get_pupae_supply_curve(weeks=12)
+    if supply.empty or supply.to_numpy().sum() == 0:
+        st.info("No pupae expected from current breeding batches.")
+    else:
+        st.bar_chart(supply)
+        st.caption("Expected pupae available per week from active breeding batches")
 
 def customer_management_section():
     """Manage customer relationships"""
@@ -0,0 +1,134 @@
+"""
+Incrementally maintained aggregate counters for CSV-backed tables
+Counters are updated on each write and persisted as JSON, so dashboards read
+precomputed totals instead of rescanning the full CSV on every render
+"""
+
+import os
+import json
+import threading
+import streamlit as st
+from utils.csv_handlers import load_from_csv, STORAGE_DIR
+
+COUNTERS_DIR = os.path.join(STORAGE_DIR, 'counters')
+
+_LOCK = threading.RLock()
+_CACHE = {}
+
+def _counters_path(name):
+    return os.path.join(COUNTERS_DIR, f"{name}.json")
+
+def source_size(source_file):
+    """Current size of a source file, to pass to record_write as size_before"""
+    return os.path.getsize(source_file) if os.path.exists(source_file) else 0
+
+def _save(name, counters):
+    """Persist counters atomically"""
+    try:
+        os.makedirs(COUNTERS_DIR, exist_ok=True)
+        path = _counters_path(name)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(counters, f)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        st.warning(f"Failed to save counters {name}: {str(e)}")
+
+def _load(name):
+    """Load counters from memory or disk; None if never built"""
+    if name in _CACHE:
+        return _CACHE[name]
+    path = _counters_path(name)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            counters = json.load(f)
+        _CACHE[name] = counters
+        return counters
+    except Exception:
+        return None
+
+def rebuild_counters(name, source_file, rebuild_fn):
+    """
+    Recompute counters from a full scan of the source file
+
+    Args:
+        name: Counter set name
+        source_file: CSV file the counters summarize
+        rebuild_fn: Function(DataFrame) -> counters dict
+
+    Returns:
+        dict: Rebuilt counters
+    """
+    with _LOCK:
+        counters = rebuild_fn(load_from_csv(source_file))
+        counters['_source_size'] = source_size(source_file)
+        _CACHE[name] = counters
+        _save(name, counters)
+        return counters
+
+def get_counters(name, source_file, rebuild_fn):
+    """
+    Get counters, rebuilding only if the source changed outside the app
+
+    The source file size is recorded with every update; a mismatch means
+    the CSV was edited externally and the counters are recomputed once.
+
+    Args:
+        name: Counter set name
+        source_file: CSV file the counters summarize
+        rebuild_fn: Function(DataFrame) -> counters dict
+
+    Returns:
+        dict: Current counters
+    """
+    with _LOCK:
+        counters = _load(name)
+        if counters is None or counters.get('_source_size') != source_size(source_file):
+            counters = rebuild_counters(name, source_file, rebuild_fn)
+        return counters
+
+def record_write(name, source_file, size_before, update_fn, rebuild_fn):
+    """
+    Apply an incremental update after the source file was written
+
+    Args:
+        name: Counter set name
+        source_file: CSV file that was just written
+        size_before: Source file size captured before the write
+        update_fn: Function(counters) that mutates counters in place
+        rebuild_fn: Function(DataFrame) -> counters dict, used if counters are stale
+
+    Returns:
+        dict: Updated counters
+    """
+    with _LOCK:
+        counters = _load(name)
+        if counters is None or counters.get('_source_size') != size_before:
+            # Stale or missing; the full rebuild already includes the new write
+            return rebuild_counters(name, source_file, rebuild_fn)
+
+        update_fn(counters)
+        counters['_source_size'] = source_size(source_file)
+        _save(name, counters)
+        return counters
+
+def rebase_counters(name, source_file, size_before):
+    """
+    Keep counters after rows were moved out of the source file (archival)
+
+    The counters still describe every record ever written, so instead of
+    rebuilding from the shrunken file only the recorded size is moved on.
+    Counters that were already stale are left to rebuild as usual.
+
+    Args:
+        name: Counter set name
+        source_file: CSV file that was just rewritten
+        size_before: Source file size just before the rewrite
+    """
+    with _LOCK:
+        counters = _load(name)
+        if counters is not None and counters.get('_source_size') == size_before:
+            counters['_source_size'] = source_size(source_file)
+            _save(name, counters)
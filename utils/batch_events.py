@@ -0,0 +1,442 @@
+"""
+Event-sourced history for breeding batches
+Every batch change is appended to an event log; periodic snapshots make the current
+state an in-memory read and any past state a snapshot plus a short replay
+"""
+
+import os
+import io
+import csv
+import json
+import bisect
+import threading
+import datetime
+import pandas as pd
+import streamlit as st
+from utils.csv_handlers import load_from_csv, STORAGE_DIR
+
+EVENTS_FILE = os.path.join(STORAGE_DIR, 'batch_events.csv')
+SNAPSHOT_DIR = os.path.join(STORAGE_DIR, 'batch_snapshots')
+SNAPSHOT_INTERVAL = 500
+
+EVENT_COLUMNS = [
+    'seq', 'timestamp', 'batch_key', 'batch_id', 'event_type',
+    'species', 'stage', 'larva_count', 'health_status', 'actor'
+]
+
+# Event type emitted for each tracked batch field
+FIELD_EVENT_TYPES = {
+    'larva_count': 'count_changed',
+    'stage': 'stage_changed',
+    'health_status': 'health_changed'
+}
+
+def batch_key(batch):
+    """
+    Stable identity for a batch row
+
+    Batch IDs are typed by hand and can repeat, so the creation timestamp
+    is part of the key.
+    """
+    return f"{batch['batch_id']}@{batch['created_date']}"
+
+def _apply_event(state, event):
+    """Fold one event into a {batch_key: batch_state} dictionary"""
+    key = event['batch_key']
+    if event['event_type'] == 'created':
+        count = int(float(event['larva_count'] or 0))
+        state[key] = {
+            'batch_id': event['batch_id'],
+            'species': event['species'],
+            'stage': event['stage'],
+            'health_status': event['health_status'],
+            'larva_count': count,
+            'initial_count': count,
+            'initial_stage': event['stage'],
+            'breeder': event.get('actor', ''),
+            'created': event['timestamp'],
+            'updated': event['timestamp'],
+            'stage_started': event['timestamp']
+        }
+        return
+
+    batch = state.get(key)
+    if batch is None:
+        return
+    if event['event_type'] == 'stage_changed' and event.get('stage') not in (None, ''):
+        batch['stage_started'] = event['timestamp']
+    for field in FIELD_EVENT_TYPES:
+        value = event.get(field)
+        if value not in (None, ''):
+            batch[field] = int(float(value)) if field == 'larva_count' else value
+    batch['updated'] = event['timestamp']
+
+class BatchEventStore:
+    """Append-only batch event log with snapshot materialization"""
+
+    def __init__(self, events_file=EVENTS_FILE, snapshot_dir=SNAPSHOT_DIR,
+                 snapshot_interval=SNAPSHOT_INTERVAL):
+        self.events_file = events_file
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_interval = snapshot_interval
+        self.lock = threading.RLock()
+        self.state = {}
+        self.seq = 0
+        self.offset = 0
+        self.last_snapshot_seq = 0
+        self.loaded = False
+        # Keys touched by each replayed event, so derived tables can update incrementally
+        self.change_log_start = 0
+        self.change_seqs = []
+        self.change_keys = []
+
+    def _snapshots(self):
+        """Snapshot filenames sorted by sequence number"""
+        if not os.path.isdir(self.snapshot_dir):
+            return []
+        return sorted(name for name in os.listdir(self.snapshot_dir)
+                      if name.startswith('snapshot_') and name.endswith('.json'))
+
+    def _read_snapshot(self, name):
+        with open(os.path.join(self.snapshot_dir, name), 'r') as f:
+            return json.load(f)
+
+    def _read_events(self, offset, until=None):
+        """
+        Read events appended after a byte offset
+
+        Args:
+            offset: Byte offset to start from (0 means after the header)
+            until: Optional timestamp; stop before the first later event
+
+        Returns:
+            tuple: (events list, byte offset after the last returned event)
+        """
+        events = []
+        if not os.path.exists(self.events_file):
+            return events, offset
+
+        with open(self.events_file, 'rb') as f:
+            if offset == 0:
+                f.readline()
+            else:
+                f.seek(offset)
+            position = f.tell()
+            for raw_line in iter(f.readline, b''):
+                if not raw_line.endswith(b'\n'):
+                    # Partial line from a concurrent writer; pick it up next time
+                    break
+                values = next(csv.reader([raw_line.decode('utf-8')]))
+                event = dict(zip(EVENT_COLUMNS, values))
+                if until is not None and event['timestamp'] > until:
+                    break
+                events.append(event)
+                position = f.tell()
+        return events, position
+
+    def _replay_tail(self):
+        """Apply events written since the last read (including by other sessions)"""
+        events, self.offset = self._read_events(self.offset)
+        for event in events:
+            _apply_event(self.state, event)
+            self.seq = int(event['seq'])
+            self.change_seqs.append(self.seq)
+            self.change_keys.append(event['batch_key'])
+
+    def _ensure_loaded(self):
+        if self.loaded:
+            if os.path.exists(self.events_file) and os.path.getsize(self.events_file) != self.offset:
+                self._replay_tail()
+            return
+
+        if not os.path.exists(self.events_file):
+            self._bootstrap_from_batches()
+
+        snapshots = self._snapshots()
+        if snapshots:
+            snapshot = self._read_snapshot(snapshots[-1])
+            self.state = snapshot['state']
+            self.seq = snapshot['seq']
+            self.offset = snapshot['offset']
+            self.last_snapshot_seq = snapshot['seq']
+            self.change_log_start = snapshot['seq']
+            if any('initial_stage' not in batch for batch in self.state.values()):
+                self._backfill_stages()
+        self._replay_tail()
+        self.loaded = True
+
+    def _backfill_stages(self):
+        """Fill initial_stage and stage_started into state from a snapshot that predates them"""
+        events, _ = self._read_events(0)
+        for event in events:
+            batch = self.state.get(event['batch_key'])
+            if batch is None:
+                continue
+            if event['event_type'] == 'created':
+                batch.setdefault('initial_stage', event['stage'])
+                batch['stage_started'] = event['timestamp']
+            elif event['event_type'] == 'stage_changed' and event.get('stage'):
+                batch['stage_started'] = event['timestamp']
+
+    def _bootstrap_from_batches(self):
+        """Seed the log with 'created' events for batches that predate it"""
+        batches_df = load_from_csv('breeding_batches.csv')
+        events = []
+        if not batches_df.empty:
+            # Replay relies on timestamp order, so seed events oldest first
+            batches_df = batches_df.sort_values('created_date', kind='stable')
+            for _, batch in batches_df.iterrows():
+                events.append({
+                    'timestamp': str(batch['created_date']),
+                    'batch_key': batch_key(batch),
+                    'batch_id': batch['batch_id'],
+                    'event_type': 'created',
+                    'species': batch['species'],
+                    'stage': batch['stage'],
+                    'larva_count': batch['larva_count'],
+                    'health_status': batch['health_status'],
+                    'actor': batch.get('created_by', '')
+                })
+        self._write_events(events, start_seq=1)
+
+    def _write_events(self, events, start_seq):
+        """Append events (creating the file with a header if needed) in one write"""
+        directory = os.path.dirname(self.events_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EVENT_COLUMNS, extrasaction='ignore', restval='')
+        if not os.path.exists(self.events_file):
+            writer.writeheader()
+        for seq, event in enumerate(events, start=start_seq):
+            event['seq'] = seq
+            writer.writerow(event)
+
+        with open(self.events_file, 'a', newline='') as f:
+            f.write(buffer.getvalue())
+
+    def append(self, events):
+        """
+        Append batch events and update the materialized state
+
+        Args:
+            events: List of event dictionaries (seq is assigned here)
+
+        Returns:
+            bool: Success status
+        """
+        if not events:
+            return True
+        try:
+            with self.lock:
+                self._ensure_loaded()
+                # A batch saved before the log existed was already seeded by the bootstrap
+                events = [event for event in events
+                          if not (event['event_type'] == 'created' and event['batch_key'] in self.state)]
+                if not events:
+                    return True
+                self._write_events(events, start_seq=self.seq + 1)
+                self._replay_tail()
+                if self.seq - self.last_snapshot_seq >= self.snapshot_interval:
+                    self.snapshot()
+            return True
+        except Exception as e:
+            st.warning(f"Failed to record batch events: {str(e)}")
+            return False
+
+    def snapshot(self):
+        """Persist the current materialized state with its log position"""
+        with self.lock:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            path = os.path.join(self.snapshot_dir, f"snapshot_{self.seq:010d}.json")
+            timestamp = max((batch['updated'] for batch in self.state.values()), default='')
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({
+                    'seq': self.seq,
+                    'offset': self.offset,
+                    'timestamp': timestamp,
+                    'state': self.state
+                }, f)
+            os.replace(tmp_path, path)
+            self.last_snapshot_seq = self.seq
+
+    def current_state(self):
+        """
+        Current state of every batch
+
+        Returns:
+            dict: batch_key -> batch state
+        """
+        with self.lock:
+            self._ensure_loaded()
+            return self.state
+
+    def stage_starts(self):
+        """
+        When each batch entered its current stage
+
+        Only stage_changed events move this; edits to counts, health or
+        notes do not.
+
+        Returns:
+            dict: batch_key -> 'YYYY-MM-DD HH:MM:SS' timestamp
+        """
+        with self.lock:
+            self._ensure_loaded()
+            # Snapshots written before stage starts were tracked fall back to creation
+            return {key: batch.get('stage_started', batch['created']) for key, batch in self.state.items()}
+
+    def changes_since(self, seq):
+        """
+        Batch keys changed after a sequence number
+
+        Args:
+            seq: Sequence number a derived table was last updated to
+
+        Returns:
+            tuple: (set of batch keys, current seq), or None if seq predates
+                   the events replayed in this process
+        """
+        with self.lock:
+            self._ensure_loaded()
+            if seq < self.change_log_start or seq > self.seq:
+                return None
+            start = bisect.bisect_right(self.change_seqs, seq)
+            return set(self.change_keys[start:]), self.seq
+
+    def state_at(self, timestamp):
+        """
+        State of every batch as of a point in time
+
+        Starts from the latest snapshot taken before the timestamp and
+        replays only the events after it.
+
+        Args:
+            timestamp: 'YYYY-MM-DD HH:MM:SS' string
+
+        Returns:
+            dict: batch_key -> batch state
+        """
+        with self.lock:
+            self._ensure_loaded()
+            state, offset = {}, 0
+            for name in reversed(self._snapshots()):
+                snapshot = self._read_snapshot(name)
+                if snapshot['timestamp'] and snapshot['timestamp'] <= timestamp:
+                    state, offset = snapshot['state'], snapshot['offset']
+                    break
+
+            events, _ = self._read_events(offset, until=timestamp)
+            for event in events:
+                _apply_event(state, event)
+            return state
+
+    def history(self, key):
+        """
+        Timeline of one batch
+
+        Args:
+            key: Batch key
+
+        Returns:
+            pandas.DataFrame: One row per event with the batch state after it
+        """
+        events_df = load_from_csv(self.events_file)
+        if events_df.empty:
+            return events_df
+        events_df = events_df[events_df['batch_key'] == key].fillna('')
+
+        state, rows = {}, []
+        for event in events_df.to_dict('records'):
+            _apply_event(state, event)
+            if key in state:
+                rows.append({'timestamp': event['timestamp'], 'event_type': event['event_type'],
+                             **{field: state[key][field] for field in FIELD_EVENT_TYPES}})
+        return pd.DataFrame(rows)
+
+def _field_value(field, value):
+    """Comparable form of a tracked field (counts compare as numbers, so 10 == 10.0)"""
+    if pd.isna(value):
+        return None
+    if field == 'larva_count':
+        number = pd.to_numeric(value, errors='coerce')
+        return None if pd.isna(number) else float(number)
+    return str(value)
+
+def build_change_events(batches_df, row_changes, username):
+    """
+    Build batch events for field changes on rows of breeding_batches
+
+    Args:
+        batches_df: Batches table before the changes
+        row_changes: Mapping of row index to field updates
+        username: Actor recorded on each event
+
+    Returns:
+        list: Event dictionaries for changed tracked fields
+    """
+    timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    events = []
+    for row_index, fields in row_changes.items():
+        if row_index not in batches_df.index:
+            continue
+        batch = batches_df.loc[row_index]
+        for field, event_type in FIELD_EVENT_TYPES.items():
+            if field in fields and _field_value(field, fields[field]) != _field_value(field, batch[field]):
+                events.append({
+                    'timestamp': timestamp,
+                    'batch_key': batch_key(batch),
+                    'batch_id': batch['batch_id'],
+                    'event_type': event_type,
+                    field: fields[field],
+                    'actor': username
+                })
+    return events
+
+def created_event(batch, username):
+    """Event recording a newly created batch"""
+    return {
+        'timestamp': batch['created_date'],
+        'batch_key': batch_key(batch),
+        'batch_id': batch['batch_id'],
+        'event_type': 'created',
+        'species': batch['species'],
+        'stage': batch['stage'],
+        'larva_count': batch['larva_count'],
+        'health_status': batch['health_status'],
+        'actor': username
+    }
+
+def survival_summary(state, group_by='species'):
+    """
+    Survival and mortality per group from materialized batch state
+
+    Args:
+        state: batch_key -> batch state dictionary
+        group_by: Batch state field to group on
+
+    Returns:
+        pandas.DataFrame: batches, initial and current counts, survival and mortality rates
+    """
+    if not state:
+        return pd.DataFrame()
+    batches = pd.DataFrame(list(state.values()))
+    summary = batches.groupby(group_by).agg(
+        batches=('larva_count', 'size'),
+        initial_count=('initial_count', 'sum'),
+        current_count=('larva_count', 'sum')
+    )
+    initial = summary['initial_count'].where(summary['initial_count'] > 0)
+    summary['survival_rate'] = (summary['current_count'] / initial * 100).round(1)
+    summary['mortality_rate'] = (100 - summary['survival_rate']).clip(lower=0).round(1)
+    return summary
+
+_STORE = {}
+
+def get_batch_event_store():
+    """Get the shared batch event store for this process"""
+    if 'store' not in _STORE:
+        _STORE['store'] = BatchEventStore()
+    return _STORE['store']
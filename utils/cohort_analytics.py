@@ -0,0 +1,207 @@
+"""
+Cohort analytics over breeding history
+Batches are grouped into (species, start month, breeder) cohorts whose survival and
+yield totals are updated from batch events as they are appended, so analytics read
+a small precomputed table instead of replaying the history
+"""
+
+import os
+import json
+import math
+import threading
+import pandas as pd
+import streamlit as st
+from utils.batch_events import get_batch_event_store
+from utils.lifecycle_forecast import expected_survival
+from data.butterfly_species_info import BREEDING_DIFFICULTY
+from utils.csv_handlers import STORAGE_DIR
+
+COHORT_FILE = os.path.join(STORAGE_DIR, 'counters', 'breeding_cohorts.json')
+# Bumped when saved contributions or anomalies are computed differently, forcing a rebuild
+COHORT_VERSION = 2
+COHORT_FIELDS = ['batches', 'initial_count', 'current_count', 'completed_batches', 'completed_initial', 'adults']
+COHORT_DIMENSIONS = ['species', 'month', 'breeder']
+
+# A batch is flagged when its survival so far is this many standard deviations
+# below the binomial expectation for its species and stage
+ANOMALY_Z = -2.0
+MIN_ANOMALY_COUNT = 10
+
+def _cohort_key(batch):
+    return '|'.join([str(batch.get('species', '')), str(batch.get('created', ''))[:7],
+                     str(batch.get('breeder', '') or 'unknown')])
+
+def batch_contribution(batch):
+    """
+    A batch's additions to its cohort totals
+
+    Returns:
+        list: Values in COHORT_FIELDS order
+    """
+    initial = int(batch.get('initial_count', 0) or 0)
+    current = int(batch.get('larva_count', 0) or 0)
+    completed = batch.get('stage') == 'adult'
+    return [1, initial, current, int(completed), initial if completed else 0, current if completed else 0]
+
+def batch_anomaly(batch):
+    """
+    Compare a batch's survival so far with its species' expected survival to its stage
+
+    The expectation runs from the stage the batch was created in, since a
+    batch started as larvae or pupae never went through the earlier stages.
+
+    Returns:
+        dict: Anomaly details, or None if the batch is within expectations
+    """
+    initial = int(batch.get('initial_count', 0) or 0)
+    if initial < MIN_ANOMALY_COUNT:
+        return None
+    current = int(batch.get('larva_count', 0) or 0)
+    expected = expected_survival(batch.get('species'), batch.get('stage'), batch.get('initial_stage', 'egg'))
+    if expected >= 1.0:
+        return None
+    z = (current - initial * expected) / math.sqrt(initial * expected * (1.0 - expected))
+    if z >= ANOMALY_Z:
+        return None
+    return {
+        'batch_id': batch.get('batch_id'),
+        'species': batch.get('species'),
+        'stage': batch.get('stage'),
+        'breeder': batch.get('breeder', ''),
+        'initial_count': initial,
+        'current_count': current,
+        'survival_rate': round(current / initial * 100, 1),
+        'expected_rate': round(expected * 100, 1),
+        'z_score': round(z, 2)
+    }
+
+class CohortTable:
+    """Cohort totals and anomaly flags maintained from the batch event log"""
+
+    def __init__(self, store=None, path=COHORT_FILE):
+        self.store = store or get_batch_event_store()
+        self.path = path
+        self.lock = threading.RLock()
+        self.seq = -1
+        self.cohorts = {}
+        self.contributions = {}
+        self.anomalies = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                saved = json.load(f)
+            if saved.get('version') != COHORT_VERSION:
+                return
+            self.seq = saved['seq']
+            self.cohorts = saved['cohorts']
+            self.contributions = saved['contributions']
+            self.anomalies = saved['anomalies']
+        except Exception:
+            self.seq = -1
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': COHORT_VERSION, 'seq': self.seq, 'cohorts': self.cohorts,
+                           'contributions': self.contributions, 'anomalies': self.anomalies}, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            st.warning(f"Failed to save cohort table: {str(e)}")
+
+    def _apply(self, key, batch):
+        """Replace one batch's contribution to its cohort"""
+        old = self.contributions.pop(key, None)
+        if old is not None:
+            cohort = self.cohorts[old[0]]
+            cohort['values'] = [a - b for a, b in zip(cohort['values'], old[1])]
+            if cohort['values'][0] == 0:
+                del self.cohorts[old[0]]
+        self.anomalies.pop(key, None)
+        if batch is None:
+            return
+
+        cohort_key = _cohort_key(batch)
+        values = batch_contribution(batch)
+        cohort = self.cohorts.setdefault(cohort_key, {'values': [0] * len(COHORT_FIELDS)})
+        cohort['values'] = [a + b for a, b in zip(cohort['values'], values)]
+        self.contributions[key] = [cohort_key, values]
+        anomaly = batch_anomaly(batch)
+        if anomaly is not None:
+            self.anomalies[key] = anomaly
+
+    def rebuild(self):
+        """Recompute every cohort from the materialized batch state"""
+        with self.lock:
+            state = self.store.current_state()
+            self.cohorts, self.contributions, self.anomalies = {}, {}, {}
+            for key, batch in state.items():
+                self._apply(key, batch)
+            self.seq = self.store.seq
+            self._save()
+
+    def refresh(self):
+        """Apply batch events appended since the last refresh"""
+        with self.lock:
+            changes = self.store.changes_since(self.seq) if self.seq >= 0 else None
+            if changes is None:
+                self.rebuild()
+                return
+            keys, seq = changes
+            if not keys:
+                return
+            state = self.store.current_state()
+            for key in keys:
+                self._apply(key, state.get(key))
+            self.seq = seq
+            self._save()
+
+    def table(self, group_by=('species',)):
+        """
+        Cohort survival and yield, rolled up to the requested dimensions
+
+        Args:
+            group_by: Any of 'species', 'month', 'breeder'
+
+        Returns:
+            pandas.DataFrame: Totals with egg-to-adult survival vs the species benchmark
+        """
+        with self.lock:
+            self.refresh()
+            if not self.cohorts:
+                return pd.DataFrame()
+            rows = [dict(zip(COHORT_DIMENSIONS, key.split('|')), **dict(zip(COHORT_FIELDS, cohort['values'])))
+                    for key, cohort in self.cohorts.items()]
+
+        table = pd.DataFrame(rows).groupby(list(group_by))[COHORT_FIELDS].sum()
+        completed = table['completed_initial'].where(table['completed_initial'] > 0)
+        table['survival_rate'] = (table['adults'] / completed * 100).round(1)
+        table['current_survival'] = (table['current_count'] / table['initial_count'].where(table['initial_count'] > 0) * 100).round(1)
+
+        if 'species' in group_by:
+            species = table.index.get_level_values('species')
+            table['benchmark_rate'] = [BREEDING_DIFFICULTY.get(name, {}).get('success_rate') for name in species]
+            table['vs_benchmark'] = (table['survival_rate'] - table['benchmark_rate']).round(1)
+        return table
+
+    def anomaly_table(self):
+        """Batches surviving significantly worse than expected, worst first"""
+        with self.lock:
+            self.refresh()
+            anomalies = list(self.anomalies.values())
+        if not anomalies:
+            return pd.DataFrame()
+        return pd.DataFrame(anomalies).sort_values('z_score').reset_index(drop=True)
+
+_TABLE = {}
+
+def get_cohort_table():
+    """Get the shared cohort table for this process"""
+    if 'table' not in _TABLE:
+        _TABLE['table'] = CohortTable()
+    return _TABLE['table']
@@ -5,9 +5,38 @@ Provides functions for reading, writing, and managing CSV data across the applic
 
 import pandas as pd
 import os
+import io
+import csv
 import datetime
+import threading
 import streamlit as st
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Union
+
+# Root for app state beyond the top-level CSV tables (journals, indexes, archives,
+# settings). Lowercase so it never resolves to the data/ package on
+# case-insensitive filesystems
+STORAGE_DIR = 'storage'
+
+_FILE_LOCKS = {}
+_FILE_LOCKS_GUARD = threading.Lock()
+
+def file_lock(filename: str) -> threading.RLock:
+    """
+    Lock serializing this process's writes to a file
+    
+    Every writer below holds it while appending or rewriting, so code that
+    replaces a file wholesale (e.g. retention archival) can hold it to keep
+    rows from landing in a copy that is about to be discarded.
+    
+    Args:
+        filename: Name of the CSV file
+        
+    Returns:
+        threading.RLock: The file's lock (re-entrant, so writers can nest)
+    """
+    key = os.path.abspath(filename)
+    with _FILE_LOCKS_GUARD:
+        return _FILE_LOCKS.setdefault(key, threading.RLock())
 
 def save_to_csv(filename: str, data: Dict[str, Any], append: bool = True) -> bool:
     """
@@ -22,16 +51,80 @@ def save_to_csv(filename: str, data: Dict[str, Any], append: bool = True) -> boo
         bool: Success status
     """
     try:
-        # Convert single record to DataFrame
-        new_df = pd.DataFrame([data])
+        with file_lock(filename):
+            # Convert single record to DataFrame
+            new_df = pd.DataFrame([data])
+            
+            # Check if file exists and we want to append
+            if append and os.path.exists(filename):
+                # Append to existing file
+                new_df.to_csv(filename, mode='a', header=False, index=False)
+            else:
+                # Create new file or overwrite
+                new_df.to_csv(filename, index=False)
         
-        # Check if file exists and we want to append
-        if append and os.path.exists(filename):
-            # Append to existing file
-            new_df.to_csv(filename, mode='a', header=False, index=False)
-        else:
-            # Create new file or overwrite
-            new_df.to_csv(filename, index=False)
+        return True
+        
+    except Exception as e:
+        st.error(f"Failed to save data to {filename}: {str(e)}")
+        return False
+
+def append_csv_record(filename: str, data: Dict[str, Any], columns: List[str]) -> bool:
+    """
+    Append a record aligned to the file's header columns
+    
+    Unlike save_to_csv, values are written by column name so records with
+    missing fields never shift into the wrong column. If the existing header
+    lacks any of the given columns, the file is rewritten once with the
+    extended header.
+    
+    Args:
+        filename: Name of the CSV file
+        data: Dictionary containing the data to save
+        columns: Full ordered column list for the file
+        
+    Returns:
+        bool: Success status
+    """
+    return append_csv_records(filename, [data], columns)
+
+def append_csv_records(filename: str, records: List[Dict[str, Any]], columns: List[str]) -> bool:
+    """
+    Append several records in one write, aligned to the file's header columns
+    
+    Args:
+        filename: Name of the CSV file
+        records: List of dictionaries to save
+        columns: Full ordered column list for the file
+        
+    Returns:
+        bool: Success status
+    """
+    try:
+        with file_lock(filename):
+            header = None
+            if os.path.exists(filename) and os.path.getsize(filename) > 0:
+                with open(filename, 'r', newline='') as f:
+                    header = next(csv.reader(f), None)
+            
+            if header is None:
+                header = list(columns)
+                with open(filename, 'w', newline='') as f:
+                    csv.writer(f).writerow(header)
+            else:
+                missing = [column for column in columns if column not in header]
+                if missing:
+                    df = pd.read_csv(filename)
+                    for column in missing:
+                        df[column] = ''
+                    df.to_csv(filename, index=False)
+                    header = header + missing
+            
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=header, extrasaction='ignore', restval='')
+            writer.writerows(records)
+            with open(filename, 'a', newline='') as f:
+                f.write(buffer.getvalue())
         
         return True
         
@@ -61,42 +154,239 @@ def load_from_csv(filename: str) -> pd.DataFrame:
         st.warning(f"Failed to load data from {filename}: {str(e)}")
         return pd.DataFrame()
 
-def update_csv_record(filename: str, record_id: str, id_column: str, updates: Dict[str, Any]) -> bool:
+_CSV_CACHE: Dict[str, Any] = {}
+
+def load_from_csv_cached(filename: str) -> pd.DataFrame:
     """
-    Update a specific record in CSV file
+    Load data from CSV file, re-parsing only when the file changed
+    
+    The parsed DataFrame is shared between callers and must be treated as
+    read-only; copy it before modifying.
     
     Args:
         filename: Name of the CSV file
-        record_id: ID of the record to update
-        id_column: Name of the ID column
-        updates: Dictionary of field updates
+        
+    Returns:
+        pandas.DataFrame: Loaded data or empty DataFrame if file doesn't exist
+    """
+    if not os.path.exists(filename):
+        return pd.DataFrame()
+    
+    stat = os.stat(filename)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _CSV_CACHE.get(filename)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    
+    df = load_from_csv(filename)
+    _CSV_CACHE[filename] = (signature, df)
+    return df
+
+def update_csv_rows(filename: str, updates: Dict[Any, Dict[str, Any]]) -> bool:
+    """
+    Apply updates to many rows with a single file rewrite
+    
+    Args:
+        filename: Name of the CSV file
+        updates: Mapping of row index (position in file) to field updates
         
     Returns:
         bool: Success status
     """
     try:
-        df = load_from_csv(filename)
+        if not updates:
+            return True
         
-        if df.empty:
-            st.warning(f"No data found in {filename}")
-            return False
+        with file_lock(filename):
+            df = load_from_csv(filename)
+            
+            if df.empty:
+                st.warning(f"No data found in {filename}")
+                return False
+            
+            missing_rows = [row_index for row_index in updates if row_index not in df.index]
+            if missing_rows:
+                st.warning(f"Rows {missing_rows} not found in {filename}")
+                return False
+            
+            _apply_row_updates(df, updates, 'last_updated')
+            write_csv_atomic(df, filename)
         
-        # Find the record to update
-        mask = df[id_column] == record_id
+        return True
         
-        if not mask.any():
-            st.warning(f"Record with {id_column} = {record_id} not found")
-            return False
+    except Exception as e:
+        st.error(f"Failed to update records in {filename}: {str(e)}")
+        return False
+
+def bulk_update_csv_records(filename: str, id_column: Union[str, List[str]], updates: Dict[Any, Dict[str, Any]],
+                            timestamp_column: str = 'last_updated') -> int:
+    """
+    Update many records keyed by ID with a single file rewrite
+    
+    All updates are applied in memory and written once; if any ID is
+    missing nothing is written.
+    
+    Args:
+        filename: Name of the CSV file
+        id_column: Name of the ID column, or a list of columns identifying a record
+        updates: Mapping of record ID (a tuple of values for several columns) to field updates
+        timestamp_column: Column stamped with the update time (None to skip)
         
-        # Update the record
-        for field, value in updates.items():
-            df.loc[mask, field] = value
+    Returns:
+        int: Number of rows updated, or -1 on failure
+    """
+    try:
+        if not updates:
+            return 0
         
-        # Add timestamp of update
-        df.loc[mask, 'last_updated'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with file_lock(filename):
+            df = load_from_csv(filename)
+            
+            if df.empty:
+                st.warning(f"No data found in {filename}")
+                return -1
+            
+            id_columns = [id_column] if isinstance(id_column, str) else list(id_column)
+            positions = {}
+            for row_index, key in zip(df.index, zip(*(df[column].astype(str) for column in id_columns))):
+                positions.setdefault(key, []).append(row_index)
+            
+            row_updates = {}
+            for record_id, fields in updates.items():
+                key = (str(record_id),) if isinstance(id_column, str) else tuple(str(value) for value in record_id)
+                rows = positions.get(key)
+                if not rows:
+                    st.warning(f"Record with {id_column} = {record_id} not found")
+                    return -1
+                for row_index in rows:
+                    row_updates.setdefault(row_index, {}).update(fields)
+            
+            _apply_row_updates(df, row_updates, timestamp_column)
+            write_csv_atomic(df, filename)
         
-        # Save updated DataFrame
-        df.to_csv(filename, index=False)
+        return len(row_updates)
+        
+    except Exception as e:
+        st.error(f"Failed to update records in {filename}: {str(e)}")
+        return -1
+
+def _apply_row_updates(df: pd.DataFrame, row_updates: Dict[Any, Dict[str, Any]],
+                       timestamp_column: Optional[str]) -> None:
+    """Apply field updates to rows of a DataFrame in place"""
+    # Object columns accept any value, so mixed-type edits don't fail mid-update
+    fields = {field for changes in row_updates.values() for field in changes}
+    if timestamp_column:
+        fields.add(timestamp_column)
+    for field in fields:
+        if field not in df.columns:
+            df[field] = None
+        df[field] = df[field].astype(object)
+    
+    timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    for row_index, changes in row_updates.items():
+        for field, value in changes.items():
+            df.at[row_index, field] = value
+        if timestamp_column:
+            df.at[row_index, timestamp_column] = timestamp
+
+def write_csv_atomic(df: pd.DataFrame, filename: str) -> None:
+    """
+    Write a DataFrame via a temporary file and rename
+    
+    A crash mid-write never leaves a half-written table behind.
+    
+    Args:
+        df: Data to write
+        filename: Target CSV filename
+    """
+    with file_lock(filename):
+        tmp_filename = f"{filename}.tmp"
+        df.to_csv(tmp_filename, index=False)
+        os.replace(tmp_filename, filename)
+
+def read_csv_tail(filename: str, n: int = 10, block_size: int = 65536) -> pd.DataFrame:
+    """
+    Load only the last n records of a CSV file by reading backwards from its end
+    
+    Cost depends on n, not on file size. Records must not contain embedded
+    newlines (true for the append-only log files written by this app).
+    
+    Args:
+        filename: Name of the CSV file
+        n: Number of records to return
+        block_size: Bytes read per backward step
+        
+    Returns:
+        pandas.DataFrame: Last n records in file order (empty if none)
+    """
+    try:
+        if not os.path.exists(filename):
+            return pd.DataFrame()
+        
+        with open(filename, 'rb') as f:
+            header = f.readline()
+            data_start = f.tell()
+            position = f.seek(0, os.SEEK_END)
+            
+            chunk = b''
+            # n records need n newline separators plus the one ending the last record
+            while position > data_start and chunk.count(b'\n') <= n:
+                step = min(block_size, position - data_start)
+                position -= step
+                f.seek(position)
+                chunk = f.read(step) + chunk
+        
+        lines = [line for line in chunk.splitlines() if line.strip()]
+        if position > data_start:
+            # First line may be a partial record cut by the block boundary
+            lines = lines[1:]
+        lines = lines[-n:] if n > 0 else []
+        
+        if not lines:
+            return pd.read_csv(io.BytesIO(header))
+        return pd.read_csv(io.BytesIO(header + b'\n'.join(lines) + b'\n'))
+        
+    except Exception as e:
+        st.warning(f"Failed to read tail of {filename}: {str(e)}")
+        return pd.DataFrame()
+
+def update_csv_record(filename: str, record_id: str, id_column: str, updates: Dict[str, Any]) -> bool:
+    """
+    Update a specific record in CSV file
+    
+    Args:
+        filename: Name of the CSV file
+        record_id: ID of the record to update
+        id_column: Name of the ID column
+        updates: Dictionary of field updates
+        
+    Returns:
+        bool: Success status
+    """
+    try:
+        with file_lock(filename):
+            df = load_from_csv(filename)
+            
+            if df.empty:
+                st.warning(f"No data found in {filename}")
+                return False
+            
+            # Find the record to update
+            mask = df[id_column] == record_id
+            
+            if not mask.any():
+                st.warning(f"Record with {id_column} = {record_id} not found")
+                return False
+            
+            # Update the record
+            for field, value in updates.items():
+                df.loc[mask, field] = value
+            
+            # Add timestamp of update
+            df.loc[mask, 'last_updated'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            
+            # Save updated DataFrame
+            df.to_csv(filename, index=False)
         
         return True
         
@@ -117,24 +407,25 @@ def delete_csv_record(filename: str, record_id: str, id_column: str) -> bool:
         bool: Success status
     """
     try:
-        df = load_from_csv(filename)
-        
-        if df.empty:
-            st.warning(f"No data found in {filename}")
-            return False
-        
-        # Find and remove the record
-        mask = df[id_column] == record_id
-        
-        if not mask.any():
-            st.warning(f"Record with {id_column} = {record_id} not found")
-            return False
-        
-        # Remove the record
-        df = df[~mask]
-        
-        # Save updated DataFrame
-        df.to_csv(filename, index=False)
+        with file_lock(filename):
+            df = load_from_csv(filename)
+            
+            if df.empty:
+                st.warning(f"No data found in {filename}")
+                return False
+            
+            # Find and remove the record
+            mask = df[id_column] == record_id
+            
+            if not mask.any():
+                st.warning(f"Record with {id_column} = {record_id} not found")
+                return False
+            
+            # Remove the record
+            df = df[~mask]
+            
+            # Save updated DataFrame
+            df.to_csv(filename, index=False)
         
         return True
         
@@ -0,0 +1,339 @@
+"""
+Row index for append-only CSV files
+Keeps each record's byte offset plus compact codes for a few filter columns, so
+filtered pages and exports read only the rows they return, and refreshing after
+an append scans only the new bytes
+"""
+
+import os
+import io
+import csv
+import zlib
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+
+EXPORT_CHUNK_BYTES = 1 << 20
+
+class CsvRowIndex:
+    """
+    Byte-offset index over an append-only CSV file
+
+    Indexed columns are stored as integer codes into a per-column vocabulary;
+    a date column is stored as days since epoch. A rewrite of the file
+    (different header, shrunk, or changed last record) triggers a full rescan.
+    """
+
+    def __init__(self, filename, code_columns=(), date_column=None):
+        self.filename = filename
+        self.code_columns = list(code_columns)
+        self.date_column = date_column
+        self.lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.header = b''
+        self.columns = []
+        self.indexed_bytes = 0
+        self.last_record = (0, b'')
+        self._offsets, self._lengths, self._days = [], [], []
+        self._codes = {column: [] for column in self.code_columns}
+        self.vocabularies = {column: {} for column in self.code_columns}
+        self._arrays = None
+
+    def __len__(self):
+        with self.lock:
+            self.refresh()
+            return len(self._offsets)
+
+    def _is_rewritten(self, f, size):
+        """Whether the file no longer extends what was indexed"""
+        if size < self.indexed_bytes:
+            return True
+        f.seek(0)
+        if f.readline() != self.header:
+            return True
+        offset, digest = self.last_record
+        if offset:
+            f.seek(offset)
+            return hashlib.sha1(f.read(self._lengths[-1])).digest() != digest
+        return False
+
+    def refresh(self):
+        """Index records appended since the last refresh"""
+        with self.lock:
+            if not os.path.exists(self.filename):
+                self._reset()
+                return
+            size = os.path.getsize(self.filename)
+            if size == self.indexed_bytes:
+                return
+
+            with open(self.filename, 'rb') as f:
+                if self.indexed_bytes and self._is_rewritten(f, size):
+                    self._reset()
+                if not self.indexed_bytes:
+                    f.seek(0)
+                    self.header = f.readline()
+                    self.columns = next(csv.reader([self.header.decode('utf-8')]), [])
+                    self.indexed_bytes = f.tell()
+                f.seek(self.indexed_bytes)
+                self._scan(f)
+
+    def _scan(self, f):
+        positions = {column: self.columns.index(column) for column in self.code_columns if column in self.columns}
+        date_position = self.columns.index(self.date_column) if self.date_column in self.columns else None
+
+        offset = self.indexed_bytes
+        record = b''
+        day_numbers = {}
+        for line in iter(f.readline, b''):
+            if not line.endswith(b'\n'):
+                # Partial write in progress; index it on a later refresh
+                break
+            record += line
+            if record.count(b'"') % 2:
+                # Quoted field with an embedded newline continues on the next line
+                continue
+
+            values = next(csv.reader([record.decode('utf-8', errors='replace')]), [])
+            if values:
+                self._offsets.append(offset)
+                self._lengths.append(len(record))
+                for column, position in positions.items():
+                    value = values[position] if position < len(values) else ''
+                    vocabulary = self.vocabularies[column]
+                    self._codes[column].append(vocabulary.setdefault(value, len(vocabulary)))
+                if date_position is not None:
+                    day = values[date_position][:10] if date_position < len(values) else ''
+                    if day not in day_numbers:
+                        try:
+                            day_numbers[day] = int(np.datetime64(day, 'D').astype(np.int64))
+                        except ValueError:
+                            day_numbers[day] = np.iinfo(np.int64).min
+                    self._days.append(day_numbers[day])
+                self.last_record = (offset, hashlib.sha1(record).digest())
+
+            offset += len(record)
+            record = b''
+
+        self.indexed_bytes = offset
+        self._arrays = None
+
+    def _as_arrays(self):
+        if self._arrays is None:
+            self._arrays = {
+                'offsets': np.array(self._offsets, dtype=np.int64),
+                'lengths': np.array(self._lengths, dtype=np.int64),
+                'days': np.array(self._days, dtype=np.int64),
+                **{column: np.array(codes, dtype=np.int32) for column, codes in self._codes.items()}
+            }
+        return self._arrays
+
+    def column_values(self, column, rows=None):
+        """
+        Values of an indexed column for selected rows (all rows by default), without reading the file
+
+        Returns:
+            numpy.ndarray: Object array of values in row order
+        """
+        with self.lock:
+            self.refresh()
+            codes = self._as_arrays()[column]
+            if rows is not None:
+                codes = codes[np.asarray(rows, dtype=np.int64)]
+            vocabulary = self.vocabularies[column]
+            values = np.empty(len(vocabulary), dtype=object)
+            for value, code in vocabulary.items():
+                values[code] = value
+        return values[codes]
+
+    def values(self, column):
+        """Distinct values seen in an indexed column"""
+        with self.lock:
+            self.refresh()
+            return sorted(value for value in self.vocabularies.get(column, {}) if value)
+
+    def value_counts(self, column, rows=None):
+        """
+        Counts of an indexed column's values over selected rows, without reading the file
+
+        Returns:
+            pandas.Series: Counts indexed by value
+        """
+        with self.lock:
+            self.refresh()
+            codes = self._as_arrays()[column]
+            if rows is not None:
+                codes = codes[np.asarray(rows, dtype=np.int64)]
+            vocabulary = self.vocabularies[column]
+            counts = np.bincount(codes, minlength=len(vocabulary))
+        values = np.empty(len(vocabulary), dtype=object)
+        for value, code in vocabulary.items():
+            values[code] = value
+        series = pd.Series(counts, index=values)
+        return series[series > 0].sort_values(ascending=False)
+
+    def day_counts(self, rows=None):
+        """
+        Rows per day of the date column over selected rows, without reading the file
+
+        Returns:
+            pandas.Series: Counts indexed by YYYY-MM-DD, oldest first (undated rows excluded)
+        """
+        with self.lock:
+            self.refresh()
+            days = self._as_arrays()['days']
+            if rows is not None:
+                days = days[np.asarray(rows, dtype=np.int64)]
+        days = days[days != np.iinfo(np.int64).min]
+        values, counts = np.unique(days, return_counts=True)
+        return pd.Series(counts, index=values.astype('datetime64[D]').astype(str))
+
+    def query(self, filters=None, date_from=None, date_to=None, newest_first=True):
+        """
+        Row numbers matching the filters
+
+        Args:
+            filters: Mapping of indexed column to a value or list of values
+            date_from: Inclusive start date (date, str or Timestamp)
+            date_to: Inclusive end date
+            newest_first: Return rows in reverse file order
+
+        Returns:
+            numpy.ndarray: Matching row numbers
+        """
+        with self.lock:
+            self.refresh()
+            arrays = self._as_arrays()
+            mask = np.ones(arrays['offsets'].size, dtype=bool)
+
+            for column, wanted in (filters or {}).items():
+                wanted = [wanted] if isinstance(wanted, str) else list(wanted)
+                codes = [self.vocabularies[column][value] for value in wanted if value in self.vocabularies[column]]
+                mask &= np.isin(arrays[column], codes)
+
+            if date_from is not None:
+                mask &= arrays['days'] >= np.datetime64(pd.Timestamp(date_from).date(), 'D').astype(np.int64)
+            if date_to is not None:
+                mask &= arrays['days'] <= np.datetime64(pd.Timestamp(date_to).date(), 'D').astype(np.int64)
+
+            rows = np.flatnonzero(mask)
+            return rows[::-1] if newest_first else rows
+
+    def _ranges(self, rows):
+        """Group row numbers into contiguous byte ranges, preserving order"""
+        arrays = self._as_arrays()
+        offsets, lengths = arrays['offsets'][rows], arrays['lengths'][rows]
+        breaks = np.flatnonzero(np.diff(rows) != 1) + 1 if rows.size else np.array([], dtype=np.int64)
+        for group in np.split(np.arange(rows.size), breaks):
+            if group.size:
+                yield int(offsets[group[0]]), int(lengths[group].sum())
+
+    def read_rows(self, rows):
+        """
+        Load specific rows, in the order given
+
+        Returns:
+            pandas.DataFrame: Rows with the file's columns
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        with self.lock:
+            self.refresh()
+            if rows.size == 0:
+                return pd.DataFrame(columns=self.columns)
+
+            # Read in file order so consecutive rows share one read, then restore the order
+            order = np.argsort(rows, kind='stable')
+            buffer = io.BytesIO()
+            buffer.write(self.header)
+            with open(self.filename, 'rb') as f:
+                for offset, length in self._ranges(rows[order]):
+                    f.seek(offset)
+                    buffer.write(f.read(length))
+        buffer.seek(0)
+        frame = pd.read_csv(buffer, dtype=str, keep_default_na=False)
+        restore = np.empty_like(order)
+        restore[order] = np.arange(order.size)
+        return frame.iloc[restore].reset_index(drop=True)
+
+    def page(self, rows, page=1, page_size=25):
+        """Load one page of a query result"""
+        start = (page - 1) * page_size
+        return self.read_rows(rows[start:start + page_size])
+
+    def iter_csv(self, rows, chunk_bytes=EXPORT_CHUNK_BYTES):
+        """
+        Stream the header and selected rows as raw CSV bytes
+
+        Records are copied from the file as-is, never parsed, and memory use is
+        bounded by chunk_bytes regardless of how many rows are exported.
+
+        Yields:
+            bytes: CSV chunks
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        with self.lock:
+            self.refresh()
+            header = self.header
+            ranges = list(self._ranges(rows))
+
+        yield header
+        with open(self.filename, 'rb') as f:
+            pending = bytearray()
+            for offset, length in ranges:
+                f.seek(offset)
+                while length > 0:
+                    data = f.read(min(length, chunk_bytes))
+                    if not data:
+                        break
+                    length -= len(data)
+                    pending += data
+                    if len(pending) >= chunk_bytes:
+                        yield bytes(pending)
+                        pending = bytearray()
+            if pending:
+                yield bytes(pending)
+
+def gzip_stream(chunks, level=6):
+    """
+    Compress a stream of byte chunks into gzip format incrementally
+
+    Yields:
+        bytes: gzip-encoded chunks
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def write_stream(chunks, path):
+    """
+    Write a chunk stream to a file atomically
+
+    Returns:
+        int: Bytes written
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    written = 0
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+            written += len(chunk)
+    os.replace(tmp_path, path)
+    return written
+
+_INDEXES = {}
+
+def get_csv_index(filename, code_columns=(), date_column=None):
+    """Get the shared row index for a file"""
+    key = (filename, tuple(code_columns), date_column)
+    if key not in _INDEXES:
+        _INDEXES[key] = CsvRowIndex(filename, code_columns, date_column)
+    return _INDEXES[key]
@@ -0,0 +1,132 @@
+"""
+Compact on-disk feature store for classification images
+Stores fixed-length float32 feature vectors in a flat binary file read back through
+numpy.memmap, with a CSV metadata table linking each row to its classification
+"""
+
+import os
+import datetime
+import numpy as np
+import pandas as pd
+import streamlit as st
+from utils.image_processing import COLOR_FEATURE_COLUMNS
+from utils.csv_handlers import append_csv_record, load_from_csv, file_lock, STORAGE_DIR
+
+FEATURE_STORE_PREFIX = os.path.join(STORAGE_DIR, 'image_features')
+FEATURE_METADATA_COLUMNS = [
+    'feature_id', 'timestamp', 'user', 'analysis_type', 'predicted_species',
+    'predicted_stage', 'predicted_disease', 'predicted_defect', 'image_key'
+]
+
+class FeatureStore:
+    """Append-only store of feature vectors backed by a memory-mapped float32 file"""
+
+    def __init__(self, prefix=FEATURE_STORE_PREFIX, columns=None):
+        self.columns = list(columns or COLOR_FEATURE_COLUMNS)
+        self.dim = len(self.columns)
+        self.data_path = f"{prefix}.f32"
+        self.metadata_path = f"{prefix}.csv"
+        self._matrix = None
+        self._matrix_rows = -1
+
+    def __len__(self):
+        if not os.path.exists(self.data_path):
+            return 0
+        return os.path.getsize(self.data_path) // (self.dim * 4)
+
+    def append(self, vector, metadata):
+        """
+        Append one feature vector and its metadata row
+
+        Args:
+            vector: Array of length len(columns)
+            metadata: Dictionary of classification metadata
+
+        Returns:
+            int: Feature id (row number) of the stored vector, or -1 on failure
+        """
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        if vector.shape[0] != self.dim:
+            st.warning(f"Feature vector has {vector.shape[0]} values, expected {self.dim}")
+            return -1
+
+        try:
+            directory = os.path.dirname(self.data_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            row = {column: metadata.get(column, '') for column in FEATURE_METADATA_COLUMNS}
+            if not row['timestamp']:
+                row['timestamp'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+            # Concurrent uploads must not share a feature_id or pair rows with the wrong vector
+            with file_lock(self.data_path):
+                feature_id = len(self)
+                with open(self.data_path, 'ab') as f:
+                    f.write(vector.tobytes())
+                row['feature_id'] = feature_id
+                append_csv_record(self.metadata_path, row, FEATURE_METADATA_COLUMNS)
+            return feature_id
+
+        except Exception as e:
+            st.warning(f"Failed to store image features: {str(e)}")
+            return -1
+
+    def matrix(self):
+        """
+        Get all stored vectors as a read-only (rows, dim) memory map
+
+        Returns:
+            numpy.ndarray: Memory-mapped matrix (empty array if no rows)
+        """
+        rows = len(self)
+        if rows == 0:
+            return np.empty((0, self.dim), dtype=np.float32)
+        if self._matrix is None or self._matrix_rows != rows:
+            self._matrix = np.memmap(self.data_path, dtype=np.float32, mode='r', shape=(rows, self.dim))
+            self._matrix_rows = rows
+        return self._matrix
+
+    def column(self, name):
+        """
+        Get one feature across all stored images without loading any image
+
+        Args:
+            name: Feature column name (e.g. 'brightness')
+
+        Returns:
+            numpy.ndarray: 1D array of values
+        """
+        return np.asarray(self.matrix()[:, self.columns.index(name)])
+
+    def metadata(self):
+        """Load the metadata table linking feature ids to classifications"""
+        return load_from_csv(self.metadata_path)
+
+    def histogram(self, name, bins=20, value_range=None):
+        """
+        Distribution of a stored feature
+
+        Args:
+            name: Feature column name
+            bins: Number of histogram bins
+            value_range: Optional (min, max) range
+
+        Returns:
+            pandas.Series: Counts indexed by bin lower edge
+        """
+        values = self.column(name)
+        if values.size == 0:
+            return pd.Series(dtype=int)
+        counts, edges = np.histogram(values, bins=bins, range=value_range)
+        return pd.Series(counts, index=np.round(edges[:-1], 1))
+
+_STORE_CACHE = {}
+
+def get_feature_store(prefix=FEATURE_STORE_PREFIX):
+    """Get the shared feature store for a path prefix"""
+    store = _STORE_CACHE.get(prefix)
+    if store is None:
+        store = FeatureStore(prefix)
+        _STORE_CACHE[prefix] = store
+    return store
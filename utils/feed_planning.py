@@ -0,0 +1,249 @@
+"""
+Host-plant feed planning across all breeding batches
+Aggregates larval food demand per host plant through a precomputed species-to-plant
+sparse matrix, and keeps the totals current by applying per-batch deltas on writes
+"""
+
+import os
+import threading
+import datetime
+import numpy as np
+import pandas as pd
+from utils.csv_handlers import load_from_csv
+from utils.lifecycle_forecast import forecast_batches, FORECAST_STAGES, STAGE_MEANS
+from utils.batch_events import batch_key
+from data.butterfly_species_info import SPECIES_HOST_PLANTS
+
+FEED_HORIZONS = [7, 14, 30]
+LARVA_STAGE_DAYS = STAGE_MEANS[FORECAST_STAGES.index('larva')]
+
+class SpeciesPlantMatrix:
+    """
+    Species x host plant matrix in CSR form
+
+    Row s holds the plants species s feeds on, each with an equal share of its
+    demand (a species with three host plants puts a third on each). Plant names
+    are matched case-insensitively so 'Sugar Apple' and 'Sugar apple' merge.
+    """
+
+    def __init__(self, host_plants=SPECIES_HOST_PLANTS):
+        self.species = list(host_plants.keys())
+        self.species_index = {name: i for i, name in enumerate(self.species)}
+        self.daily_grams = np.array([host_plants[name]['dailyConsumption'] for name in self.species],
+                                    dtype=np.float64)
+
+        self.plants = []
+        plant_index = {}
+        indptr, indices, shares = [0], [], []
+        for name in self.species:
+            row = []
+            for plant in host_plants[name]['plant']:
+                key = plant.strip().lower()
+                if key not in plant_index:
+                    plant_index[key] = len(self.plants)
+                    self.plants.append(plant.strip())
+                if plant_index[key] not in row:
+                    row.append(plant_index[key])
+            indices.extend(row)
+            shares.extend([1.0 / len(row)] * len(row))
+            indptr.append(len(indices))
+
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.indices = np.array(indices, dtype=np.int64)
+        self.shares = np.array(shares, dtype=np.float64)
+        self.row_species = np.repeat(np.arange(len(self.species)), np.diff(self.indptr))
+
+    def row(self, species_idx):
+        """Plant indices and demand shares for one species"""
+        start, end = self.indptr[species_idx], self.indptr[species_idx + 1]
+        return self.indices[start:end], self.shares[start:end]
+
+    def to_plants(self, species_amounts):
+        """
+        Spread per-species amounts onto plants (species_amounts.T @ matrix)
+
+        Args:
+            species_amounts: (n_species,) or (n_species, k) array
+
+        Returns:
+            numpy.ndarray: (n_plants,) or (n_plants, k) array
+        """
+        amounts = np.asarray(species_amounts, dtype=np.float64)
+        weighted = amounts[self.row_species] * (self.shares if amounts.ndim == 1 else self.shares[:, None])
+        totals = np.zeros((len(self.plants),) + amounts.shape[1:])
+        np.add.at(totals, self.indices, weighted)
+        return totals
+
+    def plant_species(self):
+        """Species feeding on each plant, as a list of names per plant"""
+        feeders = [[] for _ in self.plants]
+        for plant_idx, species_idx in zip(self.indices, self.row_species):
+            feeders[plant_idx].append(self.species[species_idx])
+        return feeders
+
+def batch_feed_demand(batches_df, matrix, horizons=FEED_HORIZONS, now=None):
+    """
+    Feed demand of each batch in grams (vectorized)
+
+    Larvae eat from now until their projected pupation; eggs start eating once
+    they hatch (pupation minus the mean larval duration). Current counts are used
+    without mortality discounting so plans err on the side of enough food.
+
+    Args:
+        batches_df: breeding_batches rows
+        matrix: SpeciesPlantMatrix
+        horizons: Projection horizons in days
+        now: Reference time (defaults to the current time)
+
+    Returns:
+        tuple: (species index array, demand array of shape (rows, 1 + len(horizons)))
+               where column 0 is grams/day now and the rest are grams over each horizon;
+               species without host plant data have index -1 and zero demand
+    """
+    demand = np.zeros((len(batches_df), 1 + len(horizons)))
+    if batches_df.empty:
+        return np.empty(0, dtype=np.int64), demand
+
+    now_ts = pd.Timestamp.now() if now is None else pd.Timestamp(now)
+    forecast = forecast_batches(batches_df, now_ts)
+
+    species_idx = forecast['species'].map(matrix.species_index).fillna(-1).to_numpy(dtype=np.int64)
+    known = species_idx >= 0
+    daily = np.where(known, forecast['count'].to_numpy() * matrix.daily_grams[np.maximum(species_idx, 0)], 0.0)
+
+    is_larva = (forecast['stage'] == 'larva').to_numpy()
+    feeding = is_larva | (forecast['stage'] == 'egg').to_numpy()
+
+    # Feeding window in days from now: [start, end)
+    days_to_pupation = (forecast['pupation_date'] - now_ts.normalize()).dt.days.to_numpy(dtype=np.float64)
+    end = np.where(feeding, np.nan_to_num(days_to_pupation, nan=0.0), 0.0)
+    # Larvae still present past their projected pupation are fed at least through today
+    end = np.maximum(end, np.where(is_larva, 1.0, 0.0))
+    start = np.where(is_larva, 0.0, np.maximum(end - LARVA_STAGE_DAYS, 0.0))
+
+    demand[:, 0] = np.where(is_larva, daily, 0.0)
+    for column, horizon in enumerate(horizons, start=1):
+        demand[:, column] = daily * np.clip(np.minimum(end, horizon) - start, 0.0, None)
+
+    return species_idx, demand
+
+class FeedPlanner:
+    """Per-plant feed totals maintained incrementally from batch writes"""
+
+    def __init__(self, batches_file='breeding_batches.csv', horizons=FEED_HORIZONS):
+        self.batches_file = batches_file
+        self.horizons = list(horizons)
+        self.matrix = SpeciesPlantMatrix()
+        self.lock = threading.RLock()
+        self.contributions = {}
+        self.species_totals = np.zeros((len(self.matrix.species), 1 + len(self.horizons)))
+        self.plant_totals = np.zeros((len(self.matrix.plants), 1 + len(self.horizons)))
+        self.source_size = None
+        self.built_on = None
+
+    def _file_size(self):
+        return os.path.getsize(self.batches_file) if os.path.exists(self.batches_file) else 0
+
+    def rebuild(self):
+        """Recompute every batch's demand from a full read of the batches file"""
+        with self.lock:
+            batches_df = load_from_csv(self.batches_file)
+            self.contributions = {}
+            self.species_totals[:] = 0.0
+            if not batches_df.empty:
+                species_idx, demand = batch_feed_demand(batches_df, self.matrix, self.horizons)
+                keys = [batch_key(batch) for batch in batches_df[['batch_id', 'created_date']].to_dict('records')]
+                for key, s, row in zip(keys, species_idx, demand):
+                    self._add(key, s, row, update_plants=False)
+            self.plant_totals = self.matrix.to_plants(self.species_totals)
+            self.source_size = self._file_size()
+            self.built_on = datetime.date.today()
+
+    def _add(self, key, species_idx, row, update_plants=True):
+        """Replace one batch's contribution, applying only the difference"""
+        old = self.contributions.get(key)
+        if old is not None:
+            old_species, old_row = old
+            if old_species >= 0:
+                self.species_totals[old_species] -= old_row
+                if update_plants:
+                    plants, shares = self.matrix.row(old_species)
+                    self.plant_totals[plants] -= shares[:, None] * old_row
+        self.contributions[key] = (species_idx, row)
+        if species_idx >= 0:
+            self.species_totals[species_idx] += row
+            if update_plants:
+                plants, shares = self.matrix.row(species_idx)
+                self.plant_totals[plants] += shares[:, None] * row
+
+    def _is_stale(self, size_before=None):
+        """Whether the totals no longer match the file (pass size_before when about to apply a write)"""
+        expected = self._file_size() if size_before is None else size_before
+        return (self.built_on != datetime.date.today() or
+                self.source_size is None or self.source_size != expected)
+
+    def apply_batches(self, batches_df, size_before):
+        """
+        Update totals for batches that were just written
+
+        Only the written rows are re-forecast; their old contribution is
+        subtracted and the new one added to the affected plants.
+
+        Args:
+            batches_df: Written batch rows as they now stand in the file
+            size_before: Batches file size captured before the write
+        """
+        with self.lock:
+            if self._is_stale(size_before):
+                self.rebuild()
+                return
+            if not batches_df.empty:
+                species_idx, demand = batch_feed_demand(batches_df, self.matrix, self.horizons)
+                keys = [batch_key(batch) for batch in batches_df[['batch_id', 'created_date']].to_dict('records')]
+                for key, s, row in zip(keys, species_idx, demand):
+                    self._add(key, s, row)
+            self.source_size = self._file_size()
+
+    def plan(self):
+        """
+        Aggregate host plant demand
+
+        Returns:
+            pandas.DataFrame: One row per plant with demand, sorted by daily grams
+        """
+        with self.lock:
+            if self._is_stale():
+                self.rebuild()
+            plan = pd.DataFrame({
+                'plant': self.matrix.plants,
+                'species': [', '.join(names) for names in self.matrix.plant_species()],
+                'daily_grams': np.round(self.plant_totals[:, 0], 1)
+            })
+            for column, horizon in enumerate(self.horizons, start=1):
+                plan[f'next_{horizon}d_kg'] = np.round(self.plant_totals[:, column] / 1000, 2)
+            demand = plan.drop(columns=['plant', 'species']).sum(axis=1) > 0
+            return plan[demand].sort_values('daily_grams', ascending=False).reset_index(drop=True)
+
+    def species_plan(self):
+        """
+        Feed demand per species
+
+        Returns:
+            pandas.DataFrame: grams/day and kg per horizon, indexed by species
+        """
+        with self.lock:
+            if self._is_stale():
+                self.rebuild()
+            plan = pd.DataFrame({'daily_grams': np.round(self.species_totals[:, 0], 1)},
+                                index=self.matrix.species)
+            for column, horizon in enumerate(self.horizons, start=1):
+                plan[f'next_{horizon}d_kg'] = np.round(self.species_totals[:, column] / 1000, 2)
+            return plan[plan.sum(axis=1) > 0]
+
+_PLANNER = {}
+
+def get_feed_planner():
+    """Get the shared feed planner for this process"""
+    if 'planner' not in _PLANNER:
+        _PLANNER['planner'] = FeedPlanner()
+    return _PLANNER['planner']
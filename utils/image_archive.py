@@ -0,0 +1,179 @@
+"""
+Content-addressed archive for classification images
+Keeps originals on disk keyed by SHA-256, pre-generated WebP thumbnails for fast
+listing, and a gzip-compressed cold tier for old originals
+"""
+
+import os
+import io
+import gzip
+import shutil
+import hashlib
+import datetime
+from PIL import Image
+import streamlit as st
+from utils.image_processing import create_image_thumbnail, convert_image_format
+from utils.csv_handlers import STORAGE_DIR
+
+ARCHIVE_DIR = os.path.join(STORAGE_DIR, 'image_archive')
+THUMBNAIL_SIZE = (150, 150)
+THUMBNAIL_QUALITY = 80
+DEFAULT_HOT_RETENTION_DAYS = 30
+
+def _archive_path(tier, key, suffix, archive_dir=ARCHIVE_DIR):
+    """Sharded path for a key: <archive>/<tier>/<key[:2]>/<key><suffix>"""
+    return os.path.join(archive_dir, tier, key[:2], f"{key}{suffix}")
+
+def _original_suffix(image):
+    """File extension for an original based on its decoded format"""
+    image_format = (image.format or 'png').lower()
+    return '.jpg' if image_format == 'jpeg' else f".{image_format}"
+
+def archive_image(image_bytes, image=None, archive_dir=ARCHIVE_DIR):
+    """
+    Store an uploaded original and its thumbnail
+
+    Identical uploads map to the same key, so re-archiving is a no-op.
+
+    Args:
+        image_bytes: Raw bytes of the uploaded file
+        image: Optional decoded PIL Image (decoded from bytes if omitted)
+        archive_dir: Root archive directory
+
+    Returns:
+        str: Content key (SHA-256 hex digest), or empty string on failure
+    """
+    try:
+        key = hashlib.sha256(image_bytes).hexdigest()
+        if image is None:
+            image = Image.open(io.BytesIO(image_bytes))
+
+        original_path = _archive_path('originals', key, _original_suffix(image), archive_dir)
+        cold_path = _archive_path('cold', key, f"{_original_suffix(image)}.gz", archive_dir)
+        if not os.path.exists(original_path) and not os.path.exists(cold_path):
+            os.makedirs(os.path.dirname(original_path), exist_ok=True)
+            tmp_path = f"{original_path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(image_bytes)
+            os.replace(tmp_path, original_path)
+
+        thumbnail_path = _archive_path('thumbnails', key, '.webp', archive_dir)
+        if not os.path.exists(thumbnail_path):
+            os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+            thumbnail = create_image_thumbnail(convert_image_format(image, 'RGB'), THUMBNAIL_SIZE)
+            thumbnail.save(thumbnail_path, 'WEBP', quality=THUMBNAIL_QUALITY)
+
+        return key
+
+    except Exception as e:
+        st.warning(f"Failed to archive image: {str(e)}")
+        return ""
+
+def get_thumbnail_path(key, archive_dir=ARCHIVE_DIR):
+    """
+    Get the thumbnail file for an archived image
+
+    Args:
+        key: Content key returned by archive_image
+        archive_dir: Root archive directory
+
+    Returns:
+        str: Thumbnail path, or None if not archived
+    """
+    if not isinstance(key, str) or not key:
+        return None
+    path = _archive_path('thumbnails', key, '.webp', archive_dir)
+    return path if os.path.exists(path) else None
+
+def _find_original(key, archive_dir=ARCHIVE_DIR):
+    """Locate an original in the hot or cold tier; returns (path, is_cold)"""
+    for tier, is_cold in [('originals', False), ('cold', True)]:
+        shard = os.path.join(archive_dir, tier, key[:2])
+        if os.path.isdir(shard):
+            for name in os.listdir(shard):
+                if name.startswith(key) and not name.endswith('.tmp'):
+                    return os.path.join(shard, name), is_cold
+    return None, False
+
+def load_original(key, archive_dir=ARCHIVE_DIR):
+    """
+    Load an archived original from whichever tier holds it
+
+    Args:
+        key: Content key returned by archive_image
+        archive_dir: Root archive directory
+
+    Returns:
+        PIL.Image: Original image, or None if not found
+    """
+    try:
+        path, is_cold = _find_original(key, archive_dir)
+        if path is None:
+            return None
+        if is_cold:
+            with gzip.open(path, 'rb') as f:
+                return Image.open(io.BytesIO(f.read()))
+        return Image.open(path)
+    except Exception as e:
+        st.warning(f"Failed to load archived image {key}: {str(e)}")
+        return None
+
+def run_archive_retention(max_age_days=DEFAULT_HOT_RETENTION_DAYS, archive_dir=ARCHIVE_DIR, dry_run=False):
+    """
+    Move originals older than max_age_days to the compressed cold tier
+
+    Thumbnails stay in place so listings are unaffected.
+
+    Args:
+        max_age_days: Age in days after which originals move to cold storage
+        archive_dir: Root archive directory
+        dry_run: Report what would move without changing anything
+
+    Returns:
+        dict: Retention results
+    """
+    results = {
+        'checked': 0,
+        'moved': 0,
+        'errors': 0,
+        'bytes_before': 0,
+        'bytes_after': 0
+    }
+
+    originals_dir = os.path.join(archive_dir, 'originals')
+    if not os.path.isdir(originals_dir):
+        return results
+
+    cutoff = (datetime.datetime.now() - datetime.timedelta(days=max_age_days)).timestamp()
+
+    for shard in sorted(os.listdir(originals_dir)):
+        shard_dir = os.path.join(originals_dir, shard)
+        for name in sorted(os.listdir(shard_dir)):
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(shard_dir, name)
+            results['checked'] += 1
+            try:
+                if os.path.getmtime(path) >= cutoff:
+                    continue
+
+                size = os.path.getsize(path)
+                results['moved'] += 1
+                results['bytes_before'] += size
+                if dry_run:
+                    continue
+
+                cold_path = os.path.join(archive_dir, 'cold', shard, f"{name}.gz")
+                os.makedirs(os.path.dirname(cold_path), exist_ok=True)
+                tmp_path = f"{cold_path}.tmp"
+                with open(path, 'rb') as src, gzip.open(tmp_path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                os.replace(tmp_path, cold_path)
+                os.remove(path)
+                results['bytes_after'] += os.path.getsize(cold_path)
+
+            except Exception as e:
+                results['errors'] += 1
+                st.warning(f"Error archiving {path}: {str(e)}")
+
+    return results
@@ -0,0 +1,329 @@
+"""
+Perceptual image hashing utilities for AI classification
+Detects near-duplicate uploads (burst shots of the same cage) so prior results can be reused
+"""
+
+import os
+import json
+import datetime
+from collections import OrderedDict
+import numpy as np
+import streamlit as st
+from utils.csv_handlers import STORAGE_DIR
+
+# Hash configuration
+HASH_SIZE = 8
+PHASH_HIGHFREQ_FACTOR = 4
+DEFAULT_MAX_HAMMING_DISTANCE = 6
+DEFAULT_MAX_INDEX_ENTRIES = 5000
+HASH_INDEX_FILE = os.path.join(STORAGE_DIR, 'classification_hash_index.json')
+
+def _to_grayscale(img_array):
+    """
+    Convert a preprocessed model input array to a 2D grayscale array
+
+    Args:
+        img_array: Array of shape (1, H, W, 3) or (H, W, 3) with values in [0, 1]
+
+    Returns:
+        numpy.ndarray: 2D float32 grayscale array
+    """
+    arr = np.asarray(img_array, dtype=np.float32)
+    if arr.ndim == 4:
+        arr = arr[0]
+    if arr.ndim == 3:
+        # ITU-R 601 luma weights, same as PIL's "L" conversion
+        arr = arr @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    return arr
+
+def _resize_area(gray, out_height, out_width):
+    """
+    Downsample a 2D array by averaging pixel blocks (area interpolation)
+
+    Args:
+        gray: 2D numpy array
+        out_height: Output row count
+        out_width: Output column count
+
+    Returns:
+        numpy.ndarray: Downsampled 2D array
+    """
+    rows = np.linspace(0, gray.shape[0], out_height + 1).astype(int)[:-1]
+    cols = np.linspace(0, gray.shape[1], out_width + 1).astype(int)[:-1]
+    row_counts = np.diff(np.append(rows, gray.shape[0]))
+    col_counts = np.diff(np.append(cols, gray.shape[1]))
+    sums = np.add.reduceat(np.add.reduceat(gray, rows, axis=0), cols, axis=1)
+    return sums / np.outer(row_counts, col_counts)
+
+def _bits_to_int(bits):
+    """Pack a boolean array into a Python integer hash"""
+    value = 0
+    for bit in bits.ravel():
+        value = (value << 1) | int(bit)
+    return value
+
+def _dct_matrix(n):
+    """Build an orthonormal DCT-II transform matrix of size n x n"""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0, :] = np.sqrt(1.0 / n)
+    return matrix.astype(np.float32)
+
+_DCT_CACHE = {}
+
+def compute_dhash(img_array, hash_size=HASH_SIZE):
+    """
+    Compute difference hash (dHash) of a preprocessed image array
+
+    Args:
+        img_array: Preprocessed image array (e.g. 1x180x180x3 model input)
+        hash_size: Hash grid size (hash has hash_size**2 bits)
+
+    Returns:
+        int: Perceptual hash as integer
+    """
+    gray = _to_grayscale(img_array)
+    small = _resize_area(gray, hash_size, hash_size + 1)
+    return _bits_to_int(small[:, 1:] > small[:, :-1])
+
+def compute_phash(img_array, hash_size=HASH_SIZE, highfreq_factor=PHASH_HIGHFREQ_FACTOR):
+    """
+    Compute DCT-based perceptual hash (pHash) of a preprocessed image array
+
+    Args:
+        img_array: Preprocessed image array (e.g. 1x180x180x3 model input)
+        hash_size: Hash grid size (hash has hash_size**2 bits)
+        highfreq_factor: Oversampling factor before keeping low frequencies
+
+    Returns:
+        int: Perceptual hash as integer
+    """
+    size = hash_size * highfreq_factor
+    if size not in _DCT_CACHE:
+        _DCT_CACHE[size] = _dct_matrix(size)
+    dct = _DCT_CACHE[size]
+
+    gray = _to_grayscale(img_array)
+    small = _resize_area(gray, size, size)
+    coefficients = (dct @ small @ dct.T)[:hash_size, :hash_size]
+
+    # Exclude the DC term from the median so flat brightness changes don't flip bits
+    median = np.median(coefficients.ravel()[1:])
+    return _bits_to_int(coefficients > median)
+
+def hamming_distance(hash_a, hash_b):
+    """Number of differing bits between two integer hashes"""
+    return (hash_a ^ hash_b).bit_count()
+
+class BKTree:
+    """Burkhard-Keller tree for Hamming-distance nearest neighbour lookups"""
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, hash_value, key):
+        """
+        Insert a hash into the tree
+
+        Args:
+            hash_value: Integer hash
+            key: Identifier stored alongside the hash
+        """
+        node = [hash_value, key, {}]
+        self.size += 1
+        if self.root is None:
+            self.root = node
+            return
+
+        current = self.root
+        while True:
+            distance = hamming_distance(hash_value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, hash_value, max_distance):
+        """
+        Find all hashes within max_distance of hash_value
+
+        Args:
+            hash_value: Integer hash to look up
+            max_distance: Maximum Hamming distance (inclusive)
+
+        Returns:
+            list: (distance, key) tuples sorted by distance
+        """
+        matches = []
+        if self.root is None:
+            return matches
+
+        candidates = [self.root]
+        while candidates:
+            node_hash, node_key, children = candidates.pop()
+            distance = hamming_distance(hash_value, node_hash)
+            if distance <= max_distance:
+                matches.append((distance, node_key))
+
+            # Triangle inequality prunes every child outside [d - r, d + r]
+            low, high = distance - max_distance, distance + max_distance
+            for child_distance, child in children.items():
+                if low <= child_distance <= high:
+                    candidates.append(child)
+
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+class DuplicateIndex:
+    """Bounded, persisted index of image hashes mapped to prior classification results"""
+
+    def __init__(self, path=HASH_INDEX_FILE, max_entries=DEFAULT_MAX_INDEX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.tree = BKTree()
+        self._tree_dirty = False
+        self.load()
+
+    def load(self):
+        """Load entries from disk if the index file exists"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                stored = json.load(f)
+            for entry in stored.get('entries', []):
+                self.entries[entry['key']] = entry
+            self._evict()
+            self._rebuild_tree()
+        except Exception as e:
+            st.warning(f"Failed to load duplicate index {self.path}: {str(e)}")
+            self.entries = OrderedDict()
+            self.tree = BKTree()
+
+    def save(self):
+        """Persist entries to disk atomically"""
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'entries': list(self.entries.values())}, f)
+            os.replace(tmp_path, self.path)
+            return True
+        except Exception as e:
+            st.warning(f"Failed to save duplicate index {self.path}: {str(e)}")
+            return False
+
+    def _rebuild_tree(self):
+        """Rebuild the BK-tree (BK-trees don't support deletion)"""
+        self.tree = BKTree()
+        for key, entry in self.entries.items():
+            self.tree.add(entry['phash'], key)
+        self._tree_dirty = False
+
+    def _evict(self):
+        """Drop oldest entries beyond max_entries"""
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self._tree_dirty = True
+
+    def lookup(self, phash, dhash, analysis_type, max_distance=DEFAULT_MAX_HAMMING_DISTANCE):
+        """
+        Find a prior result for a near-duplicate image
+
+        pHash candidates from the BK-tree are confirmed with dHash so that
+        both hashes must fall within max_distance.
+
+        Args:
+            phash: pHash of the new image
+            dhash: dHash of the new image
+            analysis_type: Analysis type the stored result must match
+            max_distance: Maximum Hamming distance for a match
+
+        Returns:
+            dict: Matching index entry with 'distance' added, or None
+        """
+        if self._tree_dirty:
+            self._rebuild_tree()
+
+        for distance, key in self.tree.search(phash, max_distance):
+            entry = self.entries.get(key)
+            if entry is None or entry['analysis_type'] != analysis_type:
+                continue
+            if hamming_distance(dhash, entry['dhash']) > max_distance:
+                continue
+
+            # Refresh recency so frequently re-uploaded cages stay indexed
+            self.entries.move_to_end(key)
+            match = dict(entry)
+            match['distance'] = distance
+            return match
+
+        return None
+
+    def add(self, phash, dhash, analysis_type, results):
+        """
+        Record a classification result for an image hash
+
+        Args:
+            phash: pHash of the image
+            dhash: dHash of the image
+            analysis_type: Analysis type performed
+            results: Classification results dictionary
+
+        Returns:
+            str: Key of the stored entry
+        """
+        key = f"{phash:016x}{dhash:016x}:{analysis_type}"
+        self.entries[key] = {
+            'key': key,
+            'phash': phash,
+            'dhash': dhash,
+            'analysis_type': analysis_type,
+            'results': results,
+            'timestamp': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+        self.entries.move_to_end(key)
+        self.tree.add(phash, key)
+        self._evict()
+        self.save()
+        return key
+
+_INDEX_CACHE = {}
+
+def get_duplicate_index(path=HASH_INDEX_FILE, max_entries=DEFAULT_MAX_INDEX_ENTRIES):
+    """
+    Get the shared duplicate index, loading it from disk once per process
+
+    Args:
+        path: Index file path
+        max_entries: Maximum number of hashes retained
+
+    Returns:
+        DuplicateIndex: Loaded index
+    """
+    index = _INDEX_CACHE.get(path)
+    if index is None:
+        index = DuplicateIndex(path, max_entries)
+        _INDEX_CACHE[path] = index
+    elif index.max_entries != max_entries:
+        index.max_entries = max_entries
+        index._evict()
+    return index
+
+def compute_image_hashes(img_array):
+    """
+    Compute both perceptual hashes for a preprocessed image array
+
+    Args:
+        img_array: Preprocessed image array (e.g. 1x180x180x3 model input)
+
+    Returns:
+        tuple: (phash, dhash)
+    """
+    return compute_phash(img_array), compute_dhash(img_array)
@@ -12,6 +12,16 @@ import streamlit as st
 MODEL_IMAGE_SIZE = (180, 180)
 SUPPORTED_FORMATS = ['jpg', 'jpeg', 'png', 'bmp', 'tiff']
 
+# Color feature extraction settings
+FEATURE_SAMPLE_SIZE = (64, 64)
+COLOR_HISTOGRAM_BINS = 16
+COLOR_FEATURE_COLUMNS = (
+    [f'mean_{c}' for c in 'rgb'] + [f'std_{c}' for c in 'rgb'] +
+    [f'min_{c}' for c in 'rgb'] + [f'max_{c}' for c in 'rgb'] +
+    ['brightness', 'contrast'] +
+    [f'hist_{c}_{i}' for c in 'rgb' for i in range(COLOR_HISTOGRAM_BINS)]
+)
+
 def validate_image(image_file):
     """
     Validate uploaded image file
@@ -356,12 +366,18 @@ def batch_process_images(image_files, enhancement=True):
     
     return results
 
-def extract_color_features(image):
+def extract_color_features(image, sample_size=FEATURE_SAMPLE_SIZE, histogram_bins=COLOR_HISTOGRAM_BINS):
     """
     Extract color features from image for analysis
     
+    The image is downsampled first and every statistic is derived from one
+    fused histogram pass (per-channel 256-bin counts plus the R+G+B sum),
+    instead of separate full-array passes for each statistic.
+    
     Args:
         image: PIL Image object
+        sample_size: Maximum (width, height) of the downsampled image
+        histogram_bins: Number of bins per channel in the stored color histogram
         
     Returns:
         dict: Color feature information
@@ -371,27 +387,67 @@ def extract_color_features(image):
         if image.mode != 'RGB':
             image = convert_image_format(image, 'RGB')
         
-        # Get image as numpy array
-        img_array = np.array(image)
+        # Downsample before touching pixels; statistics are stable at this size
+        sample = image.copy()
+        sample.thumbnail(sample_size, Image.Resampling.BILINEAR)
+        pixels = np.asarray(sample, dtype=np.int32).reshape(-1, 3)
+        pixel_count = pixels.shape[0]
         
-        # Calculate color statistics
-        features = {
-            'mean_rgb': np.mean(img_array, axis=(0, 1)).tolist(),
-            'std_rgb': np.std(img_array, axis=(0, 1)).tolist(),
-            'min_rgb': np.min(img_array, axis=(0, 1)).tolist(),
-            'max_rgb': np.max(img_array, axis=(0, 1)).tolist()
-        }
+        # One bincount over offset indices: R in [0,256), G in [256,512),
+        # B in [512,768) and the channel sum in [768,1534)
+        offsets = np.array([0, 256, 512], dtype=np.int32)
+        indices = np.empty((pixel_count, 4), dtype=np.int32)
+        indices[:, :3] = pixels + offsets
+        indices[:, 3] = pixels.sum(axis=1) + 768
+        counts = np.bincount(indices.ravel(), minlength=768 + 766)
         
-        # Calculate overall brightness
-        brightness = np.mean(img_array)
-        features['brightness'] = float(brightness)
+        channel_hist = counts[:768].reshape(3, 256).astype(np.float64)
+        sum_hist = counts[768:].astype(np.float64)
         
-        # Calculate contrast (standard deviation of grayscale)
-        gray = np.mean(img_array, axis=2)
-        features['contrast'] = float(np.std(gray))
+        levels = np.arange(256, dtype=np.float64)
+        mean_rgb = channel_hist @ levels / pixel_count
+        var_rgb = channel_hist @ (levels ** 2) / pixel_count - mean_rgb ** 2
+        nonzero = channel_hist > 0
+        min_rgb = nonzero.argmax(axis=1)
+        max_rgb = 255 - nonzero[:, ::-1].argmax(axis=1)
+        
+        gray_levels = np.arange(766, dtype=np.float64) / 3.0
+        gray_mean = sum_hist @ gray_levels / pixel_count
+        gray_var = sum_hist @ (gray_levels ** 2) / pixel_count - gray_mean ** 2
+        
+        histogram = channel_hist.reshape(3, histogram_bins, -1).sum(axis=2) / pixel_count
+        
+        features = {
+            'mean_rgb': mean_rgb.tolist(),
+            'std_rgb': np.sqrt(np.maximum(var_rgb, 0.0)).tolist(),
+            'min_rgb': min_rgb.tolist(),
+            'max_rgb': max_rgb.tolist(),
+            'brightness': float(gray_mean),
+            'contrast': float(np.sqrt(max(gray_var, 0.0))),
+            'histogram': histogram.tolist()
+        }
         
         return features
         
     except Exception as e:
         st.warning(f"Color feature extraction failed: {str(e)}")
         return {}
+
+def color_features_to_vector(features):
+    """
+    Flatten color features into a fixed-length float32 vector
+    
+    Args:
+        features: Dictionary returned by extract_color_features
+        
+    Returns:
+        numpy.ndarray: Vector laid out as COLOR_FEATURE_COLUMNS
+    """
+    return np.concatenate([
+        features['mean_rgb'],
+        features['std_rgb'],
+        features['min_rgb'],
+        features['max_rgb'],
+        [features['brightness'], features['contrast']],
+        np.ravel(features['histogram'])
+    ]).astype(np.float32)
@@ -0,0 +1,319 @@
+"""
+Stock ledger per species and life stage
+Every stock movement is appended to inventory_ledger.csv; on-hand quantities are
+kept in a lock-protected in-memory table rebuilt from the ledger only when the
+file changed outside the app, so stock checks are dictionary lookups and two
+sessions can never sell the same last unit. Stock limits apply to a species once
+it has any ledger entry (an opening balance, adjustment or emerged batch)
+"""
+
+import os
+import threading
+import datetime
+import pandas as pd
+from utils.csv_handlers import append_csv_records, load_from_csv
+from utils.batch_events import batch_key
+
+INVENTORY_LEDGER_FILE = 'inventory_ledger.csv'
+LEDGER_COLUMNS = ['entry_id', 'timestamp', 'species', 'stage', 'delta', 'reason', 'reference', 'recorded_by']
+STOCK_STAGES = ['egg', 'larva', 'pupa', 'adult']
+
+# Batches entering these stages add their current count to stock
+EMERGENCE_STAGES = ['pupa', 'adult']
+
+# Adult stock on hand when the ledger was introduced (the quick-order page's former fixed figures)
+OPENING_STOCK = {
+    'Butterfly-Common Lime': 25,
+    'Butterfly-Common Mormon': 15,
+    'Butterfly-Paper Kite': 20,
+    'Butterfly-Emerald Swallowtail': 8,
+    'Butterfly-Golden Birdwing': 3,
+    'Butterfly-Plain Tiger': 30,
+    'Moth-Atlas': 12,
+    'Butterfly-Red Lacewing': 10
+}
+
+def batch_count(batch):
+    """A batch row's count as an int (0 when missing or not a number)"""
+    if batch is None:
+        return 0
+    count = pd.to_numeric(batch.get('larva_count'), errors='coerce')
+    return 0 if pd.isna(count) else max(int(count), 0)
+
+class InsufficientStock(Exception):
+    """Raised when a movement would take stock below zero"""
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        details = ', '.join(f"{species} ({stage}): requested {requested}, available {available}"
+                            for species, stage, requested, available in shortages)
+        super().__init__(f"Insufficient stock: {details}")
+
+def movement(species, stage, delta):
+    """One stock movement as (species, stage, delta)"""
+    return (str(species), str(stage).lower(), int(delta))
+
+class InventoryLedger:
+    """
+    On-hand and reserved stock maintained from the ledger
+
+    Available stock is on-hand minus reservations. Checkout reserves stock
+    in memory when an order is placed and records the ledger rows once the
+    order is journaled, so a failed checkout only has to release the
+    reservation.
+    """
+
+    def __init__(self, ledger_file=INVENTORY_LEDGER_FILE):
+        self.ledger_file = ledger_file
+        self.lock = threading.RLock()
+        self.on_hand = {}
+        self.reserved = {}
+        # Species with any ledger entry; only these are held to their stock
+        self.tracked = set()
+        # Stages each batch has already been credited at, by batch_key (batch IDs can repeat)
+        self.emerged = {}
+        self.source_size = None
+        self.entries = 0
+
+    def _file_size(self):
+        return os.path.getsize(self.ledger_file) if os.path.exists(self.ledger_file) else 0
+
+    def rebuild(self):
+        """Recompute on-hand stock from a full read of the ledger"""
+        with self.lock:
+            ledger = load_from_csv(self.ledger_file)
+            self.on_hand, self.tracked, self.emerged = {}, set(), {}
+            if not ledger.empty:
+                ledger['stage'] = ledger['stage'].astype(str).str.lower()
+                totals = ledger.groupby(['species', 'stage'])['delta'].sum()
+                self.on_hand = {key: int(value) for key, value in totals.items()}
+                self.tracked = set(ledger['species'].astype(str))
+                credits = ledger[(ledger['reason'] == 'emergence') & (ledger['delta'] > 0)]
+                for reference, stage in zip(credits['reference'].astype(str), credits['stage']):
+                    self.emerged.setdefault(reference, set()).add(stage)
+            self.entries = len(ledger)
+            self.source_size = self._file_size()
+
+    def refresh(self):
+        """Rebuild if the ledger was changed outside this process"""
+        with self.lock:
+            if self.source_size is None or self.source_size != self._file_size():
+                self.rebuild()
+
+    def tracks(self, species):
+        """Whether stock limits apply to a species (it has ledger entries)"""
+        with self.lock:
+            if self.source_size is None:
+                self.rebuild()
+            return species in self.tracked
+
+    def available(self, species, stage='adult'):
+        """Stock that can still be sold"""
+        key = (species, stage)
+        with self.lock:
+            if self.source_size is None:
+                self.rebuild()
+            return self.on_hand.get(key, 0) - self.reserved.get(key, 0)
+
+    def _shortages(self, movements):
+        requested = {}
+        for species, stage, delta in movements:
+            if delta < 0:
+                requested[(species, stage)] = requested.get((species, stage), 0) - delta
+        shortages = []
+        for (species, stage), quantity in requested.items():
+            if species not in self.tracked:
+                continue
+            available = self.on_hand.get((species, stage), 0) - self.reserved.get((species, stage), 0)
+            if quantity > available:
+                shortages.append((species, stage, quantity, available))
+        return shortages
+
+    def reserve(self, movements):
+        """
+        Hold stock for an order that is about to be committed
+
+        Raises:
+            InsufficientStock: If any debit exceeds available stock (nothing is reserved)
+        """
+        with self.lock:
+            self.refresh()
+            shortages = self._shortages(movements)
+            if shortages:
+                raise InsufficientStock(shortages)
+            for species, stage, delta in movements:
+                if delta < 0:
+                    key = (species, stage)
+                    self.reserved[key] = self.reserved.get(key, 0) - delta
+
+    def release(self, movements):
+        """Drop a reservation whose order was not committed"""
+        with self.lock:
+            for species, stage, delta in movements:
+                if delta < 0:
+                    key = (species, stage)
+                    self.reserved[key] = self.reserved.get(key, 0) + delta
+                    if self.reserved[key] <= 0:
+                        del self.reserved[key]
+
+    def record(self, groups, enforce=True, reserved=False):
+        """
+        Append movements to the ledger in one write and apply them to stock
+
+        Args:
+            groups: List of (movements, reason, reference, recorded_by)
+            enforce: Reject debits beyond available stock
+            reserved: Debits were reserved earlier and are now settled
+
+        Returns:
+            bool: Success status
+
+        Raises:
+            InsufficientStock: If enforce is set and stock is short (nothing is written)
+        """
+        with self.lock:
+            self.refresh()
+            all_movements = [m for group in groups for m in group[0]]
+            if reserved:
+                self.release(all_movements)
+            elif enforce:
+                shortages = self._shortages(all_movements)
+                if shortages:
+                    raise InsufficientStock(shortages)
+
+            now = datetime.datetime.now()
+            timestamp = now.strftime('%Y-%m-%d %H:%M:%S')
+            stamp = now.strftime('%Y%m%d%H%M%S')
+            rows = []
+            for movements, reason, reference, recorded_by in groups:
+                for species, stage, delta in movements:
+                    if delta == 0:
+                        continue
+                    rows.append({
+                        'entry_id': f"INV_{stamp}_{self.entries + len(rows)}",
+                        'timestamp': timestamp,
+                        'species': species,
+                        'stage': stage,
+                        'delta': delta,
+                        'reason': reason,
+                        'reference': reference,
+                        'recorded_by': recorded_by
+                    })
+            if not rows:
+                return True
+
+            size_before = self._file_size()
+            if not append_csv_records(self.ledger_file, rows, LEDGER_COLUMNS):
+                return False
+            if size_before != self.source_size:
+                self.rebuild()
+                return True
+            for row in rows:
+                key = (row['species'], row['stage'])
+                self.on_hand[key] = self.on_hand.get(key, 0) + row['delta']
+                self.tracked.add(row['species'])
+                if row['reason'] == 'emergence' and row['delta'] > 0:
+                    self.emerged.setdefault(str(row['reference']), set()).add(row['stage'])
+            self.entries += len(rows)
+            self.source_size = self._file_size()
+            return True
+
+    def record_batches(self, previous_rows, updated_rows, recorded_by):
+        """
+        Move stock for batch writes
+
+        A batch is credited once per stage in EMERGENCE_STAGES, the first time
+        it enters that stage, keyed on batch_key; stage corrections that leave
+        and re-enter a stage add nothing. A pupa batch emerging as adults
+        also takes its pupa count out of pupa stock (never below zero, since
+        pupae may have been sold). Count edits on a batch in a stage it was
+        credited at, deaths included, move stock by the difference.
+
+        Args:
+            previous_rows: Batch rows before the write (None for new batches)
+            updated_rows: The same batches as written, with batch_id, created_date, species, stage and larva_count
+            recorded_by: Username stored on the ledger rows
+        """
+        with self.lock:
+            self.refresh()
+            groups, left, emerged = [], {}, {}
+
+            def take(species, stage, quantity):
+                """Debit up to quantity, limited to what is left at that stage"""
+                key = (species, stage)
+                remaining = left.get(key, max(self.available(species, stage), 0))
+                taken = min(quantity, remaining)
+                left[key] = remaining - taken
+                return movement(species, stage, -taken)
+
+            for previous, batch in zip(previous_rows, updated_rows):
+                key, species = batch_key(batch), batch['species']
+                old_stage = previous.get('stage') if previous is not None else None
+                new_stage = batch.get('stage')
+                old_count, new_count = batch_count(previous), batch_count(batch)
+                credited = emerged.get(key, self.emerged.get(key, set()))
+
+                if new_stage != old_stage:
+                    if new_stage not in EMERGENCE_STAGES or new_stage in credited:
+                        continue
+                    movements = [movement(species, new_stage, new_count)]
+                    if old_stage == 'pupa' and new_stage == 'adult' and 'pupa' in credited:
+                        # Every pupa of the batch leaves pupa stock, emerged or not
+                        movements.append(take(species, 'pupa', old_count))
+                    groups.append((movements, 'emergence', key, recorded_by))
+                    emerged[key] = credited | {new_stage}
+                elif new_stage in credited and new_count != old_count:
+                    change = (movement(species, new_stage, new_count - old_count) if new_count > old_count
+                              else take(species, new_stage, old_count - new_count))
+                    groups.append(([change], 'batch_count', key, recorded_by))
+            return self.record(groups, enforce=False)
+
+    def stock_table(self):
+        """
+        Current stock levels
+
+        Returns:
+            pandas.DataFrame: species, stage, on_hand, reserved and available
+        """
+        with self.lock:
+            self.refresh()
+            keys = sorted(set(self.on_hand) | set(self.reserved))
+            rows = [{'species': species, 'stage': stage,
+                     'on_hand': self.on_hand.get((species, stage), 0),
+                     'reserved': self.reserved.get((species, stage), 0)}
+                    for species, stage in keys]
+        table = pd.DataFrame(rows, columns=['species', 'stage', 'on_hand', 'reserved'])
+        table['available'] = table['on_hand'] - table['reserved']
+        return table
+
+def seed_opening_balance(ledger_file=INVENTORY_LEDGER_FILE, batches_file='breeding_batches.csv'):
+    """
+    Give an empty ledger its opening stock
+
+    Writes OPENING_STOCK as adult stock and credits every batch already at
+    the pupa or adult stage (so those batches are not credited again when
+    edited). Does nothing once the ledger has any entry.
+
+    Returns:
+        int: Ledger rows written
+    """
+    if os.path.exists(ledger_file) and len(load_from_csv(ledger_file)):
+        return 0
+    ledger = InventoryLedger(ledger_file)
+    groups = [([movement(species, 'adult', quantity) for species, quantity in OPENING_STOCK.items()],
+               'opening_balance', 'migration', 'system')]
+    batches_df = load_from_csv(batches_file)
+    if not batches_df.empty:
+        for batch in batches_df[batches_df['stage'].isin(EMERGENCE_STAGES)].to_dict('records'):
+            groups.append(([movement(batch['species'], batch['stage'], batch_count(batch))],
+                           'emergence', batch_key(batch), 'system'))
+    ledger.record(groups, enforce=False)
+    return sum(len(group[0]) for group in groups)
+
+_INVENTORY = {}
+
+def get_inventory():
+    """Get the shared inventory ledger for this process"""
+    if 'ledger' not in _INVENTORY:
+        _INVENTORY['ledger'] = InventoryLedger()
+    return _INVENTORY['ledger']
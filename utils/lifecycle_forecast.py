@@ -0,0 +1,299 @@
+"""
+Vectorized lifecycle forecasting for breeding batches
+Projects pupation and emergence dates and expected survivors for every batch at once
+using stage durations from LIFESTAGES_INFO and species success rates from BREEDING_DIFFICULTY
+"""
+
+import os
+import time
+import datetime
+import numpy as np
+import pandas as pd
+from utils.csv_handlers import load_from_csv_cached
+from utils.batch_events import get_batch_event_store
+from data.butterfly_species_info import LIFESTAGES_INFO, BREEDING_DIFFICULTY
+
+# Batch stages in lifecycle order, mapped to LIFESTAGES_INFO entries
+FORECAST_STAGES = ['egg', 'larva', 'pupa', 'adult']
+STAGE_INFO_KEYS = {'egg': 'Eggs', 'larva': 'Larvae', 'pupa': 'Pupae', 'adult': 'Butterfly'}
+PUPA, ADULT = 2, 3
+
+# Share of overall egg-to-adult mortality attributed to each pre-adult stage
+STAGE_MORTALITY_WEIGHTS = np.array([0.2, 0.5, 0.3, 0.0])
+
+DEFAULT_SUCCESS_RATE = 70
+CONFIDENCE_Z = 1.645  # two-sided 90% interval
+SECONDS_PER_DAY = 86400.0
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def _parse_duration(duration):
+    """Parse a 'min-max' day range string"""
+    low, high = duration.split('-')
+    return float(low), float(high)
+
+def _stage_duration_table():
+    """Mean and variance (days) of each stage, modelling duration as uniform on its range"""
+    ranges = np.array([_parse_duration(LIFESTAGES_INFO[STAGE_INFO_KEYS[stage]]['duration_days'])
+                       for stage in FORECAST_STAGES])
+    means = ranges.mean(axis=1)
+    variances = (ranges[:, 1] - ranges[:, 0]) ** 2 / 12.0
+    return ranges, means, variances
+
+STAGE_RANGES, STAGE_MEANS, STAGE_VARIANCES = _stage_duration_table()
+
+# Cumulative sums let "time until stage j" be a gather instead of a per-row loop:
+# days from the start of stage i to the start of stage j = CUM[j] - CUM[i]
+_CUM_MEANS = np.concatenate([[0.0], np.cumsum(STAGE_MEANS)])
+_CUM_VARIANCES = np.concatenate([[0.0], np.cumsum(STAGE_VARIANCES)])
+_CUM_WEIGHTS = np.concatenate([[0.0], np.cumsum(STAGE_MORTALITY_WEIGHTS)])
+
+SPECIES_NAMES = list(BREEDING_DIFFICULTY.keys())
+SPECIES_SUCCESS = np.array([BREEDING_DIFFICULTY[name]['success_rate'] for name in SPECIES_NAMES] +
+                           [DEFAULT_SUCCESS_RATE], dtype=np.float64) / 100.0
+
+def _time_to_stage(stage_idx, elapsed_days, target):
+    """
+    Days until each batch enters the target stage (vectorized)
+
+    Returns:
+        tuple: (mean days, variance) arrays; NaN where the batch is already past the target
+    """
+    # Remaining time in the current stage, given time already spent in it
+    remaining = np.maximum(STAGE_MEANS[stage_idx] - elapsed_days, 0.0)
+    later = _CUM_MEANS[target] - _CUM_MEANS[stage_idx + 1]
+    mean = remaining + np.maximum(later, 0.0)
+
+    # Elapsed time narrows the current stage's spread proportionally
+    current_fraction = np.clip(remaining / np.maximum(STAGE_MEANS[stage_idx], 1e-9), 0.0, 1.0)
+    later_var = np.maximum(_CUM_VARIANCES[target] - _CUM_VARIANCES[stage_idx + 1], 0.0)
+    variance = STAGE_VARIANCES[stage_idx] * current_fraction ** 2 + later_var
+
+    past = stage_idx >= target
+    mean = np.where(past, np.nan, mean)
+    variance = np.where(past, np.nan, variance)
+    return mean, variance
+
+def _survival_to_stage(species_idx, stage_idx, target):
+    """Probability of surviving from the current stage to the target stage"""
+    success = SPECIES_SUCCESS[species_idx]
+    exponent = np.maximum(_CUM_WEIGHTS[target] - _CUM_WEIGHTS[stage_idx], 0.0)
+    return success ** exponent
+
+def expected_survival(species_name, stage, from_stage='egg'):
+    """
+    Expected fraction of a batch still alive on reaching a stage
+
+    Args:
+        species_name: Species key from BREEDING_DIFFICULTY
+        stage: Stage name from FORECAST_STAGES
+        from_stage: Stage the batch started in (its count is the baseline)
+
+    Returns:
+        float: Probability (1.0 when stage is not after from_stage, or unknown)
+    """
+    if stage not in FORECAST_STAGES:
+        return 1.0
+    start = FORECAST_STAGES.index(from_stage) if from_stage in FORECAST_STAGES else 0
+    success = BREEDING_DIFFICULTY.get(species_name, {}).get('success_rate', DEFAULT_SUCCESS_RATE) / 100.0
+    return success ** max(_CUM_WEIGHTS[FORECAST_STAGES.index(stage)] - _CUM_WEIGHTS[start], 0.0)
+
+def forecast_arrays(species_idx, stage_idx, counts, stage_start, now):
+    """
+    Core forecast over NumPy arrays
+
+    Args:
+        species_idx: int array indexing SPECIES_NAMES (len(SPECIES_NAMES) = unknown species)
+        stage_idx: int array indexing FORECAST_STAGES
+        counts: Current individuals per batch
+        stage_start: Stage start times as float seconds since epoch
+        now: Forecast reference time as float seconds since epoch
+
+    Returns:
+        dict: Arrays of projected dates (seconds since epoch) and survivor counts
+    """
+    counts = counts.astype(np.float64)
+    elapsed = np.maximum(now - stage_start, 0.0) / SECONDS_PER_DAY
+
+    results = {}
+    for label, target in [('pupation', PUPA), ('emergence', ADULT)]:
+        mean, variance = _time_to_stage(stage_idx, elapsed, target)
+        spread = CONFIDENCE_Z * np.sqrt(variance)
+        results[f'{label}_date'] = now + mean * SECONDS_PER_DAY
+        results[f'{label}_low'] = now + np.maximum(mean - spread, 0.0) * SECONDS_PER_DAY
+        results[f'{label}_high'] = now + (mean + spread) * SECONDS_PER_DAY
+
+        # Binomial expectation with a normal-approximation interval
+        p = _survival_to_stage(species_idx, stage_idx, target)
+        expected = counts * p
+        margin = CONFIDENCE_Z * np.sqrt(counts * p * (1.0 - p))
+        survivors = 'pupae' if target == PUPA else 'adults'
+        results[f'expected_{survivors}'] = np.where(stage_idx >= target, np.nan, expected)
+        results[f'{survivors}_low'] = np.where(stage_idx >= target, np.nan, np.maximum(expected - margin, 0.0))
+        results[f'{survivors}_high'] = np.where(stage_idx >= target, np.nan, np.minimum(expected + margin, counts))
+
+    return results
+
+def stage_start_times(batches_df):
+    """
+    Start of each batch's current stage, from the batch event history
+
+    last_updated is stamped by every edit (notes, health), so it cannot
+    tell when the stage began.
+
+    Returns:
+        pandas.Series: Timestamp strings aligned with batches_df (NaN for batches the history does not know)
+    """
+    starts = get_batch_event_store().stage_starts()
+    keys = batches_df['batch_id'].astype(str) + '@' + batches_df['created_date'].astype(str)
+    return keys.map(starts)
+
+def forecast_batches(batches_df, now=None, stage_started=None):
+    """
+    Forecast stage transitions and survivors for all batches
+
+    Args:
+        batches_df: breeding_batches DataFrame
+        now: Reference time (defaults to the current time)
+        stage_started: Current stage start per batch, aligned with batches_df
+                       (defaults to stage_start_times; creation time where unknown)
+
+    Returns:
+        pandas.DataFrame: One row per batch with projected dates, intervals and survivors
+    """
+    if batches_df.empty:
+        return pd.DataFrame()
+
+    now_ts = pd.Timestamp.now() if now is None else pd.Timestamp(now)
+    now_seconds = now_ts.value / 1e9
+
+    species_idx = pd.Categorical(batches_df['species'], categories=SPECIES_NAMES).codes.astype(np.int64)
+    species_idx[species_idx < 0] = len(SPECIES_NAMES)
+    stage_idx = pd.Categorical(batches_df['stage'], categories=FORECAST_STAGES).codes.astype(np.int64)
+    known_stage = stage_idx >= 0
+    stage_idx = np.where(known_stage, stage_idx, 0)
+
+    if stage_started is None:
+        stage_started = stage_start_times(batches_df)
+    created = pd.to_datetime(batches_df['created_date'], format=TIMESTAMP_FORMAT, errors='coerce')
+    started = pd.to_datetime(pd.Series(stage_started, index=batches_df.index), format=TIMESTAMP_FORMAT,
+                             errors='coerce').fillna(created).fillna(now_ts)
+    stage_start = started.to_numpy(dtype='datetime64[ns]').astype(np.int64) / 1e9
+
+    counts = pd.to_numeric(batches_df['larva_count'], errors='coerce').fillna(0).to_numpy()
+
+    arrays = forecast_arrays(species_idx, stage_idx, counts, stage_start, now_seconds)
+
+    forecast = pd.DataFrame({
+        'batch_id': batches_df['batch_id'].to_numpy(),
+        'species': batches_df['species'].to_numpy(),
+        'stage': batches_df['stage'].to_numpy(),
+        'count': counts
+    }, index=batches_df.index)
+    for name, values in arrays.items():
+        if name.startswith(('pupation_', 'emergence_')):
+            values = np.where(known_stage, values, np.nan)
+            forecast[name] = pd.to_datetime(values * 1e9, errors='coerce').floor('D')
+        else:
+            forecast[name] = np.where(known_stage, values, np.nan)
+    return forecast
+
+def pupae_supply_curve(forecast, weeks=12, start=None, by_species=True):
+    """
+    Expected pupae becoming available per week
+
+    Pupae already in the pupa stage count as available in the current week.
+
+    Args:
+        forecast: Output of forecast_batches
+        weeks: Number of weeks to project
+        start: Week containing this date is week 0 (defaults to today)
+        by_species: Return one column per species instead of a single total
+
+    Returns:
+        pandas.DataFrame: Expected pupae indexed by week start date
+    """
+    start_ts = pd.Timestamp.now().normalize() if start is None else pd.Timestamp(start).normalize()
+    week0 = start_ts - pd.Timedelta(days=start_ts.weekday())
+    week_index = pd.date_range(week0, periods=weeks, freq='7D')
+
+    if forecast.empty:
+        return pd.DataFrame(index=week_index)
+
+    in_pupa = (forecast['stage'] == 'pupa').to_numpy()
+    quantity = np.where(in_pupa, forecast['count'].to_numpy(), forecast['expected_pupae'].fillna(0).to_numpy())
+    dates = forecast['pupation_date'].to_numpy(dtype='datetime64[ns]')
+    dates = np.where(in_pupa, np.datetime64(week0, 'ns'), dates)
+
+    dated = ~np.isnat(dates)
+    week_offsets = np.full(dates.shape, -1, dtype=np.int64)
+    week_offsets[dated] = (dates[dated] - np.datetime64(week0, 'ns')) // np.timedelta64(7, 'D')
+    valid = (week_offsets >= 0) & (week_offsets < weeks) & (quantity > 0)
+
+    if by_species:
+        species_codes, species_names = pd.factorize(forecast['species'])
+        curve = np.zeros((weeks, len(species_names)))
+        np.add.at(curve, (week_offsets[valid], species_codes[valid]), quantity[valid])
+        return pd.DataFrame(np.round(curve, 1), index=week_index, columns=species_names)
+
+    curve = np.bincount(week_offsets[valid], weights=quantity[valid], minlength=weeks)
+    return pd.DataFrame({'expected_pupae': np.round(curve, 1)}, index=week_index)
+
+_SUPPLY_CACHE = {}
+
+def get_pupae_supply_curve(weeks=12, batches_file='breeding_batches.csv'):
+    """
+    Per-species weekly pupae supply for the current farm state
+
+    Recomputed only when the batches file changes or the day rolls over, so
+    POS and sales pages can read it on every rerun.
+
+    Args:
+        weeks: Number of weeks to project
+        batches_file: Batches CSV to forecast from
+
+    Returns:
+        pandas.DataFrame: Expected pupae per week (rows) and species (columns)
+    """
+    stat = os.stat(batches_file) if os.path.exists(batches_file) else None
+    key = (weeks, stat and stat.st_mtime_ns, stat and stat.st_size, datetime.date.today())
+    cached = _SUPPLY_CACHE.get(batches_file)
+    if cached is None or cached[0] != key:
+        curve = pupae_supply_curve(forecast_batches(load_from_csv_cached(batches_file)), weeks=weeks)
+        _SUPPLY_CACHE[batches_file] = (key, curve)
+        return curve
+    return cached[1]
+
+def benchmark_forecast(batch_count=100000, seed=0):
+    """
+    Time a forecast over synthetic batches
+
+    Args:
+        batch_count: Number of synthetic batches
+        seed: Random seed
+
+    Returns:
+        dict: Timing results in seconds
+    """
+    rng = np.random.default_rng(seed)
+    now = pd.Timestamp.now()
+    batches_df = pd.DataFrame({
+        'batch_id': [f"BENCH_{i}" for i in range(batch_count)],
+        'species': rng.choice(SPECIES_NAMES, batch_count),
+        'stage': rng.choice(FORECAST_STAGES, batch_count),
+        'larva_count': rng.integers(1, 200, batch_count),
+        'created_date': (now - pd.to_timedelta(rng.integers(0, 60 * 86400, batch_count), unit='s')).strftime('%Y-%m-%d %H:%M:%S'),
+    })
+
+    started = time.perf_counter()
+    forecast = forecast_batches(batches_df, now, stage_started=batches_df['created_date'])
+    forecast_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    pupae_supply_curve(forecast, start=now)
+    curve_seconds = time.perf_counter() - started
+
+    return {
+        'batches': batch_count,
+        'forecast_seconds': round(forecast_seconds, 4),
+        'supply_curve_seconds': round(curve_seconds, 4)
+    }
@@ -0,0 +1,227 @@
+"""
+Shared live POS aggregates
+One in-process aggregate of today's sales (totals, per cashier, payment method and
+terminal, and top sellers) is updated by the checkout pipeline as each order is
+written, so every terminal session reads the same live figures instead of
+re-reading the CSV files per session. It is rebuilt from today's rows only when the
+files changed outside the pipeline or the day rolls over
+"""
+
+import os
+import re
+import time
+import heapq
+import threading
+import datetime
+import numpy as np
+from utils.csv_index import get_csv_index
+
+TRANSACTIONS_FILE = 'pos_transactions.csv'
+ITEMS_FILE = 'pos_items.csv'
+
+TOP_SELLERS = 10
+
+_TERMINAL_PATTERN = re.compile(r'^ORD\d{8}-(.+)-\d+$')
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+def _bump(table, key, **amounts):
+    row = table.setdefault(key, dict.fromkeys(amounts, 0))
+    for name, amount in amounts.items():
+        row[name] += amount
+
+class SalesAggregates:
+    """
+    Today's sales, maintained incrementally under a lock
+
+    record() is called by the checkout pipeline after each group of orders
+    is written, with the file sizes from just before the write; the orders
+    are added only if the aggregate was built at exactly those sizes, and
+    otherwise today is recounted from the files. Orders already counted are
+    skipped, so a rebuild racing with a write never counts an order twice.
+    """
+
+    def __init__(self, transactions_file=TRANSACTIONS_FILE, items_file=ITEMS_FILE):
+        self.transactions_file = transactions_file
+        self.items_file = items_file
+        self.lock = threading.Lock()
+        self.source_sizes = None
+        self._reset(str(datetime.date.today()))
+
+    def _reset(self, day):
+        self.day = day
+        self.orders = set()
+        self.totals = dict.fromkeys(['orders', 'items', 'revenue', 'profit', 'discount', 'tax'], 0)
+        self.by_cashier = {}
+        self.by_payment_method = {}
+        self.by_terminal = {}
+        self.by_item = {}
+
+    def sizes(self):
+        """Current sizes of the POS files (taken by the pipeline before each write)"""
+        return tuple(os.path.getsize(path) if os.path.exists(path) else 0
+                     for path in (self.transactions_file, self.items_file))
+
+    def _add(self, transactions, items):
+        added = set()
+        for transaction in transactions:
+            order_number = transaction['order_number']
+            if str(transaction['date']) != self.day or order_number in self.orders:
+                continue
+            self.orders.add(order_number)
+            added.add(order_number)
+            revenue = _number(transaction['total_revenue'])
+            tax = _number(transaction.get('tax'))
+            amounts = {'orders': 1, 'revenue': revenue, 'collected': revenue + tax}
+            for name, value in (('items', _number(transaction['total_items'])), ('revenue', revenue),
+                                ('profit', _number(transaction['total_profit'])),
+                                ('discount', _number(transaction.get('discount'))), ('tax', tax)):
+                self.totals[name] += value
+            self.totals['orders'] += 1
+            match = _TERMINAL_PATTERN.match(order_number)
+            _bump(self.by_cashier, transaction['cashier'], **amounts)
+            _bump(self.by_payment_method, transaction['payment_method'], **amounts)
+            _bump(self.by_terminal, match.group(1) if match else 'main', **amounts)
+        for item in items:
+            if item['order_number'] in added:
+                _bump(self.by_item, item['item_name'], quantity=_number(item['quantity']),
+                      revenue=_number(item['subtotal_revenue']), profit=_number(item['subtotal_profit']))
+
+    def rebuild(self):
+        """Recount today from today's rows of the POS files"""
+        with self.lock:
+            self._reset(str(datetime.date.today()))
+            self.source_sizes = self.sizes()
+            frames = []
+            for filename in (self.transactions_file, self.items_file):
+                index = get_csv_index(filename, date_column='date')
+                rows = index.query(date_from=self.day, date_to=self.day, newest_first=False)
+                frames.append(index.read_rows(rows).to_dict('records') if rows.size else [])
+            self._add(*frames)
+
+    def record(self, transactions, items, sizes_before=None):
+        """
+        Count orders just written by the checkout pipeline
+
+        Args:
+            sizes_before: sizes() just before the write; if the aggregate was never
+                built, was built at other sizes (the files also changed outside
+                the pipeline) or is for another day, today is recounted instead
+        """
+        with self.lock:
+            if (self.source_sizes is not None and sizes_before == self.source_sizes and
+                    self.day == str(datetime.date.today())):
+                self._add(transactions, items)
+                self.source_sizes = self.sizes()
+                return
+        self.rebuild()
+
+    def snapshot(self, top=TOP_SELLERS):
+        """
+        Today's figures for display
+
+        Returns:
+            dict: day, totals (with collected and avg_order), per-cashier,
+                  per-payment-method and per-terminal breakdowns, and top sellers
+        """
+        if self.source_sizes != self.sizes() or self.day != str(datetime.date.today()):
+            self.rebuild()
+        with self.lock:
+            totals = dict(self.totals)
+            totals['collected'] = totals['revenue'] + totals['tax']
+            totals['avg_order'] = totals['revenue'] / totals['orders'] if totals['orders'] else 0
+            top_sellers = heapq.nlargest(top, self.by_item.items(), key=lambda entry: entry[1]['quantity'])
+            return {
+                'day': self.day,
+                'totals': totals,
+                'by_cashier': {key: dict(value) for key, value in self.by_cashier.items()},
+                'by_payment_method': {key: dict(value) for key, value in self.by_payment_method.items()},
+                'by_terminal': {key: dict(value) for key, value in self.by_terminal.items()},
+                'top_sellers': [dict(value, item_name=name) for name, value in top_sellers]
+            }
+
+def load_test(terminals=8, checkouts_per_terminal=200, think_time=0.0, durable=True, seed=0):
+    """
+    Simulate concurrent terminals checking out random carts against one pipeline
+
+    Each terminal is a thread with its own cashier; checkout latency is
+    measured per call. Afterwards the shared aggregates are compared with the
+    totals re-summed from the written CSV files.
+
+    Args:
+        terminals: Number of concurrent terminals
+        checkouts_per_terminal: Checkouts each terminal performs
+        think_time: Seconds a terminal waits between checkouts
+        durable: fsync the journal on every group commit
+
+    Returns:
+        dict: Throughput, latency percentiles (ms) and whether the aggregates match the files
+    """
+    import tempfile
+    import pandas as pd
+    from utils.inventory import InventoryLedger, movement
+    from utils.pos_checkout import CheckoutPipeline, new_idempotency_key
+
+    catalog = [{'item_id': n, 'name': f"Species {n}", 'species': f"Butterfly-Species {n}",
+                'price': 20 + 5 * n, 'cost': 10 + 2 * n} for n in range(12)]
+    payment_methods = ['Cash', 'GCash', 'Credit Card']
+
+    with tempfile.TemporaryDirectory() as directory:
+        inventory = InventoryLedger(os.path.join(directory, 'inventory_ledger.csv'))
+        inventory.record([([movement(item['species'], 'adult', 10 ** 9) for item in catalog],
+                           'adjustment', 'load_test', 'bench')])
+        aggregates = SalesAggregates(os.path.join(directory, TRANSACTIONS_FILE), os.path.join(directory, ITEMS_FILE))
+        pipeline = CheckoutPipeline(directory, aggregates.transactions_file, aggregates.items_file,
+                                    durable=durable, inventory=inventory, aggregates=aggregates)
+        latencies = [[] for _ in range(terminals)]
+
+        def terminal(number):
+            rng = np.random.default_rng(seed + number)
+            for _ in range(checkouts_per_terminal):
+                picks = rng.choice(len(catalog), size=int(rng.integers(1, 5)), replace=False)
+                cart = [dict(catalog[pick], quantity=int(rng.integers(1, 6))) for pick in picks]
+                started = time.perf_counter()
+                pipeline.checkout(cart, new_idempotency_key(), f"cashier{number}",
+                                  payment_method=payment_methods[int(rng.integers(len(payment_methods)))],
+                                  terminal_id=f"T{number}")
+                latencies[number - 1].append(time.perf_counter() - started)
+                if think_time:
+                    time.sleep(think_time)
+
+        threads = [threading.Thread(target=terminal, args=(n + 1,)) for n in range(terminals)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        live = aggregates.snapshot()
+        transactions = pd.read_csv(aggregates.transactions_file)
+        consistent = (live['totals']['orders'] == len(transactions) and
+                      abs(live['totals']['revenue'] - transactions['total_revenue'].sum()) < 1e-6 and
+                      len(live['by_terminal']) == terminals)
+
+    latency_ms = np.array([value for values in latencies for value in values]) * 1000
+    checkouts = terminals * checkouts_per_terminal
+    return {
+        'terminals': terminals,
+        'checkouts': checkouts,
+        'seconds': round(elapsed, 3),
+        'checkouts_per_second': int(checkouts / elapsed),
+        'latency_ms': {f"p{q}": round(float(np.percentile(latency_ms, q)), 2) for q in (50, 90, 95, 99)} |
+                      {'max': round(float(latency_ms.max()), 2)},
+        'aggregates_consistent': bool(consistent)
+    }
+
+_AGGREGATES = {}
+
+def get_sales_aggregates():
+    """Get the shared live sales aggregates for this process"""
+    if 'aggregates' not in _AGGREGATES:
+        _AGGREGATES['aggregates'] = SalesAggregates()
+    return _AGGREGATES['aggregates']
@@ -0,0 +1,113 @@
+"""
+POS cart with incrementally maintained totals
+Each edit adjusts the running item, revenue, cost and profit totals by the
+changed line's difference, so rendering a large cart never re-sums its lines
+"""
+
+import itertools
+import pandas as pd
+
+CART_COLUMNS = ['item_id', 'name', 'species', 'price', 'quantity', 'subtotal', 'profit']
+
+# Shared across carts so a cleared cart never reuses an earlier cart's version
+_VERSIONS = itertools.count(1)
+
+class Cart:
+    """
+    Lines keyed by item id, in the order they were first added
+
+    Iterating yields line dicts (item_id, name, species, price, cost,
+    quantity, subtotal, profit), the shape the checkout pipeline and receipt
+    expect. version changes on every edit, for keying widgets to cart contents.
+    """
+
+    def __init__(self):
+        self._lines = {}
+        self._species = {}
+        self.version = next(_VERSIONS)
+        self.total_items = 0
+        self.total_revenue = 0
+        self.total_cost = 0
+
+    @property
+    def total_profit(self):
+        return self.total_revenue - self.total_cost
+
+    def __iter__(self):
+        return iter(self._lines.values())
+
+    def __len__(self):
+        return len(self._lines)
+
+    def __bool__(self):
+        return bool(self._lines)
+
+    def _account(self, line, sign):
+        self.version = next(_VERSIONS)
+        quantity = line['quantity'] * sign
+        self.total_items += quantity
+        self.total_revenue += line['price'] * quantity
+        self.total_cost += line['cost'] * quantity
+        self._species[line['species']] = self._species.get(line['species'], 0) + quantity
+
+    def quantity(self, item_id):
+        line = self._lines.get(item_id)
+        return line['quantity'] if line else 0
+
+    def species_quantity(self, species):
+        """Units of a species across all lines"""
+        return self._species.get(species, 0)
+
+    def set_quantity(self, item_id, quantity, item=None):
+        """
+        Set a line's quantity, adding the line from item if it is new
+
+        A quantity of zero or less removes the line.
+        """
+        line = self._lines.get(item_id)
+        if line is not None:
+            self._account(line, -1)
+        elif item is None or quantity <= 0:
+            return
+        else:
+            line = {'item_id': item_id, 'name': item['name'], 'species': item['species'],
+                    'price': item['price'], 'cost': item['cost'], 'quantity': 0}
+
+        if quantity <= 0:
+            del self._lines[item_id]
+            return
+        line['quantity'] = int(quantity)
+        line['subtotal'] = line['price'] * line['quantity']
+        line['profit'] = (line['price'] - line['cost']) * line['quantity']
+        self._lines[item_id] = line
+        self._account(line, 1)
+
+    def add(self, item_id, item, quantity):
+        self.set_quantity(item_id, self.quantity(item_id) + quantity, item)
+
+    def remove(self, item_id):
+        self.set_quantity(item_id, 0)
+
+    def apply_edits(self, quantities):
+        """
+        Apply a batch of quantity edits from one form submit
+
+        Args:
+            quantities: Mapping of item id to new quantity (0 removes the line)
+
+        Returns:
+            int: Number of lines changed
+        """
+        changed = 0
+        for item_id, quantity in quantities.items():
+            if item_id in self._lines and int(quantity) != self._lines[item_id]['quantity']:
+                self.set_quantity(item_id, int(quantity))
+                changed += 1
+        return changed
+
+    def clear(self):
+        self.__init__()
+
+    def to_frame(self):
+        """Lines as a DataFrame for display and editing"""
+        return pd.DataFrame(list(self._lines.values()), columns=CART_COLUMNS)
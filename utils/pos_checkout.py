@@ -0,0 +1,596 @@
+"""
+Transactional POS checkout
+Each checkout is committed as a single journal record holding the order header and
+all of its lines, then applied to pos_transactions.csv and pos_items.csv; a crash in
+between is repaired by replaying the journal. Order numbers come from a per-terminal
+monotonic sequence, and idempotency keys make a retried checkout return the original
+order instead of recording the sale twice
+"""
+
+import os
+import json
+import time
+import uuid
+import contextlib
+import threading
+import datetime
+import pandas as pd
+from utils.csv_handlers import append_csv_records, STORAGE_DIR
+from utils.inventory import InventoryLedger, InsufficientStock, get_inventory, movement
+from utils.pos_aggregates import get_sales_aggregates
+
+CHECKOUT_DIR = os.path.join(STORAGE_DIR, 'pos')
+TRANSACTIONS_FILE = 'pos_transactions.csv'
+ITEMS_FILE = 'pos_items.csv'
+TERMINAL_ID = os.environ.get('POS_TERMINAL_ID', 'T1')
+
+TRANSACTION_COLUMNS = [
+    'order_number', 'date', 'time', 'cashier', 'customer_name',
+    'customer_email', 'payment_method', 'total_items', 'total_revenue',
+    'total_cost', 'total_profit', 'notes', 'discount', 'tax'
+]
+ITEM_COLUMNS = [
+    'order_number', 'date', 'time', 'item_id', 'item_name', 'species',
+    'quantity', 'unit_price', 'unit_cost', 'subtotal_revenue',
+    'subtotal_profit', 'cashier'
+]
+
+CONFLICT_COLUMNS = ['timestamp', 'order_number', 'terminal', 'species', 'stage', 'requested', 'available']
+
+# Journal offset up to which the CSV files are known to be written is saved this often
+CHECKPOINT_EVERY = 100
+
+def new_idempotency_key():
+    """Key identifying one checkout attempt; reuse it when retrying the same cart"""
+    return uuid.uuid4().hex
+
+def format_order_number(terminal_id, seq, day):
+    """Order number for a terminal's seq-th checkout, e.g. ORD20250802-T1-000042"""
+    return f"ORD{day.strftime('%Y%m%d')}-{terminal_id}-{seq:06d}"
+
+def build_order(order_number, cart, cashier, customer_name='', customer_email='',
+                payment_method='Cash', notes='', now=None, discount=0, tax=0):
+    """
+    Build the transaction header and line records for a cart
+
+    Args:
+        order_number: Assigned order number
+        cart: List of cart item dicts (item_id, name, species, price, cost, quantity)
+              where price is the net unit price actually charged
+        now: Checkout time (defaults to the current time)
+        discount: Total discount already reflected in the line prices
+        tax: Tax charged on top of total_revenue
+
+    Returns:
+        tuple: (transaction dict, list of item dicts)
+    """
+    now = now or datetime.datetime.now()
+    date, clock = now.strftime('%Y-%m-%d'), now.strftime('%H:%M:%S')
+
+    items = []
+    for item in cart:
+        quantity = int(item['quantity'])
+        revenue = item['price'] * quantity
+        items.append({
+            'order_number': order_number,
+            'date': date,
+            'time': clock,
+            'item_id': item['item_id'],
+            'item_name': item['name'],
+            'species': item['species'],
+            'quantity': quantity,
+            'unit_price': item['price'],
+            'unit_cost': item['cost'],
+            'subtotal_revenue': revenue,
+            'subtotal_profit': revenue - item['cost'] * quantity,
+            'cashier': cashier
+        })
+
+    total_revenue = sum(item['subtotal_revenue'] for item in items)
+    total_profit = sum(item['subtotal_profit'] for item in items)
+    transaction = {
+        'order_number': order_number,
+        'date': date,
+        'time': clock,
+        'cashier': cashier,
+        'customer_name': customer_name or 'Walk-in Customer',
+        'customer_email': customer_email or '',
+        'payment_method': payment_method,
+        'total_items': sum(item['quantity'] for item in items),
+        'total_revenue': total_revenue,
+        'total_cost': total_revenue - total_profit,
+        'total_profit': total_profit,
+        'notes': notes or '',
+        'discount': discount,
+        'tax': tax
+    }
+    return transaction, items
+
+class CheckoutPipeline:
+    """
+    Journal-first checkout with group commit
+
+    Concurrent checkouts queue their records and whichever thread finds the
+    journal idle writes everything queued in one append (and one fsync when
+    durable), so throughput grows with the number of terminals instead of
+    being capped by one disk flush per sale. With an inventory ledger, stock
+    is reserved before an order number is issued and the ledger rows are
+    written with the rest of the group; with live aggregates, each written
+    group is counted there too.
+    """
+
+    def __init__(self, directory=CHECKOUT_DIR, transactions_file=TRANSACTIONS_FILE,
+                 items_file=ITEMS_FILE, terminal_id=TERMINAL_ID, durable=True, inventory=None, aggregates=None):
+        self.journal_file = os.path.join(directory, 'checkout_journal.jsonl')
+        self.state_file = os.path.join(directory, 'checkout_state.json')
+        self.transactions_file = transactions_file
+        self.items_file = items_file
+        self.terminal_id = terminal_id
+        self.durable = durable
+        self.inventory = inventory
+        self.aggregates = aggregates
+
+        self.cond = threading.Condition(threading.Lock())
+        self.keys = {}
+        self.orders = set()
+        self.sequences = {}
+        self.queue = []
+        self.batch = 0
+        self.flushed = -1
+        self.failures = {}
+        # Callers still to read each batch's outcome; its failure is dropped after the last
+        self.waiting = {}
+        self.writing = False
+        self.journal_bytes = 0
+        self.applied_bytes = 0
+        self.unsaved_entries = 0
+        self.needs_recovery = False
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """Rebuild keys and sequences from the journal and replay unapplied entries"""
+        if os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, 'r') as f:
+                    saved = json.load(f)
+                self.applied_bytes = saved['applied_bytes']
+                # Sequences outlive the journal entries compacted away by retention
+                self.sequences = dict(saved.get('sequences', {}))
+            except Exception:
+                self.applied_bytes = 0
+
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, 'rb') as f:
+                offset = 0
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # Torn final record: never committed, so drop it
+                        break
+                    self._index(json.loads(line))
+                    offset += len(line)
+            if offset != os.path.getsize(self.journal_file):
+                with open(self.journal_file, 'r+b') as f:
+                    f.truncate(offset)
+            self.journal_bytes = offset
+
+        if self.applied_bytes > self.journal_bytes:
+            self.applied_bytes = 0
+        if self.applied_bytes < self.journal_bytes:
+            self.recover()
+
+    def _index(self, entry):
+        transaction = entry['transaction']
+        self.keys[entry['key']] = transaction
+        self.orders.add(transaction['order_number'])
+        terminal = entry['terminal']
+        self.sequences[terminal] = max(self.sequences.get(terminal, 0), entry['seq'])
+
+    def _read_entries(self, start):
+        entries = []
+        with open(self.journal_file, 'rb') as f:
+            f.seek(start)
+            for line in f:
+                entries.append(json.loads(line))
+        return entries
+
+    def _column_values(self, filename, column='order_number'):
+        if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+            return set()
+        try:
+            return set(pd.read_csv(filename, usecols=[column], dtype=str)[column])
+        except ValueError:
+            return set()
+
+    def _stock_groups(self, entries, reserved=None):
+        """Ledger groups for entries; reserved=True/False selects entries by whether stock was held"""
+        return [([tuple(m) for m in entry['stock']], 'pos_sale',
+                 entry['transaction']['order_number'], entry['transaction']['cashier'])
+                for entry in entries if entry.get('stock') and
+                (reserved is None or entry.get('reserved', True) == reserved)]
+
+    def recover(self):
+        """Write journaled orders missing from the CSV files (after a crash or failed write)"""
+        with self.cond:
+            while self.writing:
+                self.cond.wait()
+            self.writing = True
+        try:
+            entries = self._read_entries(self.applied_bytes)
+            if entries:
+                transactions = self._column_values(self.transactions_file)
+                items = self._column_values(self.items_file)
+                missing_transactions = [entry['transaction'] for entry in entries
+                                        if entry['transaction']['order_number'] not in transactions]
+                missing_items = [line for entry in entries
+                                 if entry['transaction']['order_number'] not in items
+                                 for line in entry['items']]
+                sizes_before = self.aggregates.sizes() if self.aggregates is not None else None
+                if missing_transactions and not append_csv_records(
+                        self.transactions_file, missing_transactions, TRANSACTION_COLUMNS):
+                    raise IOError(f"Failed to write {self.transactions_file}")
+                if missing_items and not append_csv_records(self.items_file, missing_items, ITEM_COLUMNS):
+                    raise IOError(f"Failed to write {self.items_file}")
+                if self.aggregates is not None:
+                    self.aggregates.record(missing_transactions, missing_items, sizes_before)
+                if self.inventory is not None:
+                    recorded = self._column_values(self.inventory.ledger_file, 'reference')
+                    missing_stock = [group for group in self._stock_groups(entries) if group[2] not in recorded]
+                    if missing_stock and not self.inventory.record(missing_stock, enforce=False):
+                        raise IOError(f"Failed to write {self.inventory.ledger_file}")
+            self.needs_recovery = False
+            self.applied_bytes = self.journal_bytes
+            self._save_state()
+        finally:
+            with self.cond:
+                self.writing = False
+                self.cond.notify_all()
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        """Hold off commits while the CSV files are rewritten (e.g. archived)"""
+        with self.cond:
+            while self.writing:
+                self.cond.wait()
+            self.writing = True
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.writing = False
+                self.cond.notify_all()
+
+    def compact_journal(self, cutoff):
+        """
+        Drop applied entries for sales dated before cutoff (call under exclusive())
+
+        Retention calls this before archiving those sales' rows, so startup no
+        longer replays (or keeps keys for) sales that are leaving the CSV
+        files. Entries not yet written to the CSV files are always kept.
+
+        Returns:
+            int: Entries removed
+        """
+        if not os.path.exists(self.journal_file):
+            return 0
+        applied = self.applied_bytes if self.needs_recovery else self.journal_bytes
+        kept, removed, kept_applied, offset = [], [], 0, 0
+        with open(self.journal_file, 'rb') as f:
+            for line in f:
+                if offset >= self.journal_bytes:
+                    break
+                entry = json.loads(line) if offset < applied else None
+                if entry is not None and str(entry['transaction']['date']) < cutoff:
+                    removed.append(entry)
+                else:
+                    kept.append(line)
+                    kept_applied += len(line) if offset < applied else 0
+                offset += len(line)
+        if not removed:
+            return 0
+
+        tmp_path = f"{self.journal_file}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.writelines(kept)
+            f.flush()
+            os.fsync(f.fileno())
+        # Until the new offset is saved, a restart replays the whole journal; that
+        # skips orders already in the CSV files, so a crash in between is harmless
+        self.applied_bytes = 0
+        self._save_state()
+        os.replace(tmp_path, self.journal_file)
+        self.journal_bytes = sum(len(line) for line in kept)
+        self.applied_bytes = kept_applied
+        self._save_state()
+
+        for entry in removed:
+            self.keys.pop(entry['key'], None)
+            self.orders.discard(entry['transaction']['order_number'])
+        return len(removed)
+
+    def _save_state(self):
+        tmp_path = f"{self.state_file}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'applied_bytes': self.applied_bytes, 'sequences': self.sequences}, f)
+        os.replace(tmp_path, self.state_file)
+        self.unsaved_entries = 0
+
+    def _write(self, entries):
+        """Append one group of entries to the journal, then apply them"""
+        data = b''.join(json.dumps(entry, separators=(',', ':')).encode('utf-8') + b'\n'
+                        for entry in entries)
+        with open(self.journal_file, 'ab') as f:
+            f.write(data)
+            f.flush()
+            if self.durable:
+                os.fsync(f.fileno())
+        self.journal_bytes += len(data)
+
+        # The sale is committed once journaled; a failure below is repaired by recover()
+        if not self._apply(entries):
+            self.needs_recovery = True
+            return
+
+        self.unsaved_entries += len(entries)
+        if self.unsaved_entries >= CHECKPOINT_EVERY:
+            self.applied_bytes = self.journal_bytes
+            self._save_state()
+
+    def _apply(self, entries):
+        """Write journaled entries to the CSV files and settle their stock"""
+        transactions = [entry['transaction'] for entry in entries]
+        items = [line for entry in entries for line in entry['items']]
+        sizes_before = self.aggregates.sizes() if self.aggregates is not None else None
+        applied = (not self.needs_recovery and
+                   append_csv_records(self.transactions_file, transactions, TRANSACTION_COLUMNS) and
+                   append_csv_records(self.items_file, items, ITEM_COLUMNS))
+        if applied and self.aggregates is not None:
+            self.aggregates.record(transactions, items, sizes_before)
+        if self.inventory is not None:
+            held = self._stock_groups(entries, reserved=True)
+            if applied:
+                applied = self.inventory.record(held, reserved=True)
+                short = self._stock_groups(entries, reserved=False)
+                if applied and short:
+                    applied = self.inventory.record(short, enforce=False)
+            else:
+                self.inventory.release([m for group in held for m in group[0]])
+        return applied
+
+    def _commit(self, new_entries):
+        """Queue entries and return once they are journaled (group commit)"""
+        with self.cond:
+            self.queue.extend(new_entries)
+            batch = self.batch
+            self.waiting[batch] = self.waiting.get(batch, 0) + 1
+            while self.flushed < batch:
+                if self.writing:
+                    self.cond.wait()
+                    continue
+                self.writing = True
+                entries, self.queue = self.queue, []
+                flushing = self.batch
+                self.batch += 1
+                self.cond.release()
+                error = None
+                try:
+                    self._write(entries)
+                except Exception as e:
+                    error = e
+                finally:
+                    self.cond.acquire()
+                    self.writing = False
+                    self.flushed = flushing
+                    for flushed in entries:
+                        if error is None:
+                            self.keys[flushed['key']] = flushed['transaction']
+                        else:
+                            self.keys.pop(flushed['key'], None)
+                            self.orders.discard(flushed['transaction']['order_number'])
+                    if error is not None:
+                        self.failures[flushing] = error
+                        if self.inventory is not None:
+                            self.inventory.release([m for group in self._stock_groups(entries, reserved=True)
+                                                    for m in group[0]])
+                    self.cond.notify_all()
+            self.waiting[batch] -= 1
+            if self.waiting[batch]:
+                error = self.failures.get(batch)
+            else:
+                del self.waiting[batch]
+                error = self.failures.pop(batch, None)
+        if error is not None:
+            raise error
+
+    def checkout(self, cart, idempotency_key, cashier, customer_name='', customer_email='',
+                 payment_method='Cash', notes='', terminal_id=None, discount=0, tax=0):
+        """
+        Record a sale exactly once
+
+        Args:
+            cart: List of cart item dicts, priced at the net unit price
+            idempotency_key: Key for this checkout attempt; retries must reuse it
+            cashier: Username of the cashier
+            terminal_id: Terminal issuing the order number (defaults to this process's)
+            discount: Total discount included in the cart prices
+            tax: Tax charged on the order
+
+        Returns:
+            tuple: (transaction dict, created) where created is False when the key
+                   was already used and the original transaction is returned
+
+        Raises:
+            InsufficientStock: If the inventory cannot cover the cart
+        """
+        if not cart:
+            raise ValueError("Cannot check out an empty cart")
+        terminal = terminal_id or self.terminal_id
+        now = datetime.datetime.now()
+        stock = [movement(item['species'], 'adult', -int(item['quantity'])) for item in cart]
+
+        with self.cond:
+            if self.needs_recovery and not self.writing:
+                self.cond.release()
+                try:
+                    self.recover()
+                finally:
+                    self.cond.acquire()
+            existing = self.keys.get(idempotency_key)
+            while existing is not None and existing.get('_pending'):
+                # A retry racing the original waits until the original is journaled
+                self.cond.wait()
+                existing = self.keys.get(idempotency_key)
+            if existing is not None:
+                return existing, False
+
+            if self.inventory is not None:
+                self.inventory.reserve(stock)
+            try:
+                seq = self.sequences.get(terminal, 0) + 1
+                order_number = format_order_number(terminal, seq, now)
+                transaction, items = build_order(order_number, cart, cashier, customer_name,
+                                                 customer_email, payment_method, notes, now, discount, tax)
+            except Exception:
+                # A cart that cannot be priced must not keep its stock held
+                if self.inventory is not None:
+                    self.inventory.release(stock)
+                raise
+            self.sequences[terminal] = seq
+            self.keys[idempotency_key] = dict(transaction, _pending=True)
+            self.orders.add(order_number)
+
+        entry = {'key': idempotency_key, 'terminal': terminal, 'seq': seq,
+                 'transaction': transaction, 'items': items,
+                 'stock': [list(m) for m in stock] if self.inventory is not None else []}
+        self._commit([entry])
+        return transaction, True
+
+    def ingest(self, entries, conflicts_file=None):
+        """
+        Commit checkouts journaled elsewhere (by an offline terminal)
+
+        Orders already recorded are skipped, so a terminal can resend a batch
+        whose acknowledgement was lost. A sale the central stock can no longer
+        cover is still accepted, since the goods have already left the farm;
+        stock goes negative and the shortfall is logged for review.
+
+        Args:
+            entries: Terminal journal entries (key, terminal, seq, transaction, items)
+            conflicts_file: CSV receiving stock shortfalls (defaults next to the journal)
+
+        Returns:
+            dict: Order number -> 'accepted', 'duplicate' or 'stock_conflict'
+        """
+        results, accepted, conflicts = {}, [], []
+        with self.cond:
+            for entry in entries:
+                order_number = entry['transaction']['order_number']
+                if order_number in self.orders or order_number in results:
+                    results[order_number] = 'duplicate'
+                    continue
+                entry = dict(entry, stock=[], reserved=True)
+                if self.inventory is not None:
+                    stock = [movement(line['species'], 'adult', -int(line['quantity'])) for line in entry['items']]
+                    entry['stock'] = [list(m) for m in stock]
+                    try:
+                        self.inventory.reserve(stock)
+                    except InsufficientStock as e:
+                        entry['reserved'] = False
+                        conflicts.extend({
+                            'timestamp': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                            'order_number': order_number,
+                            'terminal': entry['terminal'],
+                            'species': species,
+                            'stage': stage,
+                            'requested': requested,
+                            'available': available
+                        } for species, stage, requested, available in e.shortages)
+                results[order_number] = 'accepted' if entry['reserved'] else 'stock_conflict'
+                self.keys[entry['key']] = dict(entry['transaction'], _pending=True)
+                self.orders.add(order_number)
+                terminal = entry['terminal']
+                self.sequences[terminal] = max(self.sequences.get(terminal, 0), entry['seq'])
+                accepted.append(entry)
+
+        if accepted:
+            self._commit(accepted)
+        if conflicts:
+            append_csv_records(conflicts_file or os.path.join(os.path.dirname(self.journal_file), 'stock_conflicts.csv'),
+                               conflicts, CONFLICT_COLUMNS)
+        return results
+
+    def find(self, idempotency_key):
+        """Transaction recorded for a key, or None"""
+        with self.cond:
+            transaction = self.keys.get(idempotency_key)
+        if transaction is None or transaction.get('_pending'):
+            return None
+        return transaction
+
+def benchmark_checkout(terminals=4, checkouts_per_terminal=250, retry_every=10, durable=True):
+    """
+    Measure checkout throughput with concurrent terminals in a scratch directory
+
+    Every retry_every-th checkout is submitted twice with the same key to
+    exercise idempotency.
+
+    Returns:
+        dict: Checkouts, elapsed seconds, checkouts per second and written row counts
+    """
+    import tempfile
+    cart = [
+        {'item_id': 1, 'name': 'Clipper', 'species': 'Butterfly-Clippers', 'price': 23, 'cost': 10, 'quantity': 3},
+        {'item_id': 14, 'name': 'Red Lacewing', 'species': 'Butterfly-Red Lacewing', 'price': 100, 'cost': 50, 'quantity': 1}
+    ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        inventory = InventoryLedger(os.path.join(directory, 'inventory_ledger.csv'))
+        inventory.record([([movement(item['species'], 'adult', 10 ** 9) for item in cart],
+                           'adjustment', 'benchmark', 'bench')])
+        pipeline = CheckoutPipeline(directory, os.path.join(directory, TRANSACTIONS_FILE),
+                                    os.path.join(directory, ITEMS_FILE), durable=durable,
+                                    inventory=inventory)
+        duplicates = []
+
+        def terminal(number):
+            rejected = 0
+            for i in range(checkouts_per_terminal):
+                key = new_idempotency_key()
+                pipeline.checkout(cart, key, 'bench', terminal_id=f"T{number}")
+                if retry_every and i % retry_every == 0:
+                    rejected += not pipeline.checkout(cart, key, 'bench', terminal_id=f"T{number}")[1]
+            duplicates.append(rejected)
+
+        threads = [threading.Thread(target=terminal, args=(n + 1,)) for n in range(terminals)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        transactions = pd.read_csv(pipeline.transactions_file)
+        items = pd.read_csv(pipeline.items_file)
+        ledger_rows = len(pd.read_csv(inventory.ledger_file)) - len(cart)
+
+    checkouts = terminals * checkouts_per_terminal
+    return {
+        'terminals': terminals,
+        'checkouts': checkouts,
+        'seconds': round(elapsed, 3),
+        'checkouts_per_second': int(checkouts / elapsed),
+        'duplicates_rejected': sum(duplicates),
+        'transactions_written': len(transactions),
+        'unique_orders': int(transactions['order_number'].nunique()),
+        'lines_written': len(items),
+        'ledger_rows_written': ledger_rows
+    }
+
+_PIPELINE = {}
+
+def get_checkout_pipeline():
+    """Get the shared checkout pipeline for this process"""
+    if 'pipeline' not in _PIPELINE:
+        _PIPELINE['pipeline'] = CheckoutPipeline(inventory=get_inventory(), aggregates=get_sales_aggregates())
+    return _PIPELINE['pipeline']
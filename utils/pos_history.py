@@ -0,0 +1,189 @@
+"""
+Paginated POS transaction history
+Filters run against the in-memory row index of pos_transactions.csv (payment
+method, cashier and customer codes plus the date column), pages are fetched with
+keyset pagination on (date, time, order_number), and only the rows of the page
+being shown are read from disk. Exports stream the full filtered result as raw
+CSV bytes
+"""
+
+import os
+import time
+import datetime
+import numpy as np
+from utils.csv_index import get_csv_index, gzip_stream, write_stream
+from utils.csv_handlers import STORAGE_DIR
+
+TRANSACTIONS_FILE = 'pos_transactions.csv'
+EXPORT_DIR = os.path.join(STORAGE_DIR, 'pos', 'exports')
+
+# Indexed columns: filters plus the parts of the sort key
+HISTORY_CODE_COLUMNS = ['payment_method', 'cashier', 'customer_name', 'date', 'time', 'order_number']
+
+class TransactionHistory:
+    """
+    Sorted, filterable view over the transactions row index
+
+    Rows are kept sorted by (date, time, order_number) keys built from the
+    index vocabularies (no file read), re-sorted whenever the index has grown
+    or been rebuilt. Page cursors are the key of a page's last row. The rows,
+    keys and index state they were built from are published together as one
+    tuple, so a reader never pairs the rows of one sort with the keys of another.
+    """
+
+    def __init__(self, filename=TRANSACTIONS_FILE):
+        self.index = get_csv_index(filename, code_columns=HISTORY_CODE_COLUMNS, date_column='date')
+        self.sorted = (np.array([], dtype=np.int64), np.array([], dtype=str), None)
+
+    def _ensure_sorted(self):
+        """Current (rows, keys, state) sort, rebuilt if the index has changed"""
+        with self.index.lock:
+            self.index.refresh()
+            state = (self.index.indexed_bytes, len(self.index))
+            if state != self.sorted[2]:
+                if state[1]:
+                    # Pinned to the rows counted in state, should appends land meanwhile
+                    rows = np.arange(state[1])
+                    keys = (self.index.column_values('date', rows) + '\x1f' + self.index.column_values('time', rows) +
+                            '\x1f' + self.index.column_values('order_number', rows)).astype(str)
+                else:
+                    keys = np.array([], dtype=str)
+                order = np.argsort(keys, kind='stable')
+                self.sorted = (order.astype(np.int64), keys[order], state)
+            return self.sorted
+
+    def payment_methods(self):
+        return self.index.values('payment_method')
+
+    def cashiers(self):
+        return self.index.values('cashier')
+
+    def _match(self, column, text):
+        """Indexed values containing text (case-insensitive)"""
+        text = text.strip().lower()
+        return [value for value in self.index.vocabularies.get(column, {}) if text in value.lower()]
+
+    def _selected(self, payment_methods=None, cashiers=None, customer=None, order_search=None,
+                  date_from=None, date_to=None):
+        """
+        One sort snapshot and the filters' mask over it
+
+        Returns:
+            tuple: (sorted rows, sorted keys, boolean mask over sorted positions)
+        """
+        filters = {}
+        if payment_methods:
+            filters['payment_method'] = payment_methods
+        if cashiers:
+            filters['cashier'] = cashiers
+        with self.index.lock:
+            sorted_rows, sorted_keys, _ = self._ensure_sorted()
+            if customer:
+                filters['customer_name'] = self._match('customer_name', customer)
+            if order_search:
+                filters['order_number'] = self._match('order_number', order_search)
+            rows = self.index.query(filters, date_from, date_to, newest_first=False)
+        mask = np.zeros(sorted_rows.size, dtype=bool)
+        mask[rows[rows < mask.size]] = True
+        return sorted_rows, sorted_keys, mask[sorted_rows]
+
+    def count(self, **filters):
+        """Number of transactions matching the filters"""
+        return int(self._selected(**filters)[2].sum())
+
+    def page(self, after=None, page_size=25, **filters):
+        """
+        One page of transactions, newest first
+
+        Args:
+            after: Cursor of the last row of the previous page (None for the first page)
+            page_size: Rows per page
+            **filters: payment_methods, cashiers, customer, order_search, date_from, date_to
+
+        Returns:
+            tuple: (DataFrame of the page, cursor for the next page or None)
+        """
+        sorted_rows, sorted_keys, selected = self._selected(**filters)
+        bound = selected.size if after is None else int(np.searchsorted(sorted_keys, after, side='left'))
+        positions = np.flatnonzero(selected[:bound])
+        page_positions = positions[-page_size:][::-1]
+        frame = self.index.read_rows(sorted_rows[page_positions])
+        next_cursor = sorted_keys[page_positions[-1]] if positions.size > page_size else None
+        return frame, next_cursor
+
+    def export(self, compress=False, directory=EXPORT_DIR, **filters):
+        """
+        Write every matching transaction to a CSV file, oldest first
+
+        Records are copied from the file as raw bytes in bounded chunks.
+
+        Returns:
+            str: Path of the export file
+        """
+        sorted_rows, _, selected = self._selected(**filters)
+        rows = sorted_rows[selected]
+        stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        path = os.path.join(directory, f"transactions_{stamp}.csv" + ('.gz' if compress else ''))
+        chunks = self.index.iter_csv(rows)
+        write_stream(gzip_stream(chunks) if compress else chunks, path)
+        return path
+
+def benchmark_history(transactions=100_000, page_size=25, pages=20):
+    """
+    Page through a synthetic history with and without filters
+
+    Returns:
+        dict: Seconds for the first index build and average milliseconds per page
+    """
+    import tempfile
+    import pandas as pd
+    from utils.pos_checkout import TRANSACTION_COLUMNS
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'pos_transactions.csv')
+        stamps = pd.Timestamp('2025-01-01') + pd.to_timedelta(np.sort(rng.integers(0, 300 * 86400, transactions)), unit='s')
+        frame = pd.DataFrame({column: '' for column in TRANSACTION_COLUMNS}, index=range(transactions))
+        frame['order_number'] = [f"ORD-{i:07d}" for i in range(transactions)]
+        frame['date'] = stamps.strftime('%Y-%m-%d')
+        frame['time'] = stamps.strftime('%H:%M:%S')
+        frame['cashier'] = rng.choice(['admin', 'staff1', 'staff2'], transactions)
+        frame['customer_name'] = rng.choice([f"Customer {i}" for i in range(2000)] + ['Walk-in Customer'] * 2000,
+                                            transactions)
+        frame['payment_method'] = rng.choice(['Cash', 'GCash', 'Credit Card'], transactions)
+        frame.to_csv(filename, index=False)
+
+        history = TransactionHistory(filename)
+        started = time.perf_counter()
+        history.count()
+        build_seconds = time.perf_counter() - started
+
+        timings = {}
+        for name, filters in (('unfiltered', {}), ('filtered', {'payment_methods': ['GCash'], 'customer': 'customer 1'})):
+            cursor, started = None, time.perf_counter()
+            for _ in range(pages):
+                _, cursor = history.page(cursor, page_size, **filters)
+                if cursor is None:
+                    break
+            timings[name] = round((time.perf_counter() - started) / pages * 1000, 2)
+
+        started = time.perf_counter()
+        export_path = history.export(directory=directory, payment_methods=['Cash'])
+        export_seconds = time.perf_counter() - started
+        export_bytes = os.path.getsize(export_path)
+
+    return {
+        'transactions': transactions,
+        'index_build_seconds': round(build_seconds, 3),
+        'page_ms': timings['unfiltered'],
+        'filtered_page_ms': timings['filtered'],
+        'export_seconds': round(export_seconds, 3),
+        'export_bytes': export_bytes
+    }
+
+_HISTORY = {}
+
+def get_transaction_history():
+    """Get the shared transaction history view for this process"""
+    if 'history' not in _HISTORY:
+        _HISTORY['history'] = TransactionHistory()
+    return _HISTORY['history']
@@ -0,0 +1,411 @@
+"""
+Offline-capable POS terminals
+A terminal commits every checkout to its own local journal and returns at once;
+a background worker forwards journaled sales to the central store in batches,
+resuming from a saved cursor after outages. The central store deduplicates by
+order number and records stock shortfalls instead of rejecting sales that
+already happened. Terminals authenticate to the central endpoint with a shared
+token (POS_SYNC_TOKEN)
+"""
+
+import os
+import hmac
+import json
+import time
+import socket
+import threading
+import datetime
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utils.pos_checkout import CheckoutPipeline, new_idempotency_key
+from utils.csv_handlers import STORAGE_DIR
+
+TERMINAL_DIR = os.path.join(STORAGE_DIR, 'pos', 'terminal')
+CENTRAL_URL = os.environ.get('POS_CENTRAL_URL', '')
+# Must differ from the central POS's own id, since order numbers embed it
+TERMINAL_ID = os.environ.get('POS_TERMINAL_ID') or socket.gethostname()
+DEFAULT_SYNC_PORT = 8765
+# Shared secret every terminal sends; the endpoint refuses to start without one
+SYNC_TOKEN = os.environ.get('POS_SYNC_TOKEN', '')
+# Interface the endpoint listens on; set to the farm LAN address to accept remote terminals
+SYNC_HOST = os.environ.get('POS_SYNC_HOST', '127.0.0.1')
+# Largest sync request accepted (a full batch of SYNC_BATCH_SIZE sales is far smaller)
+MAX_SYNC_BODY = 4 * 1024 * 1024
+SYNC_BATCH_SIZE = 200
+SYNC_INTERVAL = 2.0
+MAX_BACKOFF = 60.0
+
+class TerminalJournal(CheckoutPipeline):
+    """Checkout pipeline that only journals; the central store applies the sales"""
+
+    def _apply(self, entries):
+        return True
+
+    def recover(self):
+        self.needs_recovery = False
+
+class LocalCentralStore:
+    """Central store in this process, with optional simulated network latency"""
+
+    def __init__(self, pipeline, latency=0.0):
+        self.pipeline = pipeline
+        self.latency = latency
+        self.online = True
+
+    def sync(self, terminal_id, entries):
+        if not self.online:
+            raise ConnectionError("Central store unreachable")
+        if self.latency:
+            time.sleep(self.latency)
+        return {'results': self.pipeline.ingest(entries), 'stock': stock_snapshot(self.pipeline)}
+
+class HttpCentralStore:
+    """Client for a central store served by CentralSyncServer"""
+
+    def __init__(self, url, token=SYNC_TOKEN, timeout=10.0):
+        self.url = url.rstrip('/')
+        self.token = token
+        self.timeout = timeout
+
+    def sync(self, terminal_id, entries):
+        body = json.dumps({'terminal': terminal_id, 'entries': entries}).encode('utf-8')
+        request = urllib.request.Request(f"{self.url}/sync", data=body,
+                                         headers={'Content-Type': 'application/json',
+                                                  'Authorization': f"Bearer {self.token}"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+def stock_snapshot(pipeline):
+    """Available stock as [species, stage, quantity] rows, for terminals to check against"""
+    if pipeline.inventory is None:
+        return []
+    table = pipeline.inventory.stock_table()
+    return [[row.species, row.stage, int(row.available)] for row in table.itertuples()]
+
+class CentralSyncServer:
+    """
+    HTTP endpoint accepting terminal batches (POST /sync) for a central checkout pipeline
+
+    Requests must carry the shared token as a bearer Authorization header;
+    bodies larger than max_body are refused before they are read.
+    """
+
+    def __init__(self, pipeline, host=SYNC_HOST, port=DEFAULT_SYNC_PORT, token=SYNC_TOKEN, max_body=MAX_SYNC_BODY):
+        self.pipeline = pipeline
+        self.host = host
+        self.port = port
+        self.token = token
+        self.max_body = max_body
+        self.server = None
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        if not self.token:
+            raise ValueError("Set POS_SYNC_TOKEN to a shared secret before starting the sync endpoint")
+        pipeline = self.pipeline
+        expected = f"Bearer {self.token}".encode('utf-8')
+        max_body = self.max_body
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != '/sync':
+                    self.send_error(404)
+                    return
+                if not hmac.compare_digest(self.headers.get('Authorization', '').encode('utf-8'), expected):
+                    self.send_error(401)
+                    return
+                try:
+                    length = int(self.headers.get('Content-Length', ''))
+                except ValueError:
+                    self.send_error(411)
+                    return
+                if length < 0 or length > max_body:
+                    self.send_error(413)
+                    return
+                try:
+                    payload = json.loads(self.rfile.read(length))
+                except ValueError:
+                    payload = None
+                if not isinstance(payload, dict) or not isinstance(payload.get('entries'), list):
+                    self.send_error(400)
+                    return
+                try:
+                    body = json.dumps({'results': pipeline.ingest(payload['entries']),
+                                       'stock': stock_snapshot(pipeline)}).encode('utf-8')
+                except Exception as e:
+                    self.send_error(500, str(e))
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+class TerminalSync:
+    """
+    Local checkout plus background sync to the central store
+
+    Sales never wait for the network: checkout only appends to the local
+    journal. The sync cursor is a byte offset into that journal, advanced
+    only after the central store acknowledges a batch, so an outage or a
+    lost response just means the batch is sent again and deduplicated.
+    """
+
+    def __init__(self, central, directory=TERMINAL_DIR, terminal_id=TERMINAL_ID,
+                 batch_size=SYNC_BATCH_SIZE, interval=SYNC_INTERVAL, durable=True):
+        self.central = central
+        self.terminal_id = terminal_id
+        self.batch_size = batch_size
+        self.interval = interval
+        self.journal = TerminalJournal(directory, None, None, terminal_id=terminal_id, durable=durable)
+        self.cursor_file = os.path.join(directory, 'sync_state.json')
+
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.synced_bytes = 0
+        self.stock = {}
+        self.unsynced_stock = {}
+        self.unsynced_orders = 0
+        self.conflicts = 0
+        self.last_sync = None
+        self.last_error = None
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+        self._load()
+
+    def _load(self):
+        if os.path.exists(self.cursor_file):
+            try:
+                with open(self.cursor_file, 'r') as f:
+                    saved = json.load(f)
+                self.synced_bytes = saved['synced_bytes']
+                self.stock = {(species, stage): quantity for species, stage, quantity in saved['stock']}
+                self.conflicts = saved.get('conflicts', 0)
+            except Exception:
+                self.synced_bytes = 0
+        self.synced_bytes = min(self.synced_bytes, self.journal.journal_bytes)
+        for entry, _ in self._unsynced():
+            self._hold(entry['items'], 1)
+
+    def _save(self):
+        tmp_path = f"{self.cursor_file}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'synced_bytes': self.synced_bytes, 'conflicts': self.conflicts,
+                       'stock': [[species, stage, quantity] for (species, stage), quantity in self.stock.items()]}, f)
+        os.replace(tmp_path, self.cursor_file)
+
+    def _hold(self, items, sign):
+        for line in items:
+            key = (line['species'], 'adult')
+            self.unsynced_stock[key] = self.unsynced_stock.get(key, 0) + sign * int(line['quantity'])
+        self.unsynced_orders += sign
+
+    def _unsynced(self, limit=None):
+        """(entry, end offset) pairs journaled but not yet acknowledged"""
+        with self.journal.cond:
+            end = self.journal.journal_bytes
+        pairs = []
+        if end <= self.synced_bytes:
+            return pairs
+        with open(self.journal.journal_file, 'rb') as f:
+            f.seek(self.synced_bytes)
+            offset = self.synced_bytes
+            while offset < end and (limit is None or len(pairs) < limit):
+                line = f.readline()
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                pairs.append((json.loads(line), offset))
+        return pairs
+
+    def checkout(self, cart, idempotency_key, cashier, **kwargs):
+        """Record a sale locally; same signature and result as CheckoutPipeline.checkout"""
+        transaction, created = self.journal.checkout(cart, idempotency_key, cashier, **kwargs)
+        if created:
+            with self.lock:
+                self._hold([{'species': item['species'], 'quantity': item['quantity']} for item in cart], 1)
+            self.wake.set()
+        return transaction, created
+
+    def available(self, species, stage='adult'):
+        """Central stock at the last sync minus sales not yet synced"""
+        with self.lock:
+            return self.stock.get((species, stage), 0) - self.unsynced_stock.get((species, stage), 0)
+
+    def sync_once(self):
+        """
+        Send one batch of unsynced sales
+
+        Returns:
+            int: Orders acknowledged (0 if nothing was pending)
+
+        Raises:
+            Exception: If the central store could not be reached
+        """
+        # Checkouts only take self.lock briefly, so they never wait on the network
+        with self.sync_lock:
+            pairs = self._unsynced(self.batch_size)
+            if not pairs:
+                return 0
+            response = self.central.sync(self.terminal_id, [entry for entry, _ in pairs])
+            results = response.get('results', {})
+            with self.lock:
+                # Advance only over the prefix the central store acknowledged
+                acknowledged = 0
+                for entry, end in pairs:
+                    if entry['transaction']['order_number'] not in results:
+                        break
+                    self._hold(entry['items'], -1)
+                    self.synced_bytes = end
+                    acknowledged += 1
+                self.conflicts += sum(status == 'stock_conflict' for status in results.values())
+                if response.get('stock') is not None:
+                    self.stock = {(species, stage): quantity for species, stage, quantity in response['stock']}
+                self.last_sync = datetime.datetime.now()
+                self.last_error = None
+                self._save()
+            return acknowledged
+
+    def sync_all(self):
+        """Send batches until nothing is pending; returns orders acknowledged"""
+        total = 0
+        while True:
+            sent = self.sync_once()
+            if not sent:
+                return total
+            total += sent
+
+    def _run(self):
+        backoff = self.interval
+        while not self.stopping.is_set():
+            try:
+                self.sync_all()
+                backoff = self.interval
+            except Exception as e:
+                self.last_error = str(e)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+            self.wake.wait(backoff)
+            self.wake.clear()
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+    def status(self):
+        """Pending sales, conflicts and last sync for display"""
+        with self.journal.cond:
+            journal_bytes = self.journal.journal_bytes
+        return {
+            'terminal': self.terminal_id,
+            'pending_orders': self.unsynced_orders,
+            'pending_bytes': journal_bytes - self.synced_bytes,
+            'stock_conflicts': self.conflicts,
+            'last_sync': self.last_sync.strftime('%Y-%m-%d %H:%M:%S') if self.last_sync else None,
+            'last_error': self.last_error
+        }
+
+def benchmark_offline_terminal(checkouts=1000, latency=0.2, outage_every=250, batch_size=SYNC_BATCH_SIZE):
+    """
+    Compare terminal checkout speed with a slow, intermittently offline central store
+
+    The central store answers each sync after `latency` seconds and goes
+    offline for every other block of outage_every checkouts. Checkouts are
+    timed on their own; the final sync_all drains the backlog.
+
+    Returns:
+        dict: Checkouts per second, sync time, and central row counts after sync
+    """
+    import tempfile
+    import pandas as pd
+    cart = [{'item_id': 1, 'name': 'Clipper', 'species': 'Butterfly-Clippers', 'price': 23, 'cost': 10, 'quantity': 2}]
+
+    with tempfile.TemporaryDirectory() as directory:
+        central = CheckoutPipeline(os.path.join(directory, 'central'),
+                                   os.path.join(directory, 'pos_transactions.csv'),
+                                   os.path.join(directory, 'pos_items.csv'))
+        store = LocalCentralStore(central, latency=latency)
+        terminal = TerminalSync(store, os.path.join(directory, 'terminal'), terminal_id='T9',
+                                batch_size=batch_size, interval=0.05)
+        terminal.start()
+
+        started = time.perf_counter()
+        for i in range(checkouts):
+            store.online = (i // outage_every) % 2 == 0 if outage_every else True
+            terminal.checkout(cart, new_idempotency_key(), 'bench')
+        checkout_seconds = time.perf_counter() - started
+
+        terminal.stop()
+        store.online = True
+        started = time.perf_counter()
+        terminal.sync_all()
+        drain_seconds = time.perf_counter() - started
+        # Resending already acknowledged sales must not duplicate them
+        resent = store.sync('T9', terminal.journal._read_entries(0))['results']
+
+        transactions = pd.read_csv(central.transactions_file)
+
+    return {
+        'checkouts': checkouts,
+        'checkout_seconds': round(checkout_seconds, 3),
+        'checkouts_per_second': int(checkouts / checkout_seconds),
+        'final_drain_seconds': round(drain_seconds, 3),
+        'resent_duplicates': sum(status == 'duplicate' for status in resent.values()),
+        'central_transactions': len(transactions),
+        'central_unique_orders': int(transactions['order_number'].nunique())
+    }
+
+_SYNC = {}
+
+def get_terminal_sync():
+    """Get this process's terminal sync worker, or None when not running as a remote terminal"""
+    if not CENTRAL_URL:
+        return None
+    if 'terminal' not in _SYNC:
+        _SYNC['terminal'] = TerminalSync(HttpCentralStore(CENTRAL_URL))
+        _SYNC['terminal'].start()
+    return _SYNC['terminal']
+
+def get_central_server(port=DEFAULT_SYNC_PORT):
+    """Get the sync endpoint for the shared checkout pipeline (not started until start() is called)"""
+    if 'server' not in _SYNC:
+        from utils.pos_checkout import get_checkout_pipeline
+        _SYNC['server'] = CentralSyncServer(get_checkout_pipeline(), port=port)
+    return _SYNC['server']
@@ -0,0 +1,283 @@
+"""
+Price list and promotion engine
+Pricing rules (price overrides per sales channel, wholesale quantity tiers, species
+promotions, premium-member discount and tax) are saved as JSON and compiled once
+into lookup tables, so pricing a cart is a few dictionary lookups and a bisect
+per line rather than a scan of every rule
+"""
+
+import os
+import json
+import time
+import bisect
+import datetime
+import threading
+import numpy as np
+from utils.csv_handlers import STORAGE_DIR
+
+PRICING_RULES_FILE = os.path.join(STORAGE_DIR, 'pos', 'pricing_rules.json')
+CHANNELS = ['retail', 'online']
+MEMBER_REFRESH_SECONDS = 300
+
+DEFAULT_RULES = {
+    'tax_rate': 0.0,
+    'member_discount': 0.0,
+    'max_discount': 100.0,
+    'tiers': [],
+    'promotions': [],
+    'prices': {channel: {} for channel in CHANNELS}
+}
+
+def load_rules(path=PRICING_RULES_FILE):
+    """Saved pricing rules merged over the defaults"""
+    rules = json.loads(json.dumps(DEFAULT_RULES))
+    if os.path.exists(path):
+        try:
+            with open(path, 'r') as f:
+                rules.update(json.load(f))
+        except Exception:
+            pass
+    return rules
+
+def save_rules(rules, path=PRICING_RULES_FILE):
+    """Persist pricing rules atomically; engines recompile on their next use"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(rules, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+def _money(value):
+    return round(float(value) + 1e-9, 2)
+
+class CompiledRules:
+    """
+    Pricing rules reduced to lookup structures for one day
+
+    Percentages become fractions; tiers become a sorted threshold list for
+    bisect; promotions become a species -> rate dict holding only those active
+    on the compile date (the best one where several overlap).
+    """
+
+    def __init__(self, rules, members=(), today=None):
+        self.compiled_on = today or datetime.date.today()
+        self.tax_rate = float(rules.get('tax_rate', 0)) / 100
+        self.member_rate = float(rules.get('member_discount', 0)) / 100
+        self.max_rate = float(rules.get('max_discount', 100)) / 100
+
+        tiers = sorted((int(tier['min_quantity']), float(tier['discount']) / 100)
+                       for tier in rules.get('tiers', []) if int(tier.get('min_quantity', 0)) > 0)
+        self.tier_thresholds = [quantity for quantity, _ in tiers]
+        self.tier_rates = [rate for _, rate in tiers]
+
+        self.promotions = {}
+        day = self.compiled_on.isoformat()
+        for promotion in rules.get('promotions', []):
+            start = str(promotion.get('start') or '')[:10]
+            end = str(promotion.get('end') or '')[:10]
+            if (start and day < start) or (end and day > end):
+                continue
+            rate = float(promotion.get('discount', 0)) / 100
+            species = promotion.get('species')
+            self.promotions[species] = max(rate, self.promotions.get(species, 0.0))
+
+        self.prices = {channel: {species: float(price) for species, price in prices.items()}
+                       for channel, prices in rules.get('prices', {}).items()}
+        self.members = frozenset(str(name).strip().lower() for name in members)
+
+    def list_price(self, channel, species, default):
+        return self.prices.get(channel, {}).get(species, default)
+
+    def tier_rate(self, quantity):
+        position = bisect.bisect_right(self.tier_thresholds, quantity) - 1
+        return self.tier_rates[position] if position >= 0 else 0.0
+
+    def is_member(self, customer):
+        return bool(customer) and str(customer).strip().lower() in self.members
+
+class PricingEngine:
+    """Prices carts with rules compiled from the saved settings"""
+
+    def __init__(self, rules_file=PRICING_RULES_FILE, member_loader=None):
+        self.rules_file = rules_file
+        self.member_loader = member_loader
+        self.lock = threading.Lock()
+        self.compiled = None
+        self.signature = None
+        self.members = ()
+        self.members_loaded = None
+
+    def _signature(self):
+        if not os.path.exists(self.rules_file):
+            return None
+        stat = os.stat(self.rules_file)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def rules(self):
+        """Compiled rules, recompiled when the settings change, the day changes or members are stale"""
+        with self.lock:
+            now = time.monotonic()
+            refresh_members = self.member_loader is not None and (
+                self.members_loaded is None or now - self.members_loaded > MEMBER_REFRESH_SECONDS)
+            if refresh_members:
+                try:
+                    self.members = tuple(self.member_loader())
+                except Exception:
+                    pass
+                self.members_loaded = now
+            signature = self._signature()
+            if (refresh_members or self.compiled is None or signature != self.signature or
+                    self.compiled.compiled_on != datetime.date.today()):
+                self.compiled = CompiledRules(load_rules(self.rules_file), self.members)
+                self.signature = signature
+            return self.compiled
+
+    def list_price(self, species, default, channel='retail'):
+        """Unit price before discounts"""
+        return self.rules().list_price(channel, species, default)
+
+    def price(self, lines, channel='retail', customer=None):
+        """
+        Price cart lines
+
+        Each line's discount rate is its wholesale tier plus any species
+        promotion plus the member discount, capped at max_discount. Tax is
+        charged on the discounted total.
+
+        Args:
+            lines: Iterable of dicts with species, price (list price default) and quantity
+            channel: Sales channel whose price overrides apply
+            customer: Username checked for premium membership
+
+        Returns:
+            dict: Priced lines (price is the net unit price) and subtotal,
+                  discount, net, tax and total
+        """
+        compiled = self.rules()
+        member_rate = compiled.member_rate if compiled.is_member(customer) else 0.0
+        priced, subtotal, net = [], 0.0, 0.0
+        for line in lines:
+            quantity = int(line['quantity'])
+            list_price = compiled.list_price(channel, line['species'], line['price'])
+            rate = min(compiled.tier_rate(quantity) + compiled.promotions.get(line['species'], 0.0) + member_rate,
+                       compiled.max_rate)
+            unit_price = _money(list_price * (1 - rate))
+            priced.append(dict(line, list_price=list_price, price=unit_price, discount_rate=round(rate * 100, 2),
+                               subtotal=_money(unit_price * quantity)))
+            subtotal += list_price * quantity
+            net += unit_price * quantity
+
+        tax = _money(net * compiled.tax_rate)
+        return {
+            'lines': priced,
+            'member': member_rate > 0,
+            'subtotal': _money(subtotal),
+            'discount': _money(subtotal - net),
+            'net': _money(net),
+            'tax': tax,
+            'total': _money(net + tax)
+        }
+
+    def price_batch(self, cart_ids, species, quantities, list_prices, members, channel='retail'):
+        """
+        Price many carts at once (vectorized)
+
+        Args:
+            cart_ids: Line -> cart number (0..n_carts-1)
+            species: Line species names
+            quantities: Line quantities
+            list_prices: Default list prices per line
+            members: Per-cart membership flags
+
+        Returns:
+            dict: Arrays of per-cart subtotal, discount, net, tax and total
+        """
+        compiled = self.rules()
+        cart_ids = np.asarray(cart_ids, dtype=np.int64)
+        quantities = np.asarray(quantities, dtype=np.int64)
+        members = np.asarray(members, dtype=bool)
+        names, codes = np.unique(np.asarray(species, dtype=object), return_inverse=True)
+
+        overrides = compiled.prices.get(channel, {})
+        override = np.array([overrides.get(name, np.nan) for name in names])[codes]
+        prices = np.where(np.isnan(override), np.asarray(list_prices, dtype=np.float64), override)
+        promotion = np.array([compiled.promotions.get(name, 0.0) for name in names])[codes]
+
+        tier_position = np.searchsorted(np.array(compiled.tier_thresholds, dtype=np.int64), quantities, side='right') - 1
+        tier = np.where(tier_position >= 0, np.array(compiled.tier_rates + [0.0])[tier_position], 0.0)
+        rate = np.minimum(tier + promotion + np.where(members[cart_ids], compiled.member_rate, 0.0), compiled.max_rate)
+        unit_prices = np.round(prices * (1 - rate) + 1e-9, 2)
+
+        n_carts = members.size
+        subtotal = np.bincount(cart_ids, prices * quantities, minlength=n_carts)
+        net = np.bincount(cart_ids, unit_prices * quantities, minlength=n_carts)
+        tax = np.round(net * compiled.tax_rate + 1e-9, 2)
+        return {'subtotal': subtotal, 'discount': subtotal - net, 'net': net, 'tax': tax, 'total': net + tax}
+
+def benchmark_pricing(carts=100_000, max_lines=8, seed=0):
+    """
+    Price synthetic carts one at a time and as one vectorized batch
+
+    Returns:
+        dict: Carts, seconds and microseconds per cart for each path, and the
+              largest difference between the two paths' totals
+    """
+    import tempfile
+    rng = np.random.default_rng(seed)
+    species = [f"Species-{i}" for i in range(18)]
+    base_prices = rng.integers(20, 100, size=len(species))
+
+    rules = dict(DEFAULT_RULES, tax_rate=12.0, member_discount=5.0, max_discount=30.0,
+                 tiers=[{'min_quantity': 10, 'discount': 5}, {'min_quantity': 25, 'discount': 10},
+                        {'min_quantity': 50, 'discount': 15}],
+                 promotions=[{'species': species[i], 'discount': 10, 'start': '', 'end': ''} for i in range(0, 18, 3)],
+                 prices={'retail': {species[1]: 99.0}, 'online': {}})
+    members = [f"member{i}" for i in range(1000)]
+
+    line_counts = rng.integers(1, max_lines + 1, size=carts)
+    cart_ids = np.repeat(np.arange(carts), line_counts)
+    line_species = rng.integers(0, len(species), size=cart_ids.size)
+    quantities = rng.integers(1, 60, size=cart_ids.size)
+    customers = np.where(rng.random(carts) < 0.2, 'member1', 'walk-in')
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'pricing_rules.json')
+        save_rules(rules, path)
+        engine = PricingEngine(path, member_loader=lambda: members)
+        engine.rules()
+
+        starts = np.concatenate([[0], np.cumsum(line_counts)])
+        cart_lines = [[{'species': species[s], 'price': float(base_prices[s]), 'quantity': int(q)}
+                       for s, q in zip(line_species[a:b], quantities[a:b])]
+                      for a, b in zip(starts[:-1], starts[1:])]
+
+        started = time.perf_counter()
+        totals = [engine.price(lines, customer=customer)['total'] for lines, customer in zip(cart_lines, customers)]
+        per_cart_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        batch = engine.price_batch(cart_ids, np.array(species, dtype=object)[line_species], quantities,
+                                   base_prices[line_species], customers == 'member1')
+        batch_seconds = time.perf_counter() - started
+
+    return {
+        'carts': carts,
+        'lines': int(cart_ids.size),
+        'per_cart_seconds': round(per_cart_seconds, 3),
+        'per_cart_us': round(per_cart_seconds / carts * 1e6, 2),
+        'batch_seconds': round(batch_seconds, 3),
+        'batch_us_per_cart': round(batch_seconds / carts * 1e6, 3),
+        'max_total_difference': float(np.max(np.abs(np.array(totals) - batch['total'])))
+    }
+
+def _premium_members():
+    from modules.premium_system import get_premium_usernames
+    return get_premium_usernames()
+
+_ENGINE = {}
+
+def get_pricing_engine():
+    """Get the shared pricing engine for this process"""
+    if 'engine' not in _ENGINE:
+        _ENGINE['engine'] = PricingEngine(member_loader=_premium_members)
+    return _ENGINE['engine']
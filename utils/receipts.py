@@ -0,0 +1,569 @@
+"""
+POS receipts
+Each completed order's receipt is stored once in receipts.jsonl together with the
+business settings it was printed under, so a reprint matches the original. Layouts
+are compiled once per settings combination and cached; rendering a receipt only
+formats its lines. Large reprint batches (PDF or ESC/POS thermal) run on a
+background worker so terminals are never blocked
+"""
+
+import os
+import json
+import html
+import time
+import queue
+import threading
+import datetime
+import functools
+import pandas as pd
+from utils.csv_index import get_csv_index
+from utils.csv_handlers import STORAGE_DIR
+
+RECEIPTS_DIR = os.path.join(STORAGE_DIR, 'pos')
+RECEIPTS_FILE = 'receipts.jsonl'
+RECEIPT_OUTPUT_DIR = os.path.join(STORAGE_DIR, 'pos', 'receipts')
+RECEIPT_SETTINGS_FILE = os.path.join(STORAGE_DIR, 'pos', 'receipt_settings.json')
+RECEIPT_FORMATS = ['pdf', 'escpos']
+
+DEFAULT_RECEIPT_SETTINGS = {
+    'business_name': 'Butterfly Haven',
+    'business_address': '',
+    'footer': 'Thank you for your purchase!',
+    'width': 42
+}
+
+# Receipts loaded per step of a batch job
+BATCH_CHUNK = 500
+
+# ESC/POS control sequences
+ESC_INIT = b'\x1b@'
+ESC_ALIGN_LEFT = b'\x1ba\x00'
+ESC_ALIGN_CENTER = b'\x1ba\x01'
+ESC_BOLD_ON = b'\x1bE\x01'
+ESC_BOLD_OFF = b'\x1bE\x00'
+ESC_FEED_CUT = b'\x1dVB\x03'
+
+def load_receipt_settings(path=RECEIPT_SETTINGS_FILE):
+    """Saved receipt settings merged over the defaults"""
+    settings = dict(DEFAULT_RECEIPT_SETTINGS)
+    if os.path.exists(path):
+        try:
+            with open(path, 'r') as f:
+                settings.update(json.load(f))
+        except Exception:
+            pass
+    return settings
+
+def save_receipt_settings(settings, path=RECEIPT_SETTINGS_FILE):
+    """Persist receipt settings atomically"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(settings, f, indent=2)
+    os.replace(tmp_path, path)
+
+def _settings_key(settings):
+    merged = dict(DEFAULT_RECEIPT_SETTINGS, **(settings or {}))
+    return (str(merged['business_name']), str(merged['business_address']),
+            str(merged['footer']), int(merged['width']))
+
+class ReceiptTemplate:
+    """
+    Receipt layout for one set of business settings
+
+    Header and footer blocks for every output format are built here once;
+    render calls only format the order details and lines.
+    """
+
+    def __init__(self, business_name, business_address, footer, width):
+        self.width = width
+        address_lines = [line.strip() for line in business_address.splitlines() if line.strip()]
+        footer_lines = [line.strip() for line in footer.splitlines() if line.strip()]
+
+        address_html = ''.join(f'<p style="text-align: center; margin: 0;">{html.escape(line)}</p>'
+                               for line in address_lines)
+        self.html_head = ('<div style="border: 1px solid #ccc; padding: 20px; margin: 10px 0; font-family: monospace;">'
+                          f'<h3 style="text-align: center;">🦋 {html.escape(business_name)}</h3>'
+                          f'{address_html}<p style="text-align: center;">Sales Receipt</p><hr>')
+        footer_html = ''.join(f'<p style="text-align: center;">{html.escape(line)}</p>' for line in footer_lines)
+        self.html_foot = f'<hr>{footer_html}</div>'
+
+        rule = '-' * width
+        self.text_head = [business_name.center(width)] + [line.center(width) for line in address_lines] + \
+            ['Sales Receipt'.center(width), rule]
+        self.text_foot = [rule] + [line.center(width) for line in footer_lines]
+        self.rule = rule
+
+        self.escpos_head = (ESC_INIT + ESC_ALIGN_CENTER + ESC_BOLD_ON + _encode(business_name) + b'\n' + ESC_BOLD_OFF +
+                            b''.join(_encode(line) + b'\n' for line in address_lines) +
+                            b'Sales Receipt\n' + ESC_ALIGN_LEFT + _encode(rule) + b'\n')
+        self.escpos_foot = (_encode(rule) + b'\n' + ESC_ALIGN_CENTER +
+                            b''.join(_encode(line) + b'\n' for line in footer_lines) + ESC_FEED_CUT)
+
+    def _pair(self, left, right):
+        space = max(self.width - len(left) - len(right), 1)
+        return f"{left}{' ' * space}{right}"
+
+    def body_lines(self, receipt):
+        """Order details, lines and totals as fixed-width text"""
+        lines = [
+            f"Order #: {receipt['order_number']}",
+            f"Date: {receipt['date']} {receipt['time']}",
+            f"Cashier: {receipt['cashier']}",
+            f"Customer: {receipt['customer_name']}",
+            self.rule
+        ]
+        for name, quantity, price, subtotal in receipt['lines']:
+            lines.append(str(name)[:self.width])
+            lines.append(self._pair(f"  {quantity} x ${price:.2f}", f"${subtotal:.2f}"))
+        lines.append(self.rule)
+        if receipt.get('discount'):
+            lines.append(self._pair('Discount', f"-${receipt['discount']:.2f}"))
+        if receipt.get('tax'):
+            lines.append(self._pair('Tax', f"${receipt['tax']:.2f}"))
+        lines.append(self._pair('TOTAL', f"${receipt_total(receipt):.2f}"))
+        lines.append(self._pair('Payment', str(receipt['payment_method'])))
+        return lines
+
+    def render_html(self, receipt):
+        parts = [self.html_head,
+                 f"<p><strong>Order #:</strong> {html.escape(receipt['order_number'])}</p>",
+                 f"<p><strong>Date:</strong> {receipt['date']} {receipt['time']}</p>",
+                 f"<p><strong>Cashier:</strong> {html.escape(str(receipt['cashier']))}</p>",
+                 f"<p><strong>Customer:</strong> {html.escape(str(receipt['customer_name']))}</p><hr>"]
+        parts.extend(f"<p>{quantity}x {html.escape(str(name))} @ ${price:.2f} = ${subtotal:.2f}</p>"
+                     for name, quantity, price, subtotal in receipt['lines'])
+        parts.append('<hr>')
+        if receipt.get('discount'):
+            parts.append(f"<p>Discount: -${receipt['discount']:.2f}</p>")
+        if receipt.get('tax'):
+            parts.append(f"<p>Tax: ${receipt['tax']:.2f}</p>")
+        parts.append(f"<p><strong>Total: ${receipt_total(receipt):.2f}</strong></p>"
+                     f"<p><strong>Payment: {html.escape(str(receipt['payment_method']))}</strong></p>")
+        parts.append(self.html_foot)
+        return ''.join(parts)
+
+    def render_text(self, receipt):
+        return self.text_head + self.body_lines(receipt) + self.text_foot
+
+    def render_escpos(self, receipt):
+        return self.escpos_head + b'\n'.join(_encode(line) for line in self.body_lines(receipt)) + b'\n' + self.escpos_foot
+
+@functools.lru_cache(maxsize=32)
+def _compiled_template(key):
+    return ReceiptTemplate(*key)
+
+def compile_template(settings=None):
+    """Cached template for the given receipt settings"""
+    return _compiled_template(_settings_key(settings))
+
+def _encode(text):
+    return str(text).encode('cp437', errors='replace')
+
+def _amounts(frame, columns):
+    """Numeric columns of rows read as text (blank or malformed counts as 0)"""
+    for column in columns:
+        values = frame[column] if column in frame.columns else pd.Series(0, index=frame.index)
+        frame[column] = pd.to_numeric(values, errors='coerce').fillna(0)
+    return frame
+
+def receipt_total(receipt):
+    return float(receipt['total_revenue']) + float(receipt.get('tax') or 0)
+
+def build_receipt(transaction, lines, settings=None):
+    """
+    Receipt record for a committed order
+
+    Args:
+        transaction: Transaction header from the checkout pipeline
+        lines: Lines with name, quantity, price (charged) and subtotal
+        settings: Receipt settings in effect at the sale
+
+    Returns:
+        dict: Receipt record as stored in receipts.jsonl
+    """
+    return {
+        'order_number': transaction['order_number'],
+        'date': transaction['date'],
+        'time': transaction['time'],
+        'cashier': transaction['cashier'],
+        'customer_name': transaction['customer_name'],
+        'payment_method': transaction['payment_method'],
+        'total_revenue': float(transaction['total_revenue']),
+        'discount': float(transaction.get('discount') or 0),
+        'tax': float(transaction.get('tax') or 0),
+        'lines': [[line['name'], int(line['quantity']), float(line['price']), float(line['subtotal'])]
+                  for line in lines],
+        'settings': dict(DEFAULT_RECEIPT_SETTINGS, **(settings or load_receipt_settings()))
+    }
+
+class ReceiptStore:
+    """
+    Append-only receipt file with an in-memory offset index
+
+    The index maps order number to byte offset and is extended by reading
+    only what was appended since the last lookup, so fetching a receipt is a
+    seek and one line read.
+    """
+
+    def __init__(self, directory=RECEIPTS_DIR, filename=RECEIPTS_FILE,
+                 transactions_file='pos_transactions.csv', items_file='pos_items.csv'):
+        self.path = os.path.join(directory, filename)
+        self.transactions_file = transactions_file
+        self.items_file = items_file
+        self.lock = threading.Lock()
+        self.offsets = {}
+        self.indexed_bytes = 0
+
+    def _refresh(self):
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size < self.indexed_bytes:
+            self.offsets, self.indexed_bytes = {}, 0
+        if size == self.indexed_bytes:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self.indexed_bytes)
+            offset = self.indexed_bytes
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    break
+                try:
+                    self.offsets[json.loads(raw)['order_number']] = offset
+                except (ValueError, KeyError):
+                    pass
+                offset += len(raw)
+            self.indexed_bytes = offset
+
+    def save(self, receipt):
+        """Store a receipt unless one already exists for its order"""
+        with self.lock:
+            self._refresh()
+            if receipt['order_number'] in self.offsets:
+                return False
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            record = json.dumps(receipt).encode('utf-8') + b'\n'
+            with open(self.path, 'ab') as f:
+                offset = f.tell()
+                f.write(record)
+            if offset == self.indexed_bytes:
+                self.offsets[receipt['order_number']] = offset
+                self.indexed_bytes = offset + len(record)
+            return True
+
+    def compact(self, cutoff):
+        """
+        Drop receipts of sales dated before cutoff (after retention archived their rows)
+
+        Returns:
+            int: Receipts removed
+        """
+        with self.lock:
+            if not os.path.exists(self.path):
+                return 0
+            removed = 0
+            tmp_path = f"{self.path}.tmp"
+            with open(self.path, 'rb') as src, open(tmp_path, 'wb') as kept:
+                for raw in src:
+                    if not raw.endswith(b'\n'):
+                        break
+                    try:
+                        old = str(json.loads(raw).get('date', '')) < cutoff
+                    except ValueError:
+                        old = False
+                    if old:
+                        removed += 1
+                    else:
+                        kept.write(raw)
+                kept.flush()
+                os.fsync(kept.fileno())
+            if not removed:
+                os.remove(tmp_path)
+                return 0
+            os.replace(tmp_path, self.path)
+            self.offsets, self.indexed_bytes = {}, 0
+            return removed
+
+    def get(self, order_number):
+        """Receipt for an order, or None"""
+        receipts = self.get_many([order_number])
+        return receipts[0] if receipts else None
+
+    def get_many(self, order_numbers):
+        """
+        Receipts for many orders, in the order requested
+
+        Orders recorded before receipts were stored (or synced from remote
+        terminals) are rebuilt from the POS CSV files under current settings.
+        Unknown order numbers are skipped.
+        """
+        with self.lock:
+            self._refresh()
+            found = {}
+            if os.path.exists(self.path):
+                with open(self.path, 'rb') as f:
+                    for order_number in order_numbers:
+                        offset = self.offsets.get(order_number)
+                        if offset is not None and order_number not in found:
+                            f.seek(offset)
+                            found[order_number] = json.loads(f.readline())
+        missing = [order for order in order_numbers if order not in found]
+        if missing:
+            found.update(self._from_csv(missing))
+        return [found[order] for order in order_numbers if order in found]
+
+    def _transactions_index(self):
+        return get_csv_index(self.transactions_file, code_columns=['order_number', 'date', 'time'], date_column='date')
+
+    def _from_csv(self, order_numbers):
+        """Rebuild receipts from only the POS rows of the given orders, located through the row indexes"""
+        wanted = list(dict.fromkeys(order_numbers))
+        transactions = self._transactions_index()
+        rows = transactions.query({'order_number': wanted}, newest_first=False)
+        if rows.size == 0:
+            return {}
+        transactions = _amounts(transactions.read_rows(rows).drop_duplicates('order_number'),
+                                ['total_revenue', 'discount', 'tax'])
+        items = get_csv_index(self.items_file, code_columns=['order_number'], date_column='date')
+        items = _amounts(items.read_rows(items.query({'order_number': wanted}, newest_first=False)),
+                         ['quantity', 'unit_price', 'subtotal_revenue'])
+        lines = {}
+        for row in items.to_dict('records'):
+            lines.setdefault(row['order_number'], []).append(
+                {'name': row['item_name'], 'quantity': row['quantity'], 'price': row['unit_price'],
+                 'subtotal': row['subtotal_revenue']})
+        settings = load_receipt_settings()
+        return {transaction['order_number']: build_receipt(transaction, lines.get(transaction['order_number'], []), settings)
+                for transaction in transactions.to_dict('records')}
+
+    def order_numbers(self, start_date=None, end_date=None):
+        """Order numbers with committed transactions in a date range (inclusive), from the row index"""
+        index = self._transactions_index()
+        rows = index.query(date_from=start_date or None, date_to=end_date or None, newest_first=False)
+        if rows.size == 0:
+            return []
+        keys = pd.DataFrame({column: index.column_values(column, rows) for column in ('date', 'time', 'order_number')})
+        return keys.sort_values(['date', 'time'], kind='stable')['order_number'].drop_duplicates().tolist()
+
+def render_receipt(receipt, fmt='html'):
+    """Render a stored receipt with the template for the settings it was printed under"""
+    template = compile_template(receipt.get('settings'))
+    if fmt == 'html':
+        return template.render_html(receipt)
+    if fmt == 'text':
+        return '\n'.join(template.render_text(receipt))
+    if fmt == 'escpos':
+        return template.render_escpos(receipt)
+    if fmt == 'pdf':
+        return pdf_document([receipt])
+    raise ValueError(f"Unknown receipt format: {fmt}")
+
+def _pdf_text(text):
+    return str(text).replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)').encode('latin-1', errors='replace')
+
+class PdfWriter:
+    """
+    Minimal PDF writer: one Courier page per receipt, sized to its length
+
+    Pages are streamed to the output as they are added; only object offsets
+    are kept in memory, so a batch of thousands of receipts stays small.
+    """
+
+    FONT_SIZE = 8
+    LEADING = 10
+    MARGIN = 14
+
+    def __init__(self, output):
+        self.output = output
+        self.offsets = {}
+        self.pages = []
+        self.next_id = 4
+        self.output.write(b'%PDF-1.4\n')
+        self._object(3, b'<< /Type /Font /Subtype /Type1 /BaseFont /Courier >>')
+
+    def _object(self, object_id, body):
+        self.offsets[object_id] = self.output.tell()
+        self.output.write(f"{object_id} 0 obj\n".encode() + body + b'\nendobj\n')
+
+    def add_page(self, lines, width_chars):
+        width = self.MARGIN * 2 + width_chars * self.FONT_SIZE * 0.6
+        height = self.MARGIN * 2 + len(lines) * self.LEADING
+        content = b''.join([
+            f"BT /F1 {self.FONT_SIZE} Tf {self.LEADING} TL {self.MARGIN} {height - self.MARGIN - self.FONT_SIZE} Td\n".encode(),
+            b''.join(b'(' + _pdf_text(line) + b') Tj T*\n' for line in lines),
+            b'ET'
+        ])
+        page_id, content_id = self.next_id, self.next_id + 1
+        self.next_id += 2
+        self._object(content_id, f"<< /Length {len(content)} >>\nstream\n".encode() + content + b'\nendstream')
+        self._object(page_id, (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width:.1f} {height:.1f}] "
+                               f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>").encode())
+        self.pages.append(page_id)
+
+    def add_receipt(self, receipt):
+        template = compile_template(receipt.get('settings'))
+        self.add_page(template.render_text(receipt), template.width)
+
+    def close(self):
+        kids = ' '.join(f"{page} 0 R" for page in self.pages)
+        self._object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.pages)} >>".encode())
+        self._object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+        xref_offset = self.output.tell()
+        count = self.next_id
+        entries = [b'0000000000 65535 f \n'] + [
+            f"{self.offsets[object_id]:010d} 00000 n \n".encode() if object_id in self.offsets else b'0000000000 65535 f \n'
+            for object_id in range(1, count)]
+        self.output.write(f"xref\n0 {count}\n".encode() + b''.join(entries) +
+                          f"trailer\n<< /Size {count} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+
+def pdf_document(receipts):
+    """Receipts as one PDF document (bytes)"""
+    import io
+    buffer = io.BytesIO()
+    writer = PdfWriter(buffer)
+    for receipt in receipts:
+        writer.add_receipt(receipt)
+    writer.close()
+    return buffer.getvalue()
+
+class ReceiptWorker:
+    """
+    Background generator for batches of receipts
+
+    Jobs are queued and processed one at a time on a daemon thread, loading
+    receipts in chunks and streaming them into a single PDF or ESC/POS file
+    under RECEIPT_OUTPUT_DIR. Progress is kept in jobs for the UI to poll.
+    """
+
+    def __init__(self, store, output_dir=RECEIPT_OUTPUT_DIR, chunk=BATCH_CHUNK):
+        self.store = store
+        self.output_dir = output_dir
+        self.chunk = chunk
+        self.queue = queue.Queue()
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def submit(self, order_numbers, fmt='pdf'):
+        """
+        Queue a batch of receipts for generation
+
+        Returns:
+            str: Job id for polling status()
+        """
+        if fmt not in RECEIPT_FORMATS:
+            raise ValueError(f"Unknown receipt format: {fmt}")
+        job_id = f"receipts_{datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')}"
+        extension = 'pdf' if fmt == 'pdf' else 'bin'
+        with self.lock:
+            self.jobs[job_id] = {'job_id': job_id, 'format': fmt, 'state': 'queued', 'total': len(order_numbers),
+                                 'done': 0, 'path': os.path.join(self.output_dir, f"{job_id}.{extension}"),
+                                 'error': None, 'seconds': None}
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='receipt-worker', daemon=True)
+                self.thread.start()
+        self.queue.put((job_id, list(order_numbers)))
+        return job_id
+
+    def status(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _update(self, job_id, **fields):
+        with self.lock:
+            self.jobs[job_id].update(fields)
+
+    def _run(self):
+        while True:
+            job_id, order_numbers = self.queue.get()
+            try:
+                self.generate(job_id, order_numbers)
+            except Exception as e:
+                self._update(job_id, state='failed', error=str(e))
+            finally:
+                self.queue.task_done()
+
+    def generate(self, job_id, order_numbers):
+        """Write a queued job's output file (runs on the worker thread)"""
+        job = self.status(job_id)
+        started = time.perf_counter()
+        self._update(job_id, state='running')
+        os.makedirs(self.output_dir, exist_ok=True)
+        tmp_path = f"{job['path']}.tmp"
+        with open(tmp_path, 'wb') as output:
+            writer = PdfWriter(output) if job['format'] == 'pdf' else None
+            done = 0
+            for start in range(0, len(order_numbers), self.chunk):
+                receipts = self.store.get_many(order_numbers[start:start + self.chunk])
+                for receipt in receipts:
+                    if writer is not None:
+                        writer.add_receipt(receipt)
+                    else:
+                        output.write(render_receipt(receipt, 'escpos'))
+                done += len(receipts)
+                self._update(job_id, done=done)
+            if writer is not None:
+                writer.close()
+        os.replace(tmp_path, job['path'])
+        self._update(job_id, state='done', total=done, seconds=round(time.perf_counter() - started, 3))
+
+    def wait(self):
+        """Block until every queued job has finished"""
+        self.queue.join()
+
+def benchmark_receipts(receipts=5000, lines_per_receipt=6):
+    """
+    Store, render and batch-print synthetic receipts
+
+    Returns:
+        dict: Seconds for storing, HTML rendering and PDF / ESC/POS batch generation
+    """
+    import tempfile
+    settings = dict(DEFAULT_RECEIPT_SETTINGS, business_address='123 Garden Road\nSan Isidro')
+    with tempfile.TemporaryDirectory() as directory:
+        store = ReceiptStore(directory)
+        started = time.perf_counter()
+        for number in range(receipts):
+            lines = [{'name': f"Butterfly {line}", 'quantity': line + 1, 'price': 25.0, 'subtotal': 25.0 * (line + 1)}
+                     for line in range(lines_per_receipt)]
+            transaction = {'order_number': f"ORD20250101-T1-{number:06d}", 'date': '2025-01-01', 'time': '10:00:00',
+                           'cashier': 'admin', 'customer_name': 'Walk-in Customer', 'payment_method': 'Cash',
+                           'total_revenue': sum(line['subtotal'] for line in lines), 'discount': 0, 'tax': 3.5}
+            store.save(build_receipt(transaction, lines, settings))
+        store_seconds = time.perf_counter() - started
+
+        order_numbers = [f"ORD20250101-T1-{number:06d}" for number in range(receipts)]
+        started = time.perf_counter()
+        for receipt in store.get_many(order_numbers):
+            render_receipt(receipt, 'html')
+        html_seconds = time.perf_counter() - started
+
+        worker = ReceiptWorker(store, os.path.join(directory, 'out'))
+        timings = {}
+        for fmt in RECEIPT_FORMATS:
+            job_id = worker.submit(order_numbers, fmt)
+            worker.wait()
+            job = worker.status(job_id)
+            timings[fmt] = {'seconds': job['seconds'], 'bytes': os.path.getsize(job['path']), 'state': job['state']}
+
+    return {
+        'receipts': receipts,
+        'store_seconds': round(store_seconds, 3),
+        'html_seconds': round(html_seconds, 3),
+        'pdf': timings['pdf'],
+        'escpos': timings['escpos']
+    }
+
+_RECEIPTS = {}
+
+def get_receipt_store():
+    """Get the shared receipt store for this process"""
+    if 'store' not in _RECEIPTS:
+        _RECEIPTS['store'] = ReceiptStore()
+    return _RECEIPTS['store']
+
+def get_receipt_worker():
+    """Get the shared background receipt worker for this process"""
+    if 'worker' not in _RECEIPTS:
+        _RECEIPTS['worker'] = ReceiptWorker(get_receipt_store())
+    return _RECEIPTS['worker']
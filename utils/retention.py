@@ -0,0 +1,480 @@
+"""
+Data retention and archival
+Rows older than a table's retention period are moved out of the live CSV into a
+gzip-compressed archive in one streaming pass: each record is copied either to the
+archive or to a replacement file that is swapped in atomically, so memory use does
+not grow with the table. Rollups survive archival: POS days are closed with a
+Z-report before their rows leave, and aggregate counters keep their all-time totals
+"""
+
+import os
+import csv
+import json
+import gzip
+import time
+import threading
+import datetime
+import contextlib
+import pandas as pd
+from utils.csv_index import get_csv_index
+from utils.csv_handlers import file_lock, STORAGE_DIR
+from utils.aggregate_counters import rebase_counters
+
+RETENTION_DIR = os.path.join(STORAGE_DIR, 'retention')
+ARCHIVE_DIR = os.path.join(STORAGE_DIR, 'archive')
+POLICIES_FILE = os.path.join(RETENTION_DIR, 'policies.json')
+RUNS_FILE = os.path.join(RETENTION_DIR, 'runs.jsonl')
+# One record per table whose live file was replaced, written the moment it happens
+COMMITS_FILE = os.path.join(RETENTION_DIR, 'commits.jsonl')
+JOB_STATE_FILE = os.path.join(RETENTION_DIR, 'job_state.json')
+
+# How often the background job checks whether the daily run is due
+JOB_CHECK_SECONDS = 600
+
+# Archivable tables. pos_items has no policy of its own: its rows leave together
+# with their order headers, using the pos_transactions cutoff.
+RETENTION_TABLES = {
+    'pos_transactions': {'file': 'pos_transactions.csv', 'date_column': 'date', 'z_reports': True},
+    'pos_items': {'file': 'pos_items.csv', 'date_column': 'date', 'linked_to': 'pos_transactions'},
+    'ai_classifications': {'file': 'ai_classifications.csv', 'date_column': 'timestamp',
+                           'counters': 'ai_classifications'},
+    'breeding_log': {'file': 'breeding_log.csv', 'date_column': 'timestamp'}
+}
+POS_TABLES = ['pos_transactions', 'pos_items']
+
+DEFAULT_POLICIES = {
+    'schedule_hour': 2,
+    'tables': {
+        'pos_transactions': {'enabled': False, 'keep_days': 365},
+        'ai_classifications': {'enabled': False, 'keep_days': 180},
+        'breeding_log': {'enabled': False, 'keep_days': 365}
+    }
+}
+
+def load_policies(path=POLICIES_FILE):
+    """Saved retention policies merged over the defaults"""
+    policies = json.loads(json.dumps(DEFAULT_POLICIES))
+    if os.path.exists(path):
+        try:
+            with open(path, 'r') as f:
+                saved = json.load(f)
+            policies['schedule_hour'] = saved.get('schedule_hour', policies['schedule_hour'])
+            for table, policy in saved.get('tables', {}).items():
+                if table in policies['tables']:
+                    policies['tables'][table].update(policy)
+        except Exception:
+            pass
+    return policies
+
+def save_policies(policies, path=POLICIES_FILE):
+    """Persist retention policies atomically"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(policies, f, indent=2)
+    os.replace(tmp_path, path)
+
+def table_policy(policies, table):
+    """Policy governing a table (a linked table follows its parent)"""
+    return policies['tables'][RETENTION_TABLES[table].get('linked_to', table)]
+
+def cutoff_date(keep_days, today=None):
+    """First day that is kept; rows dated before it are archived"""
+    today = today or datetime.date.today()
+    return str(today - datetime.timedelta(days=int(keep_days)))
+
+def plan_retention(policies=None, today=None, tables=None):
+    """
+    Rows each table would archive, from the row indexes (nothing is moved)
+
+    Returns:
+        list: Per-table dicts with the policy, cutoff, total rows, rows to
+              archive and the date range they cover
+    """
+    policies = policies or load_policies()
+    plan = []
+    for table in tables or RETENTION_TABLES:
+        spec = RETENTION_TABLES[table]
+        policy = table_policy(policies, table)
+        cutoff = cutoff_date(policy['keep_days'], today)
+        entry = {'table': table, 'file': spec['file'], 'enabled': bool(policy['enabled']),
+                 'keep_days': int(policy['keep_days']), 'cutoff': cutoff,
+                 'rows': 0, 'rows_to_archive': 0, 'oldest': None, 'newest_archived': None, 'days': []}
+        if os.path.exists(spec['file']):
+            index = get_csv_index(spec['file'], date_column=spec['date_column'])
+            days = index.day_counts()
+            aged = days[days.index < cutoff]
+            entry.update({'rows': len(index), 'rows_to_archive': int(aged.sum()),
+                          'oldest': days.index[0] if len(days) else None,
+                          'newest_archived': aged.index[-1] if len(aged) else None,
+                          'days': aged.index.tolist()})
+        plan.append(entry)
+    return plan
+
+def _record_day(record, date_position):
+    """Date (YYYY-MM-DD bytes) of a raw CSV record, or None"""
+    if b'"' in record:
+        values = next(csv.reader([record.decode('utf-8', errors='replace')]), [])
+        value = values[date_position].encode('utf-8') if date_position < len(values) else b''
+    else:
+        values = record.split(b',', date_position + 1)
+        value = values[date_position] if date_position < len(values) else b''
+    value = value.strip()[:10]
+    return value if len(value) == 10 and value[:4].isdigit() else None
+
+def _fsync(path):
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+
+def _record_commit(result, run_id, commits_file=COMMITS_FILE):
+    """Durably log a table whose live file was just replaced"""
+    os.makedirs(os.path.dirname(commits_file), exist_ok=True)
+    record = dict(result, run_id=run_id, committed_at=datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    with open(commits_file, 'a') as f:
+        f.write(json.dumps(record, default=str) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+def _remove_orphans(archive_dir=ARCHIVE_DIR):
+    """
+    Delete temporary files left by runs that stopped before swapping a live file
+
+    Only .tmp files go: their rows are still in the live file. Finished
+    .csv.gz archives are always kept, since one left by a run that stopped
+    right after its swap holds the only copy of its rows.
+    """
+    for table, spec in RETENTION_TABLES.items():
+        kept_tmp = f"{spec['file']}.retention.tmp"
+        if os.path.exists(kept_tmp):
+            os.remove(kept_tmp)
+        directory = os.path.join(archive_dir, table)
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            if name.endswith('.tmp'):
+                os.remove(os.path.join(directory, name))
+
+def archive_table(table, cutoff, run_id, archive_dir=ARCHIVE_DIR, source=None, commits_file=COMMITS_FILE):
+    """
+    Move rows dated before cutoff from a table into a gzip archive
+
+    One pass over the file copies each record to the archive or to the
+    replacement file; records appended while the pass ran are copied over
+    before the replacement is swapped in, with the file's writers held off
+    from that copy until the swap. Records without a readable date are kept.
+    The archive is finished before the swap and the swap is logged to the
+    commits file straight after, so a later failure never loses either.
+
+    Returns:
+        dict: Rows archived and kept, archive path, bytes before and after
+    """
+    spec = RETENTION_TABLES[table]
+    source = source or spec['file']
+    result = {'table': table, 'cutoff': cutoff, 'archived': 0, 'kept': 0, 'archive': None,
+              'first_day': None, 'last_day': None, 'bytes_before': 0, 'bytes_after': 0}
+    if not os.path.exists(source):
+        return result
+
+    directory = os.path.join(archive_dir, table)
+    os.makedirs(directory, exist_ok=True)
+    archive_tmp = os.path.join(directory, f"{table}_{run_id}.csv.gz.tmp")
+    kept_tmp = f"{source}.retention.tmp"
+    cutoff_bytes = cutoff.encode('utf-8')
+    first_day = last_day = None
+
+    with contextlib.ExitStack() as held:
+        try:
+            with open(source, 'rb') as src, gzip.open(archive_tmp, 'wb', compresslevel=6) as archive, \
+                    open(kept_tmp, 'wb') as kept:
+                header = src.readline()
+                columns = next(csv.reader([header.decode('utf-8')]), [])
+                if spec['date_column'] not in columns:
+                    raise ValueError(f"{source} has no {spec['date_column']} column")
+                date_position = columns.index(spec['date_column'])
+                archive.write(header)
+                kept.write(header)
+
+                scanned = src.tell()
+                record = b''
+                for line in iter(src.readline, b''):
+                    if not line.endswith(b'\n'):
+                        # Partial write in progress; copied with the tail below
+                        break
+                    record += line
+                    if record.count(b'"') % 2:
+                        continue
+                    day = _record_day(record, date_position)
+                    if day is not None and day < cutoff_bytes:
+                        archive.write(record)
+                        result['archived'] += 1
+                        first_day = day if first_day is None or day < first_day else first_day
+                        last_day = day if last_day is None or day > last_day else last_day
+                    else:
+                        kept.write(record)
+                        result['kept'] += 1
+                    scanned += len(record)
+                    record = b''
+
+                if result['archived']:
+                    # Rows appended during the pass are newer than any cutoff
+                    held.enter_context(file_lock(source))
+                    src.seek(scanned)
+                    for chunk in iter(lambda: src.read(1 << 20), b''):
+                        kept.write(chunk)
+                    kept.flush()
+                    os.fsync(kept.fileno())
+                    result['bytes_before'] = src.tell()
+            if result['archived']:
+                _fsync(archive_tmp)
+        except BaseException:
+            for path in (archive_tmp, kept_tmp):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+
+        if not result['archived']:
+            os.remove(archive_tmp)
+            os.remove(kept_tmp)
+            result['bytes_before'] = result['bytes_after'] = os.path.getsize(source)
+            return result
+
+        first_day, last_day = first_day.decode(), last_day.decode()
+        archive_path = os.path.join(directory, f"{table}_{first_day}_{last_day}_{run_id}.csv.gz")
+        os.replace(archive_tmp, archive_path)
+        try:
+            os.replace(kept_tmp, source)
+        except OSError:
+            # The rows never left the live file, so the archive must not survive
+            os.remove(archive_path)
+            os.remove(kept_tmp)
+            raise
+        result.update({'archive': archive_path, 'first_day': first_day, 'last_day': last_day,
+                       'bytes_after': os.path.getsize(source)})
+        _record_commit(result, run_id, commits_file)
+        if spec.get('counters') and source == spec['file']:
+            rebase_counters(spec['counters'], source, result['bytes_before'])
+    return result
+
+def _close_pos_days(days, closed_by):
+    """Issue Z-reports for days about to be archived that were never closed"""
+    from utils.z_reports import close_day, load_z_reports
+    closed = 0
+    for day in days:
+        if not load_z_reports(day=day):
+            close_day(day, closed_by)
+            closed += 1
+    return closed
+
+def run_retention(dry_run=False, run_by='scheduler', policies=None, today=None, tables=None,
+                  archive_dir=ARCHIVE_DIR, runs_file=RUNS_FILE, pipeline=None, commits_file=COMMITS_FILE,
+                  receipts=None):
+    """
+    Apply retention policies
+
+    Each table is committed on its own, so a failure part-way keeps the
+    tables already archived; the run report is written either way, with the
+    error if there was one.
+
+    Args:
+        dry_run: Only report what would be archived
+        run_by: Username (or 'scheduler') recorded with the run
+        tables: Restrict to these tables (default: every enabled table)
+        pipeline: Checkout pipeline to pause while POS files are rewritten
+        receipts: Receipt store compacted along with the POS files
+
+    Returns:
+        dict: Run report with per-table results (or the plan, for a dry run)
+    """
+    policies = policies or load_policies()
+    run_id = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+    started = time.perf_counter()
+    plan = plan_retention(policies, today, tables)
+    report = {'run_id': run_id, 'run_by': run_by, 'dry_run': dry_run,
+              'started_at': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'tables': []}
+
+    try:
+        if dry_run:
+            report['tables'] = [{key: value for key, value in entry.items() if key != 'days'} for entry in plan]
+        else:
+            _remove_orphans(archive_dir)
+            due = {entry['table']: entry for entry in plan if entry['enabled'] and entry['rows_to_archive']}
+            pos_due = [table for table in POS_TABLES if table in due]
+            if 'pos_transactions' in due:
+                report['z_reports_issued'] = _close_pos_days(due['pos_transactions']['days'], run_by)
+
+            for table, entry in due.items():
+                if table in POS_TABLES:
+                    continue
+                report['tables'].append(archive_table(table, entry['cutoff'], run_id, archive_dir,
+                                                      commits_file=commits_file))
+
+            if pos_due:
+                if pipeline is None:
+                    from utils.pos_checkout import get_checkout_pipeline
+                    pipeline = get_checkout_pipeline()
+                if receipts is None:
+                    from utils.receipts import get_receipt_store
+                    receipts = get_receipt_store()
+                cutoff = due[pos_due[0]]['cutoff']
+                # Headers and lines leave together, with checkouts held off meanwhile. The
+                # journal is compacted first: while the rows are still live, a crash at
+                # any point leaves a journal whose replay finds every order already written.
+                with pipeline.exclusive():
+                    report['journal_entries_removed'] = pipeline.compact_journal(cutoff)
+                    for table in pos_due:
+                        report['tables'].append(archive_table(table, due[table]['cutoff'], run_id, archive_dir,
+                                                              commits_file=commits_file))
+                report['receipts_removed'] = receipts.compact(cutoff)
+    except Exception as e:
+        report['error'] = str(e)
+        raise
+    finally:
+        report['seconds'] = round(time.perf_counter() - started, 3)
+        os.makedirs(os.path.dirname(runs_file), exist_ok=True)
+        with open(runs_file, 'a') as f:
+            f.write(json.dumps(report, default=str) + '\n')
+    return report
+
+def load_runs(runs_file=RUNS_FILE, limit=20):
+    """Most recent retention runs, newest first"""
+    if not os.path.exists(runs_file):
+        return []
+    with open(runs_file, 'r') as f:
+        lines = f.readlines()[-limit:]
+    runs = []
+    for line in reversed(lines):
+        try:
+            runs.append(json.loads(line))
+        except ValueError:
+            pass
+    return runs
+
+def read_archive(path):
+    """Load an archive file (for restores and audits)"""
+    return pd.read_csv(path, compression='gzip', dtype=str, keep_default_na=False)
+
+class RetentionJob:
+    """
+    Daily retention run on a background thread
+
+    Runs once per day after schedule_hour; the last run date is saved so a
+    restart does not run it again the same day.
+    """
+
+    def __init__(self, state_file=JOB_STATE_FILE, check_seconds=JOB_CHECK_SECONDS):
+        self.state_file = state_file
+        self.check_seconds = check_seconds
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.last_run_day = None
+        self.last_report = None
+        self.last_error = None
+        self._load()
+
+    def _load(self):
+        if os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, 'r') as f:
+                    self.last_run_day = json.load(f).get('last_run_day')
+            except Exception:
+                pass
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+        tmp_path = f"{self.state_file}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'last_run_day': self.last_run_day}, f)
+        os.replace(tmp_path, self.state_file)
+
+    def due(self, now=None):
+        now = now or datetime.datetime.now()
+        return self.last_run_day != str(now.date()) and now.hour >= int(load_policies()['schedule_hour'])
+
+    def run_now(self, dry_run=False, run_by='scheduler'):
+        """Run retention, serialized with the scheduled run"""
+        with self.lock:
+            try:
+                report = run_retention(dry_run=dry_run, run_by=run_by)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                raise
+            if not dry_run:
+                self.last_report = report
+                self.last_run_day = str(datetime.date.today())
+                self._save()
+            return report
+
+    def _run(self):
+        while not self.stopping.is_set():
+            if self.due():
+                try:
+                    self.run_now()
+                except Exception:
+                    pass
+            self.stopping.wait(self.check_seconds)
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run, name='retention-job', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+    def status(self):
+        return {'running': self.running, 'last_run_day': self.last_run_day, 'last_error': self.last_error,
+                'schedule_hour': load_policies()['schedule_hour']}
+
+def benchmark_retention(rows=1_000_000, days=400, keep_days=90):
+    """
+    Archive synthetic classification rows spread over `days` days
+
+    Returns:
+        dict: Rows archived and kept, seconds, bytes before/after and archive size
+    """
+    import tempfile
+    import numpy as np
+    rng = np.random.default_rng(0)
+    today = datetime.date(2025, 6, 1)
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'ai_classifications.csv')
+        offsets = np.sort(rng.integers(0, days, size=rows))[::-1]
+        stamps = (np.datetime64(today) - offsets.astype('timedelta64[D]')).astype(str)
+        pd.DataFrame({'timestamp': np.char.add(stamps, ' 10:00:00'), 'analysis_type': 'Species Identification',
+                      'user': 'admin', 'predicted_species': 'Butterfly-Clippers',
+                      'species_confidence': rng.random(rows).round(4)}).to_csv(source, index=False)
+        started = time.perf_counter()
+        result = archive_table('ai_classifications', cutoff_date(keep_days, today), 'bench',
+                               os.path.join(directory, 'archive'), source=source,
+                               commits_file=os.path.join(directory, 'commits.jsonl'))
+        seconds = time.perf_counter() - started
+        archive_bytes = os.path.getsize(result['archive']) if result['archive'] else 0
+    return {
+        'rows': rows,
+        'archived': result['archived'],
+        'kept': result['kept'],
+        'seconds': round(seconds, 3),
+        'rows_per_second': int(rows / seconds) if seconds else None,
+        'bytes_before': result['bytes_before'],
+        'bytes_after': result['bytes_after'],
+        'archive_bytes': archive_bytes
+    }
+
+_JOB = {}
+
+def get_retention_job():
+    """Get the shared retention job for this process"""
+    if 'job' not in _JOB:
+        _JOB['job'] = RetentionJob()
+    return _JOB['job']
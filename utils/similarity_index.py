@@ -0,0 +1,177 @@
+"""
+Similar-image search over stored classification features
+Cosine top-k over an in-memory NumPy matrix, with an inverted-file (IVF) coarse
+quantizer once the collection grows large
+"""
+
+import os
+import numpy as np
+import streamlit as st
+from utils.feature_store import FeatureStore, get_feature_store
+from utils.csv_handlers import STORAGE_DIR
+
+# Index configuration
+IVF_MIN_ROWS = 20000
+IVF_NPROBE = 8
+KMEANS_ITERATIONS = 10
+EMBEDDING_STORE_PREFIX = os.path.join(STORAGE_DIR, 'image_embeddings')
+SPECIES_MODEL_PATH = './model/model_Butterfly_Species.h5'
+
+def _kmeans(vectors, n_clusters, iterations=KMEANS_ITERATIONS, seed=0):
+    """
+    Spherical k-means on L2-normalized vectors
+
+    Args:
+        vectors: (n, d) float32 array of unit vectors
+        n_clusters: Number of centroids
+        iterations: Lloyd iterations
+        seed: Random seed for centroid initialization
+
+    Returns:
+        numpy.ndarray: (n_clusters, d) unit centroids
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # Keep the previous centroid for clusters that lost all members
+        empty = norms[:, 0] == 0
+        sums[empty] = centroids[empty]
+        norms[empty] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+class SimilarityIndex:
+    """Cosine similarity index over a FeatureStore"""
+
+    def __init__(self, store, ivf_min_rows=IVF_MIN_ROWS):
+        self.store = store
+        self.ivf_min_rows = ivf_min_rows
+        self.rows = 0
+        self.mean = None
+        self.scale = None
+        self.vectors = np.empty((0, store.dim), dtype=np.float32)
+        self.centroids = None
+        self.assignments = None
+        self.trained_rows = 0
+
+    def _normalize(self, matrix):
+        """Standardize columns with the index statistics, then L2-normalize rows"""
+        standardized = (np.asarray(matrix, dtype=np.float32) - self.mean) / self.scale
+        norms = np.linalg.norm(standardized, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return standardized / norms
+
+    def refresh(self):
+        """
+        Bring the index up to date with the feature store
+
+        New rows are normalized and appended incrementally; statistics and
+        IVF centroids are recomputed only when the collection doubles.
+        """
+        total = len(self.store)
+        if total == self.rows:
+            return
+
+        matrix = self.store.matrix()
+        if self.mean is None or total >= 2 * max(self.trained_rows, 1):
+            self.mean = matrix.mean(axis=0)
+            self.scale = matrix.std(axis=0)
+            self.scale[self.scale == 0] = 1.0
+            self.vectors = self._normalize(matrix)
+            self.trained_rows = total
+            self.centroids = None
+            if total >= self.ivf_min_rows:
+                self.centroids = _kmeans(self.vectors, int(np.sqrt(total)))
+                self.assignments = np.argmax(self.vectors @ self.centroids.T, axis=1)
+        else:
+            new_vectors = self._normalize(matrix[self.rows:total])
+            self.vectors = np.vstack([self.vectors, new_vectors])
+            if self.centroids is not None:
+                new_assignments = np.argmax(new_vectors @ self.centroids.T, axis=1)
+                self.assignments = np.concatenate([self.assignments, new_assignments])
+
+        self.rows = total
+
+    def search(self, vector, k=5, exclude=None, nprobe=IVF_NPROBE):
+        """
+        Find the k most similar stored vectors
+
+        Args:
+            vector: Query feature vector (raw, same layout as the store)
+            k: Number of results
+            exclude: Optional feature id to leave out (the query itself)
+            nprobe: IVF lists to scan when the IVF quantizer is active
+
+        Returns:
+            list: (feature_id, cosine_similarity) tuples, most similar first
+        """
+        self.refresh()
+        if self.rows == 0:
+            return []
+
+        query = self._normalize(np.asarray(vector, dtype=np.float32).reshape(1, -1))[0]
+
+        if self.centroids is not None:
+            probe = np.argsort(self.centroids @ query)[::-1][:nprobe]
+            candidates = np.flatnonzero(np.isin(self.assignments, probe))
+        else:
+            candidates = np.arange(self.rows)
+
+        if exclude is not None and exclude >= 0:
+            candidates = candidates[candidates != exclude]
+        if candidates.size == 0:
+            return []
+
+        scores = self.vectors[candidates] @ query
+        k = min(k, scores.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(candidates[i]), float(scores[i])) for i in top]
+
+def load_embedding_model(model_path=SPECIES_MODEL_PATH):
+    """
+    Load a penultimate-layer embedding model from the species classifier
+
+    Args:
+        model_path: Path to the Keras species model
+
+    Returns:
+        Keras model producing penultimate-layer activations, or None when the
+        model file or TensorFlow is not available
+    """
+    if not os.path.exists(model_path):
+        return None
+    try:
+        import tensorflow as tf
+        model = tf.keras.models.load_model(model_path)
+        return tf.keras.Model(inputs=model.inputs, outputs=model.layers[-2].output)
+    except Exception as e:
+        st.warning(f"Embedding model unavailable, using color features: {str(e)}")
+        return None
+
+_INDEX_CACHE = {}
+
+def get_similarity_index(embedding_dim=None):
+    """
+    Get the shared similarity index
+
+    Args:
+        embedding_dim: Size of model embeddings, or None for color features
+
+    Returns:
+        SimilarityIndex: Index over the matching feature store
+    """
+    key = embedding_dim or 'color'
+    index = _INDEX_CACHE.get(key)
+    if index is None:
+        if embedding_dim:
+            store = FeatureStore(EMBEDDING_STORE_PREFIX, [f'emb_{i}' for i in range(embedding_dim)])
+        else:
+            store = get_feature_store()
+        index = SimilarityIndex(store)
+        _INDEX_CACHE[key] = index
+    return index
@@ -0,0 +1,524 @@
+"""
+Task scheduler for breeding operations
+Recurring task schedules generate instances lazily, pending tasks are kept in a
+due-date ordered index for fast due/overdue queries, and batch stage transitions
+create their follow-up tasks automatically
+"""
+
+import os
+import heapq
+import bisect
+import threading
+import datetime
+import pandas as pd
+from utils.csv_handlers import load_from_csv, append_csv_records, bulk_update_csv_records
+from utils.aggregate_counters import get_counters, record_write, rebuild_counters
+
+TASKS_FILE = 'breeding_tasks.csv'
+SCHEDULES_FILE = 'task_schedules.csv'
+
+TASK_COLUMNS = [
+    'task_id', 'title', 'type', 'priority', 'due_date', 'batch_id',
+    'description', 'status', 'created_by', 'created_date', 'completed_date', 'schedule_id'
+]
+SCHEDULE_COLUMNS = [
+    'schedule_id', 'title', 'type', 'priority', 'batch_id', 'description',
+    'interval_days', 'next_due', 'active', 'created_by', 'created_date'
+]
+
+PRIORITY_RANK = {'High': 0, 'Medium': 1, 'Low': 2}
+PRIORITY_NAMES = {rank: name for name, rank in PRIORITY_RANK.items()}
+TASK_COUNTERS = 'breeding_tasks'
+DATE_FORMAT = '%Y-%m-%d'
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Follow-up tasks created when a batch enters a stage: (days after transition, title, type, priority)
+STAGE_TRANSITION_TASKS = {
+    'egg': [
+        (2, "Check eggs for hatching", "Health Check", "Medium")
+    ],
+    'larva': [
+        (0, "Stock host plants for new larvae", "Plant Replacement", "High"),
+        (3, "Larva health check", "Health Check", "Medium")
+    ],
+    'pupa': [
+        (1, "Assess pupae quality", "Quality Assessment", "High"),
+        (7, "Prepare emergence cage", "Cage Cleaning", "Medium")
+    ],
+    'adult': [
+        (0, "Record emergence", "Breeding Record", "High"),
+        (1, "Harvest or release adults", "Harvest", "Medium")
+    ]
+}
+
+# Stages that get a recurring daily feeding schedule for as long as the batch is in them
+FEEDING_SCHEDULE_STAGES = {'larva'}
+# ID prefix of the feeding schedules created for stage transitions; only these end with the stage
+AUTO_SCHEDULE_PREFIX = 'AUTO_SCHED_'
+
+def _today():
+    return datetime.date.today().strftime(DATE_FORMAT)
+
+def _shift(date_str, days):
+    return (datetime.datetime.strptime(date_str, DATE_FORMAT) + datetime.timedelta(days=days)).strftime(DATE_FORMAT)
+
+def _days_between(start_str, end_str):
+    start = datetime.datetime.strptime(start_str, DATE_FORMAT)
+    end = datetime.datetime.strptime(end_str, DATE_FORMAT)
+    return (end - start).days
+
+def _is_date(value):
+    return isinstance(value, str) and len(value) == 10
+
+def build_task_counters(tasks_df):
+    """Compute task counters from a full table scan"""
+    counters = {'tasks': 0, 'status': {}, 'pending_priority': {}}
+    if tasks_df.empty:
+        return counters
+
+    counters['tasks'] = len(tasks_df)
+    counters['status'] = {str(status): int(count) for status, count in tasks_df['status'].value_counts().items()}
+    pending = tasks_df[tasks_df['status'] == 'pending']
+    counters['pending_priority'] = {str(priority): int(count)
+                                    for priority, count in pending['priority'].value_counts().items()}
+    return counters
+
+def _bump(counts, key, amount):
+    counts[key] = counts.get(key, 0) + amount
+    if counts[key] == 0:
+        del counts[key]
+
+def update_task_counters(counters, added_tasks=(), status_changes=()):
+    """
+    Fold task writes into the counters
+
+    Args:
+        counters: Counters from build_task_counters
+        added_tasks: New task dictionaries
+        status_changes: (old status, new status, priority) for updated tasks
+    """
+    for task in added_tasks:
+        counters['tasks'] += 1
+        status = task.get('status', 'pending')
+        _bump(counters['status'], status, 1)
+        if status == 'pending':
+            _bump(counters['pending_priority'], task.get('priority', ''), 1)
+    for old_status, new_status, priority in status_changes:
+        _bump(counters['status'], old_status, -1)
+        _bump(counters['status'], new_status, 1)
+        if old_status == 'pending':
+            _bump(counters['pending_priority'], priority, -1)
+        if new_status == 'pending':
+            _bump(counters['pending_priority'], priority, 1)
+
+def get_task_counters(tasks_file=TASKS_FILE):
+    """Task counters, rebuilt only if the tasks file changed outside the app"""
+    return get_counters(TASK_COUNTERS, tasks_file, build_task_counters)
+
+class TaskScheduler:
+    """
+    Pending task index and recurring schedule runner
+
+    Pending tasks are held as a sorted list of (due_date, priority rank, task_id)
+    so "due by date X" is a bisect plus a slice. Active schedules sit in a
+    min-heap on their next due date, so checking for instances to generate is
+    a peek when nothing is due. Both are rebuilt only when the files change
+    outside the scheduler.
+    """
+
+    def __init__(self, tasks_file=TASKS_FILE, schedules_file=SCHEDULES_FILE):
+        self.tasks_file = tasks_file
+        self.schedules_file = schedules_file
+        self.lock = threading.RLock()
+        self.due_index = []
+        self.pending = {}
+        self.tasks_size = None
+        self.schedule_heap = []
+        self.schedules = {}
+        self.schedules_size = None
+
+    @staticmethod
+    def _file_size(filename):
+        return os.path.getsize(filename) if os.path.exists(filename) else 0
+
+    def _load_tasks(self):
+        """Rebuild the pending index from the tasks file"""
+        tasks_df = load_from_csv(self.tasks_file)
+        self.pending = {}
+        if not tasks_df.empty:
+            pending = tasks_df[tasks_df['status'] == 'pending']
+            for task_id, due_date, priority in zip(pending['task_id'].astype(str),
+                                                    pending['due_date'], pending['priority']):
+                if _is_date(due_date):
+                    self.pending[task_id] = (due_date, PRIORITY_RANK.get(priority, len(PRIORITY_RANK)), task_id)
+        self.due_index = sorted(self.pending.values())
+        self.tasks_size = self._file_size(self.tasks_file)
+
+    def _load_schedules(self):
+        """Rebuild the schedule heap from the schedules file"""
+        schedules_df = load_from_csv(self.schedules_file)
+        self.schedules = {}
+        if not schedules_df.empty:
+            schedules_df = schedules_df.fillna('')
+            active = schedules_df[schedules_df['active'].astype(str) == 'True']
+            for schedule in active.to_dict('records'):
+                schedule['schedule_id'] = str(schedule['schedule_id'])
+                self.schedules[schedule['schedule_id']] = schedule
+        self.schedule_heap = [(schedule['next_due'], schedule_id)
+                              for schedule_id, schedule in self.schedules.items()]
+        heapq.heapify(self.schedule_heap)
+        self.schedules_size = self._file_size(self.schedules_file)
+
+    def _ensure_current(self):
+        if self.tasks_size != self._file_size(self.tasks_file):
+            self._load_tasks()
+        if self.schedules_size != self._file_size(self.schedules_file):
+            self._load_schedules()
+
+    def _index_task(self, task):
+        if task.get('status', 'pending') != 'pending' or not _is_date(task.get('due_date')):
+            return
+        entry = (task['due_date'], PRIORITY_RANK.get(task.get('priority'), len(PRIORITY_RANK)), str(task['task_id']))
+        self.pending[entry[2]] = entry
+        bisect.insort(self.due_index, entry)
+
+    def _unindex_task(self, task_id):
+        entry = self.pending.pop(str(task_id), None)
+        if entry is not None:
+            position = bisect.bisect_left(self.due_index, entry)
+            if position < len(self.due_index) and self.due_index[position] == entry:
+                del self.due_index[position]
+
+    def add_tasks(self, tasks):
+        """
+        Append tasks in one write and index the pending ones
+
+        Args:
+            tasks: List of task dictionaries
+
+        Returns:
+            bool: Success status
+        """
+        if not tasks:
+            return True
+        with self.lock:
+            self._ensure_current()
+            size_before = self._file_size(self.tasks_file)
+            if not append_csv_records(self.tasks_file, tasks, TASK_COLUMNS):
+                return False
+            record_write(TASK_COUNTERS, self.tasks_file, size_before,
+                         lambda counters: update_task_counters(counters, added_tasks=tasks),
+                         build_task_counters)
+            if self.tasks_size != size_before:
+                self._load_tasks()
+                return True
+            for task in tasks:
+                self._index_task(task)
+            self.tasks_size = self._file_size(self.tasks_file)
+            return True
+
+    def complete_tasks(self, task_ids):
+        """
+        Mark tasks as completed in one write
+
+        Returns:
+            int: Number of task rows updated, or -1 on failure
+        """
+        completed_date = datetime.datetime.now().strftime(TIMESTAMP_FORMAT)
+        return self.update_tasks({
+            task_id: {'status': 'completed', 'completed_date': completed_date}
+            for task_id in task_ids
+        })
+
+    def update_tasks(self, changes):
+        """
+        Apply changes keyed by task ID with a single write, keeping the index in step
+
+        Args:
+            changes: Mapping of task_id to field updates
+
+        Returns:
+            int: Number of task rows updated, or -1 on failure
+        """
+        with self.lock:
+            self._ensure_current()
+            size_before = self._file_size(self.tasks_file)
+            updated = bulk_update_csv_records(self.tasks_file, 'task_id', changes, timestamp_column=None)
+            if updated < 0:
+                return updated
+
+            # Deltas need each task's previous status; the pending index knows it for pending tasks
+            status_changes = []
+            for task_id, fields in changes.items():
+                entry = self.pending.get(str(task_id))
+                if entry is None or 'priority' in fields:
+                    status_changes = None
+                    break
+                status_changes.append(('pending', fields.get('status', 'pending'), PRIORITY_NAMES.get(entry[1], '')))
+            if status_changes is None or updated != len(changes) or self.tasks_size != size_before:
+                rebuild_counters(TASK_COUNTERS, self.tasks_file, build_task_counters)
+            else:
+                record_write(TASK_COUNTERS, self.tasks_file, size_before,
+                             lambda counters: update_task_counters(counters, status_changes=status_changes),
+                             build_task_counters)
+
+            if self.tasks_size != size_before or any('due_date' in fields or 'priority' in fields
+                                                    for fields in changes.values()):
+                self._load_tasks()
+                return updated
+            for task_id, fields in changes.items():
+                if fields.get('status', 'pending') != 'pending':
+                    self._unindex_task(task_id)
+            self.tasks_size = self._file_size(self.tasks_file)
+            return updated
+
+    def due_through(self, date_str, limit=None):
+        """
+        Pending task IDs due on or before a date, earliest and most urgent first
+
+        Args:
+            date_str: 'YYYY-MM-DD'
+            limit: Optional maximum number of IDs
+
+        Returns:
+            list: Task IDs
+        """
+        with self.lock:
+            self._ensure_current()
+            end = bisect.bisect_right(self.due_index, (date_str, float('inf')))
+            if limit is not None:
+                end = min(end, limit)
+            return [entry[2] for entry in self.due_index[:end]]
+
+    def count_due_through(self, date_str):
+        """Number of pending tasks due on or before a date"""
+        with self.lock:
+            self._ensure_current()
+            return bisect.bisect_right(self.due_index, (date_str, float('inf')))
+
+    def overdue(self, limit=None):
+        """Pending task IDs due before today"""
+        return self.due_through(_shift(_today(), -1), limit)
+
+    def due_today(self):
+        """Pending task IDs due today"""
+        with self.lock:
+            self._ensure_current()
+            today = _today()
+            start = bisect.bisect_left(self.due_index, (today,))
+            end = bisect.bisect_right(self.due_index, (today, float('inf')))
+            return [entry[2] for entry in self.due_index[start:end]]
+
+    def pending_count(self):
+        with self.lock:
+            self._ensure_current()
+            return len(self.due_index)
+
+    def add_schedule(self, title, task_type, priority, interval_days, start_date,
+                     username, batch_id='', description=''):
+        """
+        Create a recurring task schedule
+
+        Instances are not created up front; generate_recurring materializes
+        them as their due dates arrive.
+
+        Returns:
+            str: Schedule ID, or empty string on failure
+        """
+        now = datetime.datetime.now()
+        schedule = {
+            'schedule_id': f"SCHED_{now.strftime('%Y%m%d_%H%M%S_%f')}",
+            'title': title,
+            'type': task_type,
+            'priority': priority,
+            'batch_id': batch_id,
+            'description': description,
+            'interval_days': int(interval_days),
+            'next_due': start_date,
+            'active': True,
+            'created_by': username,
+            'created_date': now.strftime(TIMESTAMP_FORMAT)
+        }
+        return schedule['schedule_id'] if self.add_schedules([schedule]) else ""
+
+    def add_schedules(self, schedules):
+        """
+        Append schedules in one write and queue them for generation
+
+        Args:
+            schedules: List of schedule dictionaries
+
+        Returns:
+            bool: Success status
+        """
+        if not schedules:
+            return True
+        with self.lock:
+            self._ensure_current()
+            size_before = self._file_size(self.schedules_file)
+            if not append_csv_records(self.schedules_file, schedules, SCHEDULE_COLUMNS):
+                return False
+            if self.schedules_size != size_before:
+                self._load_schedules()
+                return True
+            for schedule in schedules:
+                self.schedules[schedule['schedule_id']] = schedule
+                heapq.heappush(self.schedule_heap, (schedule['next_due'], schedule['schedule_id']))
+            self.schedules_size = self._file_size(self.schedules_file)
+            return True
+
+    def deactivate_schedules(self, schedule_ids):
+        """
+        Stop schedules from generating further instances
+
+        Heap entries are dropped lazily when they reach the top.
+
+        Returns:
+            int: Number of schedules updated, or -1 on failure
+        """
+        schedule_ids = [str(schedule_id) for schedule_id in schedule_ids]
+        if not schedule_ids:
+            return 0
+        with self.lock:
+            self._ensure_current()
+            updated = bulk_update_csv_records(self.schedules_file, 'schedule_id',
+                                              {schedule_id: {'active': False} for schedule_id in schedule_ids},
+                                              timestamp_column=None)
+            if updated >= 0:
+                for schedule_id in schedule_ids:
+                    self.schedules.pop(schedule_id, None)
+                self.schedules_size = self._file_size(self.schedules_file)
+            return updated
+
+    def active_schedules(self):
+        """Active schedules as a DataFrame"""
+        with self.lock:
+            self._ensure_current()
+            return pd.DataFrame(list(self.schedules.values()), columns=SCHEDULE_COLUMNS)
+
+    def generate_recurring(self, through_date=None):
+        """
+        Materialize recurring task instances due on or before a date
+
+        A schedule that fell behind (e.g. nobody opened the app for a week)
+        gets only its most recent missed occurrence, not one task per missed day.
+        Task IDs are derived from schedule and date, so regeneration is idempotent.
+
+        Args:
+            through_date: 'YYYY-MM-DD' (defaults to today)
+
+        Returns:
+            int: Number of task instances created, or -1 on failure
+        """
+        through_date = through_date or _today()
+        with self.lock:
+            self._ensure_current()
+            if not self.schedule_heap or self.schedule_heap[0][0] > through_date:
+                return 0
+
+            tasks, schedule_updates = [], {}
+            while self.schedule_heap and self.schedule_heap[0][0] <= through_date:
+                next_due, schedule_id = heapq.heappop(self.schedule_heap)
+                schedule = self.schedules.get(schedule_id)
+                if schedule is None or schedule['next_due'] != next_due:
+                    continue
+
+                interval = max(int(schedule['interval_days']), 1)
+                missed = _days_between(next_due, through_date) // interval
+                due_date = _shift(next_due, missed * interval)
+                task_id = f"{schedule_id}_{due_date.replace('-', '')}"
+                if task_id not in self.pending:
+                    tasks.append({
+                        'task_id': task_id,
+                        'title': schedule['title'],
+                        'type': schedule['type'],
+                        'priority': schedule['priority'],
+                        'due_date': due_date,
+                        'batch_id': schedule['batch_id'],
+                        'description': schedule['description'],
+                        'status': 'pending',
+                        'created_by': schedule['created_by'],
+                        'created_date': datetime.datetime.now().strftime(TIMESTAMP_FORMAT),
+                        'schedule_id': schedule_id
+                    })
+
+                schedule['next_due'] = _shift(due_date, interval)
+                schedule_updates[schedule_id] = {'next_due': schedule['next_due']}
+                heapq.heappush(self.schedule_heap, (schedule['next_due'], schedule_id))
+
+            if not self.add_tasks(tasks):
+                return -1
+            if schedule_updates:
+                bulk_update_csv_records(self.schedules_file, 'schedule_id', schedule_updates, timestamp_column=None)
+                self.schedules_size = self._file_size(self.schedules_file)
+            return len(tasks)
+
+    def on_stage_transitions(self, transitions, username):
+        """
+        Create follow-up tasks and feeding schedules for batches entering new stages
+
+        Args:
+            transitions: List of (batch_id, old_stage, new_stage); old_stage is None for new batches
+            username: User recorded as the task creator
+
+        Returns:
+            int: Number of tasks created, including newly due recurring instances
+        """
+        today = _today()
+        now = datetime.datetime.now()
+        tasks, schedules, ended_feeding = [], [], []
+
+        for transition, (batch_id, old_stage, new_stage) in enumerate(transitions):
+            if old_stage == new_stage:
+                continue
+            for number, (offset, title, task_type, priority) in enumerate(STAGE_TRANSITION_TASKS.get(new_stage, [])):
+                tasks.append({
+                    'task_id': f"AUTO_{batch_id}_{new_stage}_{now.strftime('%Y%m%d_%H%M%S')}_{number}",
+                    'title': f"{title} ({batch_id})",
+                    'type': task_type,
+                    'priority': priority,
+                    'due_date': _shift(today, offset),
+                    'batch_id': batch_id,
+                    'description': f"Auto-generated: batch moved to {new_stage}",
+                    'status': 'pending',
+                    'created_by': username,
+                    'created_date': now.strftime(TIMESTAMP_FORMAT)
+                })
+            if old_stage in FEEDING_SCHEDULE_STAGES:
+                ended_feeding.append(str(batch_id))
+            if new_stage in FEEDING_SCHEDULE_STAGES:
+                schedules.append({
+                    'schedule_id': f"{AUTO_SCHEDULE_PREFIX}{batch_id}_{now.strftime('%Y%m%d_%H%M%S_%f')}_{transition}",
+                    'title': f"Daily feeding ({batch_id})",
+                    'type': "Feeding",
+                    'priority': "High",
+                    'batch_id': batch_id,
+                    'description': f"Auto-generated: batch in {new_stage} stage",
+                    'interval_days': 1,
+                    'next_due': today,
+                    'active': True,
+                    'created_by': username,
+                    'created_date': now.strftime(TIMESTAMP_FORMAT)
+                })
+
+        with self.lock:
+            if ended_feeding:
+                # Schedules a user set up by hand for the batch are left running
+                self._ensure_current()
+                self.deactivate_schedules([
+                    schedule_id for schedule_id, schedule in self.schedules.items()
+                    if str(schedule['batch_id']) in ended_feeding and str(schedule_id).startswith(AUTO_SCHEDULE_PREFIX)
+                ])
+            self.add_schedules(schedules)
+
+        created = len(tasks) if tasks and self.add_tasks(tasks) else 0
+        # New feeding schedules start today, so their first instance is due now
+        return created + max(self.generate_recurring(), 0)
+
+_SCHEDULER = {}
+
+def get_task_scheduler():
+    """Get the shared task scheduler for this process"""
+    if 'scheduler' not in _SCHEDULER:
+        _SCHEDULER['scheduler'] = TaskScheduler()
+    return _SCHEDULER['scheduler']
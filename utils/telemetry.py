@@ -0,0 +1,572 @@
+"""
+Cage sensor telemetry ingestion
+Temperature and humidity readings per cage are held in fixed-size NumPy ring buffers
+with per-minute rollups in memory and hourly rollups on disk; threshold alerts are
+evaluated on each ingested chunk without rescanning history
+"""
+
+import os
+import glob
+import time
+import queue
+import socketserver
+import threading
+import datetime
+import numpy as np
+import pandas as pd
+from utils.csv_handlers import append_csv_records, load_from_csv, STORAGE_DIR
+from data.butterfly_species_info import ENVIRONMENTAL_REQUIREMENTS
+
+TELEMETRY_DIR = os.path.join(STORAGE_DIR, 'telemetry')
+INBOX_DIR = os.path.join(TELEMETRY_DIR, 'inbox')
+
+METRICS = ['temperature', 'humidity']
+THRESHOLDS = np.array([
+    [ENVIRONMENTAL_REQUIREMENTS['temperature_range']['min'], ENVIRONMENTAL_REQUIREMENTS['temperature_range']['max']],
+    [ENVIRONMENTAL_REQUIREMENTS['humidity_range']['min'], ENVIRONMENTAL_REQUIREMENTS['humidity_range']['max']]
+], dtype=np.float64)
+ALERT_TASK_TYPES = {'temperature': 'Temperature Check', 'humidity': 'Humidity Check'}
+
+RAW_CAPACITY = 1024       # most recent raw readings kept per cage
+MINUTE_CAPACITY = 1440    # 24 hours of minute rollups per cage
+ALERT_CONSECUTIVE = 3     # out-of-range readings in a row before an alert opens
+SAVE_INTERVAL_SECONDS = 30
+DEFAULT_UDP_PORT = 9999
+
+# Rollup row layout: minute start, count, then sum/min/max for each metric
+ROLLUP_FIELDS = ['minute', 'count'] + [f"{metric}_{stat}" for metric in METRICS for stat in ('sum', 'min', 'max')]
+HOURLY_COLUMNS = ['hour', 'batch_id', 'count'] + [f"{metric}_{stat}" for metric in METRICS for stat in ('mean', 'min', 'max')]
+ALERT_COLUMNS = ['timestamp', 'batch_id', 'metric', 'event', 'value', 'min', 'max']
+
+class RingBuffer:
+    """Fixed-capacity 2D ring buffer; extend writes whole chunks with at most two slice copies"""
+
+    def __init__(self, capacity, width):
+        self.data = np.zeros((capacity, width), dtype=np.float64)
+        self.capacity = capacity
+        self.head = 0
+        self.size = 0
+
+    def extend(self, rows):
+        rows = np.asarray(rows, dtype=np.float64)
+        if rows.shape[0] >= self.capacity:
+            rows = rows[-self.capacity:]
+        n = rows.shape[0]
+        first = min(n, self.capacity - self.head)
+        self.data[self.head:self.head + first] = rows[:first]
+        self.data[:n - first] = rows[first:]
+        self.head = (self.head + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    def latest(self, n=None):
+        """Most recent rows in chronological order"""
+        n = self.size if n is None else min(n, self.size)
+        start = (self.head - n) % self.capacity
+        if start + n <= self.capacity:
+            return self.data[start:start + n].copy()
+        return np.concatenate([self.data[start:], self.data[:self.head]])
+
+def _empty_bucket():
+    bucket = np.zeros(len(ROLLUP_FIELDS))
+    bucket[0] = np.nan
+    return bucket
+
+class CageSeries:
+    """Raw readings, minute rollups and alert state for one cage"""
+
+    def __init__(self):
+        self.raw = RingBuffer(RAW_CAPACITY, 1 + len(METRICS))
+        self.minutes = RingBuffer(MINUTE_CAPACITY, len(ROLLUP_FIELDS))
+        self.open_minute = _empty_bucket()
+        self.open_hour = _empty_bucket()
+        self.runs = np.zeros(len(METRICS), dtype=np.int64)
+        self.active = np.zeros(len(METRICS), dtype=bool)
+
+def _rollup_chunk(timestamps, values):
+    """
+    Minute rollups of a time-sorted chunk
+
+    Returns:
+        numpy.ndarray: One ROLLUP_FIELDS row per minute present in the chunk
+    """
+    minutes = np.floor(timestamps / 60.0) * 60.0
+    starts = np.flatnonzero(np.concatenate([[True], minutes[1:] != minutes[:-1]]))
+    rows = np.empty((starts.size, len(ROLLUP_FIELDS)))
+    rows[:, 0] = minutes[starts]
+    rows[:, 1] = np.diff(np.append(starts, minutes.size))
+    for j in range(len(METRICS)):
+        column = values[:, j]
+        rows[:, 2 + 3 * j] = np.add.reduceat(column, starts)
+        rows[:, 3 + 3 * j] = np.minimum.reduceat(column, starts)
+        rows[:, 4 + 3 * j] = np.maximum.reduceat(column, starts)
+    return rows
+
+def _merge_bucket(bucket, row):
+    """Fold a rollup row into an accumulating bucket (same period)"""
+    if np.isnan(bucket[0]):
+        bucket[:] = row
+        return
+    bucket[1] += row[1]
+    for j in range(len(METRICS)):
+        bucket[2 + 3 * j] += row[2 + 3 * j]
+        bucket[3 + 3 * j] = min(bucket[3 + 3 * j], row[3 + 3 * j])
+        bucket[4 + 3 * j] = max(bucket[4 + 3 * j], row[4 + 3 * j])
+
+def _bucket_to_hourly(cage_id, bucket):
+    row = {'hour': datetime.datetime.fromtimestamp(bucket[0]).strftime('%Y-%m-%d %H:00'),
+           'batch_id': cage_id, 'count': int(bucket[1])}
+    for j, metric in enumerate(METRICS):
+        row[f"{metric}_mean"] = round(bucket[2 + 3 * j] / max(bucket[1], 1), 2)
+        row[f"{metric}_min"] = round(bucket[3 + 3 * j], 2)
+        row[f"{metric}_max"] = round(bucket[4 + 3 * j], 2)
+    return row
+
+def _alert_transitions(out_of_range, carried_run, was_active, consecutive):
+    """
+    Streaming debounce over one chunk
+
+    Args:
+        out_of_range: Boolean array for the chunk
+        carried_run: Out-of-range run length at the end of the previous chunk
+        was_active: Whether the alert was open at the end of the previous chunk
+        consecutive: Run length that opens an alert
+
+    Returns:
+        tuple: (opened positions, cleared positions, run length at end, active at end)
+    """
+    positions = np.arange(out_of_range.size)
+    last_in_range = np.maximum.accumulate(np.where(out_of_range, -1, positions))
+    runs = np.where(last_in_range >= 0, positions - last_in_range, carried_run + positions + 1)
+    active = np.concatenate([[was_active], runs >= consecutive])
+    opened = np.flatnonzero(~active[:-1] & active[1:])
+    cleared = np.flatnonzero(active[:-1] & ~active[1:])
+    return opened, cleared, int(runs[-1]), bool(active[-1])
+
+class TelemetryStore:
+    """In-memory time series for all cages with periodic persistence"""
+
+    def __init__(self, telemetry_dir=TELEMETRY_DIR, create_tasks=True):
+        self.telemetry_dir = telemetry_dir
+        self.state_file = os.path.join(telemetry_dir, 'state.npz')
+        self.hourly_file = os.path.join(telemetry_dir, 'rollups_hourly.csv')
+        self.alerts_file = os.path.join(telemetry_dir, 'alerts.csv')
+        self.create_tasks = create_tasks
+        self.lock = threading.RLock()
+        self.cages = {}
+        self.active_alerts = {}
+        self.pending_hourly = []
+        self.pending_alerts = []
+        self.readings_ingested = 0
+        self.last_saved = time.time()
+        self._load_state()
+
+    def ingest(self, cage_ids, timestamps, temperature, humidity):
+        """
+        Ingest a chunk of readings for any number of cages
+
+        Readings are grouped by cage with one sort; each cage then gets a single
+        ring-buffer write, a vectorized minute rollup and a vectorized alert scan.
+        Readings older than a cage's open minute still land in the raw buffer but
+        are left out of its rollups.
+
+        Args:
+            cage_ids: Sequence of batch/cage IDs
+            timestamps: Seconds since epoch
+            temperature: Degrees Celsius
+            humidity: Relative humidity percent
+
+        Returns:
+            int: Number of readings ingested
+        """
+        cage_ids = np.asarray(cage_ids, dtype=str)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        values = np.column_stack([np.asarray(temperature, dtype=np.float64),
+                                  np.asarray(humidity, dtype=np.float64)])
+        if cage_ids.size == 0:
+            return 0
+
+        order = np.lexsort((timestamps, cage_ids))
+        cage_ids, timestamps, values = cage_ids[order], timestamps[order], values[order]
+        boundaries = np.flatnonzero(np.concatenate([[True], cage_ids[1:] != cage_ids[:-1], [True]]))
+
+        with self.lock:
+            for start, end in zip(boundaries[:-1], boundaries[1:]):
+                self._ingest_cage(str(cage_ids[start]), timestamps[start:end], values[start:end])
+            self.readings_ingested += int(cage_ids.size)
+            if time.time() - self.last_saved >= SAVE_INTERVAL_SECONDS:
+                self.flush()
+        return int(cage_ids.size)
+
+    def _ingest_cage(self, cage_id, timestamps, values):
+        series = self.cages.get(cage_id)
+        if series is None:
+            series = self.cages[cage_id] = CageSeries()
+
+        series.raw.extend(np.column_stack([timestamps, values]))
+
+        # Minute rollups; every minute before the chunk's last one is closed
+        in_order = np.isnan(series.open_minute[0]) | (timestamps >= series.open_minute[0])
+        if in_order.any():
+            rows = _rollup_chunk(timestamps[in_order], values[in_order])
+            if not np.isnan(series.open_minute[0]) and rows[0, 0] == series.open_minute[0]:
+                _merge_bucket(series.open_minute, rows[0])
+                rows = rows[1:]
+            for row in rows:
+                self._close_minute(cage_id, series)
+                series.open_minute = row.copy()
+
+        # Threshold alerts
+        for j, metric in enumerate(METRICS):
+            column = values[:, j]
+            out_of_range = (column < THRESHOLDS[j, 0]) | (column > THRESHOLDS[j, 1])
+            if not out_of_range.any() and series.runs[j] == 0:
+                continue
+            opened, cleared, series.runs[j], series.active[j] = _alert_transitions(
+                out_of_range, series.runs[j], series.active[j], ALERT_CONSECUTIVE)
+            for position, event in sorted([(p, 'opened') for p in opened] + [(p, 'cleared') for p in cleared]):
+                self._record_alert(cage_id, metric, event, timestamps[position], column[position], j)
+
+    def _close_minute(self, cage_id, series):
+        """Move the open minute into the ring and roll it into its hour"""
+        bucket = series.open_minute
+        if np.isnan(bucket[0]):
+            return
+        series.minutes.extend(bucket[np.newaxis, :])
+        hour = np.floor(bucket[0] / 3600.0) * 3600.0
+        if not np.isnan(series.open_hour[0]) and series.open_hour[0] != hour:
+            self.pending_hourly.append(_bucket_to_hourly(cage_id, series.open_hour))
+            series.open_hour = _empty_bucket()
+        hour_row = bucket.copy()
+        hour_row[0] = hour
+        _merge_bucket(series.open_hour, hour_row)
+
+    def _record_alert(self, cage_id, metric, event, timestamp, value, metric_index):
+        alert = {
+            'timestamp': datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S'),
+            'batch_id': cage_id,
+            'metric': metric,
+            'event': event,
+            'value': round(float(value), 2),
+            'min': float(THRESHOLDS[metric_index, 0]),
+            'max': float(THRESHOLDS[metric_index, 1])
+        }
+        self.pending_alerts.append(alert)
+        if event == 'opened':
+            self.active_alerts[(cage_id, metric)] = alert
+        else:
+            self.active_alerts.pop((cage_id, metric), None)
+
+    def flush(self):
+        """Persist hourly rollups, alert events and the ring buffers; create alert tasks"""
+        with self.lock:
+            os.makedirs(self.telemetry_dir, exist_ok=True)
+            if self.pending_hourly:
+                append_csv_records(self.hourly_file, self.pending_hourly, HOURLY_COLUMNS)
+                self.pending_hourly = []
+            alerts, self.pending_alerts = self.pending_alerts, []
+            if alerts:
+                append_csv_records(self.alerts_file, alerts, ALERT_COLUMNS)
+            self._save_state()
+            self.last_saved = time.time()
+
+        opened = [alert for alert in alerts if alert['event'] == 'opened']
+        if opened and self.create_tasks:
+            from utils.task_scheduler import get_task_scheduler
+            today = datetime.date.today().strftime('%Y-%m-%d')
+            get_task_scheduler().add_tasks([{
+                'task_id': f"ALERT_{alert['batch_id']}_{alert['metric']}_{alert['timestamp'].replace('-', '').replace(':', '').replace(' ', '_')}",
+                'title': f"{alert['metric'].title()} out of range ({alert['batch_id']})",
+                'type': ALERT_TASK_TYPES[alert['metric']],
+                'priority': 'High',
+                'due_date': today,
+                'batch_id': alert['batch_id'],
+                'description': f"Sensor read {alert['value']} (allowed {alert['min']}-{alert['max']}) at {alert['timestamp']}",
+                'status': 'pending',
+                'created_by': 'telemetry',
+                'created_date': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            } for alert in opened])
+
+    def _save_state(self):
+        """Write all cage buffers to one compressed .npz file"""
+        arrays = {'cage_ids': np.array(list(self.cages.keys()), dtype=str)}
+        for i, series in enumerate(self.cages.values()):
+            arrays[f"raw_{i}"] = series.raw.latest()
+            arrays[f"minutes_{i}"] = series.minutes.latest()
+            arrays[f"open_{i}"] = np.stack([series.open_minute, series.open_hour])
+            arrays[f"alert_{i}"] = np.concatenate([series.runs, series.active.astype(np.int64)])
+        tmp_path = f"{self.state_file}.tmp.npz"
+        np.savez_compressed(tmp_path, **arrays)
+        os.replace(tmp_path, self.state_file)
+
+    def _load_state(self):
+        if not os.path.exists(self.state_file):
+            return
+        try:
+            with np.load(self.state_file) as state:
+                for i, cage_id in enumerate(state['cage_ids']):
+                    series = CageSeries()
+                    series.raw.extend(state[f"raw_{i}"])
+                    series.minutes.extend(state[f"minutes_{i}"])
+                    series.open_minute, series.open_hour = state[f"open_{i}"].copy()
+                    alert_state = state[f"alert_{i}"]
+                    series.runs = alert_state[:len(METRICS)].copy()
+                    series.active = alert_state[len(METRICS):].astype(bool)
+                    self.cages[str(cage_id)] = series
+            alerts_df = load_from_csv(self.alerts_file)
+            if not alerts_df.empty:
+                latest = alerts_df.drop_duplicates(['batch_id', 'metric'], keep='last')
+                for alert in latest[latest['event'] == 'opened'].to_dict('records'):
+                    self.active_alerts[(str(alert['batch_id']), alert['metric'])] = alert
+        except Exception:
+            # A corrupt state file only costs the in-memory history
+            self.cages = {}
+
+    def ingest_lines(self, text, received_at=None):
+        """
+        Ingest 'batch_id,timestamp,temperature,humidity' lines
+
+        An empty timestamp means the time the lines were received.
+
+        Returns:
+            int: Number of readings ingested
+        """
+        received_at = time.time() if received_at is None else received_at
+        cage_ids, timestamps, temperature, humidity = [], [], [], []
+        for line in text.splitlines():
+            parts = line.strip().split(',')
+            if len(parts) != 4 or parts[0] in ('', 'batch_id'):
+                continue
+            try:
+                readings = (float(parts[1]) if parts[1] else received_at, float(parts[2]), float(parts[3]))
+            except ValueError:
+                continue
+            cage_ids.append(parts[0])
+            timestamps.append(readings[0])
+            temperature.append(readings[1])
+            humidity.append(readings[2])
+        return self.ingest(cage_ids, timestamps, temperature, humidity)
+
+    def process_inbox(self, inbox_dir=INBOX_DIR):
+        """
+        Ingest CSV files dropped into the inbox and delete them
+
+        Files need batch_id, timestamp, temperature and humidity columns;
+        timestamps may be epoch seconds or date strings. The store lock is
+        held throughout, so two callers never ingest the same file.
+
+        Returns:
+            int: Number of readings ingested
+        """
+        total = 0
+        with self.lock:
+            for path in sorted(glob.glob(os.path.join(inbox_dir, '*.csv'))):
+                try:
+                    readings = pd.read_csv(path, dtype={'batch_id': str})
+                    timestamps = pd.to_numeric(readings['timestamp'], errors='coerce')
+                    if timestamps.isna().any():
+                        parsed = pd.to_datetime(readings['timestamp'], errors='coerce')
+                        # Resolution-independent seconds; unparseable dates stay NaN and are dropped
+                        timestamps = timestamps.fillna((parsed - pd.Timestamp(0)).dt.total_seconds())
+                    valid = timestamps.notna()
+                    total += self.ingest(readings['batch_id'][valid], timestamps[valid],
+                                         readings['temperature'][valid], readings['humidity'][valid])
+                except FileNotFoundError:
+                    # Taken by another process
+                    continue
+                except Exception:
+                    try:
+                        os.replace(path, f"{path}.rejected")
+                    except OSError:
+                        pass
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        return total
+
+    def cage_overview(self, window_minutes=60):
+        """
+        Latest values, recent minute means and alert state per cage
+
+        Returns:
+            pandas.DataFrame: One row per cage, trend columns hold lists for sparklines
+        """
+        with self.lock:
+            rows = []
+            for cage_id, series in self.cages.items():
+                minutes = series.minutes.latest(window_minutes - 1)
+                if not np.isnan(series.open_minute[0]):
+                    minutes = np.vstack([minutes, series.open_minute])
+                latest = series.raw.latest(1)
+                if latest.size == 0:
+                    continue
+                counts = np.maximum(minutes[:, 1], 1)
+                row = {
+                    'batch_id': cage_id,
+                    'last_reading': datetime.datetime.fromtimestamp(latest[0, 0]).strftime('%Y-%m-%d %H:%M:%S'),
+                    'alerts': ', '.join(metric for j, metric in enumerate(METRICS) if series.active[j])
+                }
+                for j, metric in enumerate(METRICS):
+                    row[metric] = round(float(latest[0, 1 + j]), 1)
+                    row[f"{metric}_trend"] = np.round(minutes[:, 2 + 3 * j] / counts, 2).tolist()
+                rows.append(row)
+            return pd.DataFrame(rows)
+
+    def recent_readings(self, cage_id, n=RAW_CAPACITY):
+        """Raw readings for one cage as a DataFrame indexed by time"""
+        with self.lock:
+            series = self.cages.get(str(cage_id))
+            if series is None:
+                return pd.DataFrame(columns=METRICS)
+            raw = series.raw.latest(n)
+        return pd.DataFrame(raw[:, 1:], columns=METRICS,
+                            index=pd.DatetimeIndex([datetime.datetime.fromtimestamp(t) for t in raw[:, 0]]))
+
+class _ReadingHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.server.readings.put(self.request[0])
+
+class TelemetryListener:
+    """
+    UDP endpoint plus inbox watcher feeding one ingestion worker
+
+    Datagrams carry one or more reading lines. The socket thread only queues
+    payloads; the worker drains the queue every poll interval and ingests it
+    as one chunk, which keeps per-reading overhead low at high rates.
+    """
+
+    def __init__(self, store, host='127.0.0.1', port=DEFAULT_UDP_PORT, poll_interval=0.25):
+        self.store = store
+        self.host = host
+        self.port = port
+        self.poll_interval = poll_interval
+        self.server = None
+        self.stop_event = threading.Event()
+
+    @property
+    def running(self):
+        return self.server is not None
+
+    def start(self):
+        if self.server is not None:
+            return
+        self.stop_event.clear()
+        self.server = socketserver.UDPServer((self.host, self.port), _ReadingHandler)
+        self.server.readings = queue.SimpleQueue()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        threading.Thread(target=self._drain, daemon=True).start()
+
+    def stop(self):
+        if self.server is None:
+            return
+        self.stop_event.set()
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
+
+    def _drain(self):
+        readings = self.server.readings
+        while not self.stop_event.wait(self.poll_interval):
+            payloads = []
+            while True:
+                try:
+                    payloads.append(readings.get_nowait())
+                except queue.Empty:
+                    break
+            if payloads:
+                self.store.ingest_lines(b'\n'.join(payloads).decode('utf-8', errors='ignore'))
+            self.store.process_inbox()
+
+def simulate_readings(cage_ids, seconds=60, interval=1.0, start=None, excursion_rate=0.002, seed=None):
+    """
+    Generate synthetic sensor readings
+
+    Each cage drifts around the optimal conditions with occasional excursions
+    out of range lasting several readings, so alerts open and clear.
+
+    Args:
+        cage_ids: Cage/batch IDs to simulate
+        seconds: Length of the simulated period
+        interval: Seconds between readings per cage
+        start: Start time in epoch seconds (defaults to now - seconds)
+        excursion_rate: Probability per reading that an excursion starts
+        seed: Random seed
+
+    Returns:
+        tuple: (cage_ids, timestamps, temperature, humidity) arrays
+    """
+    rng = np.random.default_rng(seed)
+    start = time.time() - seconds if start is None else start
+    steps = max(int(seconds / interval), 1)
+    cages = np.asarray(cage_ids, dtype=str)
+
+    times = start + np.arange(steps) * interval
+    optimal = np.array([ENVIRONMENTAL_REQUIREMENTS['temperature_range']['optimal'],
+                        ENVIRONMENTAL_REQUIREMENTS['humidity_range']['optimal']])
+    # Mean-reverting drift (AR(1)) plus sensor noise
+    shocks = rng.normal(0, [0.1, 0.5], size=(cages.size, steps, 2))
+    drift = np.zeros_like(shocks)
+    for step in range(1, steps):
+        drift[:, step] = 0.98 * drift[:, step - 1] + shocks[:, step]
+    readings = optimal + drift + rng.normal(0, [0.2, 0.8], size=(cages.size, steps, 2))
+
+    # Excursions: a start flag smeared over the following readings
+    excursions = rng.random((cages.size, steps)) < excursion_rate
+    kernel = np.ones(max(ALERT_CONSECUTIVE * 2, 1))
+    spread = np.apply_along_axis(lambda row: np.convolve(row, kernel)[:steps], 1, excursions.astype(float)) > 0
+    readings[..., 0] += spread * 6.0
+
+    return (np.repeat(cages, steps), np.tile(times, cages.size),
+            readings[..., 0].ravel(), readings[..., 1].ravel())
+
+def send_udp_readings(cage_ids, timestamps, temperature, humidity, host='127.0.0.1',
+                      port=DEFAULT_UDP_PORT, lines_per_datagram=50):
+    """Send readings to a TelemetryListener, batching lines into datagrams"""
+    import socket
+    lines = [f"{c},{t:.3f},{temp:.2f},{hum:.2f}" for c, t, temp, hum in
+             zip(cage_ids, timestamps, temperature, humidity)]
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for i in range(0, len(lines), lines_per_datagram):
+            sock.sendto('\n'.join(lines[i:i + lines_per_datagram]).encode('utf-8'), (host, port))
+    return len(lines)
+
+def benchmark_ingest(cage_count=500, seconds=600, chunk_size=5000, seed=0):
+    """
+    Measure direct ingestion throughput with simulated readings
+
+    Returns:
+        dict: Readings, elapsed seconds and readings per second
+    """
+    import tempfile
+    cages = [f"BENCH_{i}" for i in range(cage_count)]
+    readings = simulate_readings(cages, seconds=seconds, seed=seed)
+    order = np.argsort(readings[1], kind='stable')
+    readings = [array[order] for array in readings]
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = TelemetryStore(directory, create_tasks=False)
+        started = time.perf_counter()
+        for i in range(0, readings[0].size, chunk_size):
+            store.ingest(*(array[i:i + chunk_size] for array in readings))
+        elapsed = time.perf_counter() - started
+
+    return {
+        'readings': int(readings[0].size),
+        'seconds': round(elapsed, 3),
+        'readings_per_second': int(readings[0].size / elapsed)
+    }
+
+_TELEMETRY = {}
+
+def get_telemetry_store():
+    """Get the shared telemetry store for this process"""
+    if 'store' not in _TELEMETRY:
+        _TELEMETRY['store'] = TelemetryStore()
+    return _TELEMETRY['store']
+
+def get_telemetry_listener(port=DEFAULT_UDP_PORT):
+    """Get the shared UDP/inbox listener (not started until start() is called)"""
+    if 'listener' not in _TELEMETRY:
+        _TELEMETRY['listener'] = TelemetryListener(get_telemetry_store(), port=port)
+    return _TELEMETRY['listener']
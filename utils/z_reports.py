@@ -0,0 +1,311 @@
+"""
+End-of-day Z-reports for the POS
+Closing a day reads only that day's rows of pos_transactions.csv and pos_items.csv
+(located through the date-indexed row index) in one chunked pass, totals them per
+terminal, cashier and payment method, and flags orders whose header disagrees with
+its lines. Reports are written once and never modified; closing a day again after
+late sales arrive issues a new numbered report that supersedes the previous one
+"""
+
+import os
+import io
+import json
+import time
+import hashlib
+import threading
+import datetime
+import numpy as np
+import pandas as pd
+from utils.csv_index import get_csv_index
+from utils.csv_handlers import STORAGE_DIR
+
+Z_REPORT_DIR = os.path.join(STORAGE_DIR, 'pos', 'z_reports')
+TRANSACTIONS_FILE = 'pos_transactions.csv'
+ITEMS_FILE = 'pos_items.csv'
+
+# Rows parsed per chunk of the streaming pass
+CHUNK_ROWS = 50_000
+
+# Header and line money totals may differ by rounding up to this much
+MONEY_TOLERANCE = 0.005
+
+BREAKDOWN_KEYS = ['terminal', 'cashier', 'payment_method']
+
+# Closes in this process run one at a time; other processes are handled by the exclusive create
+_CLOSE_LOCK = threading.Lock()
+HEADER_AMOUNTS = ['total_items', 'total_revenue', 'total_cost', 'total_profit', 'discount', 'tax']
+
+class _ChunkStream(io.RawIOBase):
+    """File-like view over an iterator of byte chunks, for pd.read_csv"""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending:
+            self.pending = next(self.chunks, None)
+            if self.pending is None:
+                self.pending = b''
+                return 0
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+def _day_chunks(filename, day, usecols):
+    """Parsed chunks of the rows dated day, streamed from the file"""
+    index = get_csv_index(filename, date_column='date')
+    rows = index.query(date_from=day, date_to=day, newest_first=False)
+    if rows.size == 0:
+        return
+    usecols = [column for column in usecols if column in index.columns]
+    stream = io.BufferedReader(_ChunkStream(index.iter_csv(rows)))
+    yield from pd.read_csv(stream, dtype=str, keep_default_na=False, usecols=usecols, chunksize=CHUNK_ROWS)
+
+def _numeric(frame, columns):
+    for column in columns:
+        if column in frame.columns:
+            frame[column] = pd.to_numeric(frame[column], errors='coerce').fillna(0)
+        else:
+            frame[column] = 0.0
+    return frame
+
+def terminal_of(order_numbers):
+    """Terminal id embedded in order numbers (ORDyyyymmdd-<terminal>-<seq>); older numbers map to 'main'"""
+    return order_numbers.str.extract(r'^ORD\d{8}-(.+)-\d+$', expand=False).fillna('main')
+
+def compute_z_report(day, transactions_file=TRANSACTIONS_FILE, items_file=ITEMS_FILE):
+    """
+    Totals and reconciliation for one day, without writing anything
+
+    Args:
+        day: Business day (date or YYYY-MM-DD)
+
+    Returns:
+        dict: totals, breakdown rows per terminal/cashier/payment method,
+              subtotals per terminal, cashier and payment method, and mismatches
+    """
+    day = str(pd.Timestamp(day).date())
+
+    breakdown_parts, header_parts = [], []
+    transaction_rows = 0
+    for chunk in _day_chunks(transactions_file, day, ['order_number', 'cashier', 'payment_method'] + HEADER_AMOUNTS):
+        transaction_rows += len(chunk)
+        chunk = _numeric(chunk, HEADER_AMOUNTS)
+        chunk['terminal'] = terminal_of(chunk['order_number'])
+        chunk['orders'] = 1
+        breakdown_parts.append(chunk.groupby(BREAKDOWN_KEYS)[['orders'] + HEADER_AMOUNTS].sum())
+        header_parts.append(chunk[['order_number', 'total_items', 'total_revenue']])
+
+    line_parts = []
+    item_rows = 0
+    for chunk in _day_chunks(items_file, day, ['order_number', 'quantity', 'subtotal_revenue']):
+        item_rows += len(chunk)
+        chunk = _numeric(chunk, ['quantity', 'subtotal_revenue'])
+        line_parts.append(chunk.groupby('order_number')[['quantity', 'subtotal_revenue']].sum())
+
+    if breakdown_parts:
+        breakdown = pd.concat(breakdown_parts).groupby(level=BREAKDOWN_KEYS).sum().reset_index()
+    else:
+        breakdown = pd.DataFrame(columns=BREAKDOWN_KEYS + ['orders'] + HEADER_AMOUNTS)
+    breakdown['collected'] = breakdown['total_revenue'] + breakdown['tax']
+
+    headers = (pd.concat(header_parts) if header_parts else
+               pd.DataFrame(columns=['order_number', 'total_items', 'total_revenue']))
+    duplicated = headers['order_number'][headers['order_number'].duplicated()].unique()
+    headers = headers.groupby('order_number')[['total_items', 'total_revenue']].sum()
+    lines = (pd.concat(line_parts).groupby(level=0).sum() if line_parts else
+             pd.DataFrame(columns=['quantity', 'subtotal_revenue'], dtype=float))
+
+    joined = headers.join(lines, how='outer')
+    no_lines = joined['quantity'].isna()
+    no_header = joined['total_items'].isna()
+    joined = joined.fillna(0)
+    items_off = ~no_lines & ~no_header & (joined['total_items'] != joined['quantity'])
+    revenue_off = ~no_lines & ~no_header & ((joined['total_revenue'] - joined['subtotal_revenue']).abs() > MONEY_TOLERANCE)
+
+    mismatches = []
+    for issue, mask in (('header without lines', no_lines), ('lines without header', no_header),
+                        ('total_items differs from line quantities', items_off),
+                        ('total_revenue differs from line subtotals', revenue_off)):
+        for order_number, row in joined[mask].iterrows():
+            mismatches.append({
+                'order_number': order_number,
+                'issue': issue,
+                'header_items': int(row['total_items']),
+                'line_items': int(row['quantity']),
+                'header_revenue': round(float(row['total_revenue']), 2),
+                'line_revenue': round(float(row['subtotal_revenue']), 2)
+            })
+    for order_number in duplicated:
+        mismatches.append({'order_number': order_number, 'issue': 'order recorded more than once',
+                           'header_items': None, 'line_items': None, 'header_revenue': None, 'line_revenue': None})
+
+    amounts = ['orders'] + HEADER_AMOUNTS + ['collected']
+
+    def subtotal(key):
+        return _records(breakdown.groupby(key)[amounts].sum().reset_index())
+
+    return {
+        'day': day,
+        'totals': {column: _plain(breakdown[column].sum()) for column in amounts},
+        'breakdown': _records(breakdown),
+        'by_terminal': subtotal('terminal'),
+        'by_cashier': subtotal('cashier'),
+        'by_payment_method': subtotal('payment_method'),
+        'mismatches': mismatches,
+        'source_rows': {'transactions': transaction_rows, 'items': item_rows}
+    }
+
+def _plain(value):
+    """JSON-friendly number (money rounded to cents)"""
+    value = float(value)
+    return int(value) if value.is_integer() else round(value, 2)
+
+def _records(frame):
+    return [{key: (_plain(value) if isinstance(value, (int, float, np.number)) else value)
+             for key, value in row.items()} for row in frame.to_dict('records')]
+
+def _digest(report):
+    body = {key: value for key, value in report.items() if key != 'digest'}
+    return hashlib.sha256(json.dumps(body, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def load_z_reports(directory=Z_REPORT_DIR, day=None):
+    """
+    Issued Z-reports, newest first
+
+    Args:
+        day: Only reports for this day (date or YYYY-MM-DD)
+
+    Returns:
+        list: Report dicts, each with a 'verified' flag from its digest
+    """
+    if not os.path.isdir(directory):
+        return []
+    prefix = f"Z{pd.Timestamp(day).strftime('%Y%m%d')}-" if day is not None else 'Z'
+    reports = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        if not (name.startswith(prefix) and name.endswith('.json')):
+            continue
+        try:
+            with open(os.path.join(directory, name), 'r') as f:
+                report = json.load(f)
+        except (OSError, ValueError):
+            continue
+        report['verified'] = report.get('digest') == _digest(report)
+        reports.append(report)
+    return reports
+
+def close_day(day, closed_by, directory=Z_REPORT_DIR, transactions_file=TRANSACTIONS_FILE, items_file=ITEMS_FILE):
+    """
+    Issue the Z-report for a day
+
+    If the day already has a report whose totals still match the data, or
+    whose rows have since been archived, that report is returned instead of
+    issuing another one. Concurrent closes of the same day (another session,
+    the retention job or another process) never fail: a close that loses the
+    race for a report number compares against the winner's report and
+    either returns it or takes the next number.
+
+    Returns:
+        tuple: (report dict, issued) where issued is False if an existing report was returned
+    """
+    started = time.perf_counter()
+    with _CLOSE_LOCK:
+        report = compute_z_report(day, transactions_file, items_file)
+        archived = not any(report['source_rows'].values())
+        os.makedirs(directory, exist_ok=True)
+        while True:
+            previous = load_z_reports(directory, report['day'])
+            if previous and (archived or (previous[0]['totals'] == report['totals'] and
+                                          previous[0]['source_rows'] == report['source_rows'])):
+                return previous[0], False
+
+            sequence = previous[0]['sequence'] + 1 if previous else 1
+            report.update({
+                'report_id': f"Z{report['day'].replace('-', '')}-{sequence:02d}",
+                'sequence': sequence,
+                'supersedes': previous[0]['report_id'] if previous else None,
+                'closed_by': closed_by,
+                'closed_at': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'seconds': round(time.perf_counter() - started, 3)
+            })
+            report.pop('verified', None)
+            report['digest'] = _digest(report)
+
+            # 'x' refuses to replace an existing report, so issued reports are never rewritten
+            try:
+                with open(os.path.join(directory, f"{report['report_id']}.json"), 'x') as f:
+                    json.dump(report, f, indent=2, default=str)
+            except FileExistsError:
+                continue
+            report['verified'] = True
+            return report, True
+
+def benchmark_z_report(line_items=100_000, other_days=2, terminals=4, seed=0):
+    """
+    Close a synthetic day with line_items POS lines, among other days' sales
+
+    Returns:
+        dict: Rows scanned, mismatches found (three are planted) and seconds for
+              the first close (index build included) and a re-close
+    """
+    import tempfile
+    from utils.pos_checkout import TRANSACTION_COLUMNS, ITEM_COLUMNS
+    rng = np.random.default_rng(seed)
+    day = datetime.date(2025, 3, 1)
+    with tempfile.TemporaryDirectory() as directory:
+        transactions_file = os.path.join(directory, 'pos_transactions.csv')
+        items_file = os.path.join(directory, 'pos_items.csv')
+        transaction_frames, item_frames = [], []
+        for offset in range(other_days + 1):
+            date = str(day + datetime.timedelta(days=offset))
+            orders = line_items // 3
+            order_ids = np.array([f"ORD{date.replace('-', '')}-T{n % terminals + 1}-{n:06d}" for n in range(orders)])
+            line_order = np.sort(rng.integers(0, orders, size=line_items))
+            quantity = rng.integers(1, 5, size=line_items)
+            price = rng.integers(10, 60, size=line_items).astype(float)
+            items = pd.DataFrame({'order_number': order_ids[line_order], 'date': date, 'time': '12:00:00',
+                                  'item_id': 'BF001', 'item_name': 'Butterfly', 'species': 'Butterfly',
+                                  'quantity': quantity, 'unit_price': price, 'unit_cost': price / 2,
+                                  'subtotal_revenue': price * quantity, 'subtotal_profit': price * quantity / 2,
+                                  'cashier': 'admin'})
+            sums = items.groupby('order_number')[['quantity', 'subtotal_revenue']].sum().reindex(order_ids, fill_value=0)
+            transactions = pd.DataFrame({'order_number': order_ids, 'date': date, 'time': '12:00:00',
+                                         'cashier': np.where(np.arange(orders) % 2, 'admin', 'staff'),
+                                         'customer_name': 'Walk-in Customer', 'customer_email': '',
+                                         'payment_method': np.where(np.arange(orders) % 3, 'Cash', 'GCash'),
+                                         'total_items': sums['quantity'].values,
+                                         'total_revenue': sums['subtotal_revenue'].values,
+                                         'total_cost': sums['subtotal_revenue'].values / 2,
+                                         'total_profit': sums['subtotal_revenue'].values / 2,
+                                         'notes': '', 'discount': 0, 'tax': 0})
+            transaction_frames.append(transactions[sums['quantity'].values > 0])
+            item_frames.append(items)
+        transactions = pd.concat(transaction_frames, ignore_index=True)
+        transactions.loc[0, 'total_items'] += 1
+        transactions.loc[1, 'total_revenue'] += 5
+        transactions = transactions.drop(index=2)
+        transactions[TRANSACTION_COLUMNS].to_csv(transactions_file, index=False)
+        pd.concat(item_frames)[ITEM_COLUMNS].to_csv(items_file, index=False)
+
+        reports = os.path.join(directory, 'z_reports')
+        started = time.perf_counter()
+        report, _ = close_day(day, 'benchmark', reports, transactions_file, items_file)
+        first_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        _, issued_again = close_day(day, 'benchmark', reports, transactions_file, items_file)
+        again_seconds = time.perf_counter() - started
+
+    return {
+        'line_items': report['source_rows']['items'],
+        'transactions': report['source_rows']['transactions'],
+        'mismatches': len(report['mismatches']),
+        'first_close_seconds': round(first_seconds, 3),
+        'reclose_seconds': round(again_seconds, 3),
+        'reissued': issued_again
+    }